@@ -29,15 +29,22 @@ import time
 import numpy as np
 import scipy.cluster.hierarchy as H
 import scipy.cluster.vq as K
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
 from SHE_PPT.logging import getLogger
-from .coordinates import euclidean_metric, get_distance_matrix, get_subregion
+from .coordinates import (DTOR, RTOD, euclidean_metric, get_distance_matrix, get_subregion, haversine_metric,
+                          haversine_metric_deg, radec_to_unit_vectors, )
 
 logger = getLogger(__name__)
 
 # seed for the k means clustering
 RANDOM_SEED = 1
 
+# metrics for which groups can be found with a KD-tree
+KDTREE_METRICS = (euclidean_metric, haversine_metric, haversine_metric_deg)
+
 
 def _find_groups(xs, ys, sep=1., metric=euclidean_metric):
     """returns a list of groups of potential blends. Each group is a list of the array indices of the identified objects
@@ -78,6 +85,98 @@ def _find_groups(xs, ys, sep=1., metric=euclidean_metric):
     return groups
 
 
+def _get_tree_points(xs, ys, sep=1., metric=euclidean_metric):
+    """Converts the objects' coordinates into points (and a search radius) in a space where the metric is the
+    Euclidean distance, so they can be grouped with a KD-tree. For the haversine metrics the points are the unit
+    vectors of the objects on the sphere, and the radius is the chord length corresponding to sep
+
+    Parameters:
+        xs (np.ndarray)  : The x coordinates of the objects
+        ys (np.ndarray)  : The y coordinates of the objects
+        sep (float)      : The maximum separation between objects to count them as belonging to the same group
+        metric(function) : The distance metric to use d=f(x1,y1,x2,y2)
+
+    Returns:
+        points (np.ndarray) : (N, ndim) array of the points, or None if the metric is not supported
+        r (float)           : The search radius for the points
+    """
+
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+
+    if metric is euclidean_metric:
+        return np.stack((xs, ys), axis=-1), sep
+
+    if metric is haversine_metric_deg:
+        sep_rad = sep * DTOR
+        points = radec_to_unit_vectors(xs, ys)
+    elif metric is haversine_metric:
+        sep_rad = sep
+        points = radec_to_unit_vectors(xs * RTOD, ys * RTOD)
+    else:
+        return None, None
+
+    # the chord length between two points on the unit sphere separated by an angle sep
+    r = 2 * np.sin(min(sep_rad, np.pi) / 2)
+
+    return points, r
+
+
+def _find_group_ids(xs, ys, sep=1., metric=euclidean_metric):
+    """Finds all the groups of potential blends in a single pass using a KD-tree to find all the pairs of objects
+    closer than sep, then the connected components of the graph of these pairs (the same groups as found with the
+    single linkage clustering of _find_groups, without constructing the O(N^2) distance matrix). Only the euclidean
+    and haversine metrics are supported.
+
+    Groups are numbered in the order of their lowest-indexed object
+
+    Parameters:
+        xs (np.ndarray)  : The x coordinates of the objects
+        ys (np.ndarray)  : The y coordinates of the objects
+        sep (float)      : The maximum separation between objects to count them as belonging to the same group
+        metric(function) : The distance metric to use (euclidean_metric, haversine_metric or haversine_metric_deg)
+
+    Returns:
+        group_ids (np.ndarray) : int array of the group_id for each object (-1 means ungrouped)
+    """
+
+    points, r = _get_tree_points(xs, ys, sep, metric)
+
+    if points is None:
+        raise ValueError("Metric %s is not supported for KD-tree grouping" % getattr(metric, "__name__", metric))
+
+    n = len(points)
+
+    group_ids = np.full(n, -1, dtype=np.int64)
+
+    if n < 2:
+        return group_ids
+
+    # all pairs of objects within the search radius of each other
+    pairs = cKDTree(points).query_pairs(r, output_type="ndarray")
+
+    if len(pairs) == 0:
+        return group_ids
+
+    # the groups are the connected components of the graph where each pair of objects is an edge
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+
+    # relabel the components with more than one object in them in order of their lowest-indexed object
+    counts = np.bincount(labels)
+    _, first_inds = np.unique(labels, return_index=True)
+
+    grouped_labels = np.where(counts > 1)[0]
+    grouped_labels = grouped_labels[np.argsort(first_inds[grouped_labels])]
+
+    new_labels = np.full(len(counts), -1, dtype=np.int64)
+    new_labels[grouped_labels] = np.arange(len(grouped_labels))
+
+    group_ids[:] = new_labels[labels]
+
+    return group_ids
+
+
 def _all_same(items):
     """Returns True if all the items in the list are identical, False otherwise"""
     return len(set(items)) == 1
@@ -155,23 +254,22 @@ def _merge_grouped(xs, ys, global_groups):
             xs (np.ndarray): The x coordinates of the objects (updated to the COM of the group)
             ys (np.ndarray): The x coordinates of the objects (updated to the COM of the group)
         """
-    n_groups = np.max(global_groups)
+    grouped = global_groups >= 0
 
-    # for each group...
-    for b in range(0, n_groups + 1):
-        # get the indices of the objects
-        inds = np.where(global_groups == b)
+    if not np.any(grouped):
+        return xs, ys
 
-        # get their x and y coordinates
-        x_coords = xs[inds]
-        y_coords = ys[inds]
+    ids = global_groups[grouped]
 
-        # find the mean
-        xc, yc = np.mean(x_coords), np.mean(y_coords)
+    # the number of objects in each group, and the sums of their coordinates
+    counts = np.bincount(ids)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xc = np.bincount(ids, weights=xs[grouped]) / counts
+        yc = np.bincount(ids, weights=ys[grouped]) / counts
 
-        # set them all to the mean
-        xs[inds] = xc
-        ys[inds] = yc
+    # set them all to the mean of their group
+    xs[grouped] = xc[ids]
+    ys[grouped] = yc[ids]
 
     return xs, ys
 
@@ -185,22 +283,69 @@ def identify_all_groups(x, y, sep=1., metric=euclidean_metric, batchsize=2000):
        A group is defined of a set of >1 objects. Ungroupped objects have a group_id of -1,
        whilst the indices for groups begins at 0
 
+       For the euclidean and haversine metrics all the groups are found in a single pass with a KD-tree, and groups
+       are numbered in the order of their lowest-indexed object. For any other metric, the groups are found in
+       overlapping batches of objects using their distance matrices.
+
         Parameters:
             x (np.ndarray) : The list of x coordinates of the objects
             y (np.ndarray) : The list of y coordinates of the objects
             sep (float) : The maximum separation between any two objects to group them together
             metric (function) : The distance metric to use d = f(x1,x2,y1,y2)
-            batchsize (int) : The number of objects to process at once when determining groups
+            batchsize (int) : The number of objects to process at once when determining groups (only used for
+            metrics other than the euclidean and haversine metrics)
 
         Returns:
             xs (np.ndarray) : updated x coordinates of the objects
             ys (np.ndarray) : updated y coordinates of the objects
             group_ids (np.ndarray) : int array of the group_id for each object """
 
-    group_ids = np.zeros(len(x), np.int64) - 1
     xs = np.copy(x)
     ys = np.copy(y)
 
+    logger.info("Grouping objects who have a separation of less than %f" % sep)
+
+    t0 = time.time()
+
+    if metric in KDTREE_METRICS:
+        logger.info("Identifying groups with a KD-tree")
+        group_ids = _find_group_ids(xs, ys, sep, metric=metric)
+        group_count = group_ids.max() + 1 if len(group_ids) > 0 else 0
+    else:
+        group_ids, group_count = _identify_groups_in_batches(xs, ys, sep, metric, batchsize)
+
+    # Now adjust the positions of all grouped objects so they are the centre of mass of ther groups
+    xs, ys = _merge_grouped(xs, ys, group_ids)
+
+    t1 = time.time()
+    n_grouped = len(np.where(group_ids >= 0)[0])
+    n_objs = len(xs)
+    logger.info("Time taken to identify groups = %fs", t1 - t0)
+    logger.info("Total number of grouped objects = %d", n_grouped)
+    logger.info("Total number of groups = %d", group_count)
+    logger.info("Fraction of objects that are grouped = %f", (n_grouped / n_objs))
+    if group_count > 0:
+        logger.info("Mean number of objects per group = %f", (n_grouped / group_count))
+
+    return xs, ys, group_ids
+
+
+def _identify_groups_in_batches(xs, ys, sep, metric, batchsize):
+    """Finds all the grouped objects in overlapping batches of objects, using the distance matrix of each batch.
+
+        Parameters:
+            xs (np.ndarray) : The list of x coordinates of the objects
+            ys (np.ndarray) : The list of y coordinates of the objects
+            sep (float) : The maximum separation between any two objects to group them together
+            metric (function) : The distance metric to use d = f(x1,x2,y1,y2)
+            batchsize (int) : The number of objects to process at once when determining groups
+
+        Returns:
+            group_ids (np.ndarray) : int array of the group_id for each object
+            group_count (int) : The number of groups identified"""
+
+    group_ids = np.zeros(len(xs), np.int64) - 1
+
     # min/max values for x and y
     xmin_global = xs.min()
     xmax_global = xs.max()
@@ -212,7 +357,7 @@ def identify_all_groups(x, y, sep=1., metric=euclidean_metric, batchsize=2000):
     # does mean occasionally identifying the same groups twice... however the function update_grouped deals with this
 
     # calculate the number of batches in each direction
-    nbatches = int(np.ceil(np.sqrt(len(x) / batchsize)))
+    nbatches = int(np.ceil(np.sqrt(len(xs) / batchsize)))
 
     # width of each batch (without padding)
     wx = (xmax_global - xmin_global) / nbatches
@@ -220,12 +365,9 @@ def identify_all_groups(x, y, sep=1., metric=euclidean_metric, batchsize=2000):
 
     group_count = 0
 
-    logger.info("Grouping objects who have a separation of less than %f" % sep)
-
     logger.info("Identifying groups in %d x %d batches", nbatches, nbatches)
 
     # loop over all the batches
-    t0 = time.time()
     for i in range(nbatches):
 
         # calculate xmin and xmax for the batch (with 10% in each direction)
@@ -257,20 +399,7 @@ def identify_all_groups(x, y, sep=1., metric=euclidean_metric, batchsize=2000):
 
             logger.debug("Batch(%d,%d): Number of objects = %d, Number of new groups = %d", i, j, len(xp), new_groups)
 
-    # Now adjust the positions of all grouped objects so they are the centre of mass of ther groups
-    xs, ys = _merge_grouped(xs, ys, group_ids)
-
-    t1 = time.time()
-    n_grouped = len(np.where(group_ids >= 0)[0])
-    n_objs = len(xs)
-    logger.info("Time taken to identify groups = %fs", t1 - t0)
-    logger.info("Total number of grouped objects = %d", n_grouped)
-    logger.info("Total number of groups = %d", group_count)
-    logger.info("Fraction of objects that are grouped = %f", (n_grouped / n_objs))
-    if group_count > 0:
-        logger.info("Mean number of objects per group = %f", (n_grouped / group_count))
-
-    return xs, ys, group_ids
+    return group_ids, group_count
 
 
 def partition_into_batches(xs, ys, batchsize=20, nbatches=None, seed=RANDOM_SEED):
@@ -58,6 +58,45 @@ def haversine_metric_deg(lon1, lat1, lon2, lat2):
     return RTOD * haversine_metric(lon1 * DTOR, lat1 * DTOR, lon2 * DTOR, lat2 * DTOR)
 
 
+def radec_to_unit_vectors(ras, decs):
+    """Converts sky coordinates (in degrees) into Cartesian unit vectors on the celestial sphere
+
+    Parameters:
+        ras (np.ndarray) : array of the right ascensions of the objects
+        decs (np.ndarray) : array of the declinations of the objects
+
+    Returns:
+        vectors (np.ndarray) : array of shape (N, 3) of the unit vectors of the objects
+    """
+
+    ras = np.atleast_1d(np.asarray(ras, dtype=float)) * DTOR
+    decs = np.atleast_1d(np.asarray(decs, dtype=float)) * DTOR
+
+    cos_decs = np.cos(decs)
+
+    return np.stack((cos_decs * np.cos(ras), cos_decs * np.sin(ras), np.sin(decs)), axis=-1)
+
+
+def skycoords_to_unit_vectors(skycoords, frame=None):
+    """Converts a SkyCoord object into Cartesian unit vectors on the celestial sphere
+
+    Parameters:
+        skycoords (astropy.coordinates.SkyCoord) : coordinates of the objects
+        frame (astropy.coordinates.SkyCoord or frame) : if supplied, the frame to transform the coordinates into
+            before converting them
+
+    Returns:
+        vectors (np.ndarray) : array of shape (N, 3) of the unit vectors of the objects
+    """
+
+    if frame is not None and not skycoords.is_equivalent_frame(frame):
+        skycoords = skycoords.transform_to(frame)
+
+    spherical = skycoords.spherical
+
+    return radec_to_unit_vectors(spherical.lon.deg, spherical.lat.deg)
+
+
 def euclidean_metric(x1, y1, x2, y2):
     """Returns the Euclidean distance between two points in two dimensions"""
 
@@ -133,19 +172,13 @@ def get_subregion(x, y, xmin, xmax, ymin, ymax):
         yp (np.ndarray) : List of y coordinates for all the objects in the subregion
         indices (np.ndarray) : int array of indices of the output objects from the input arrays
     """
-    xp = []
-    yp = []
-    indices = []
+    x = np.asarray(x)
+    y = np.asarray(y)
 
-    for i in range(len(x)):
-        if x[i] > xmin and x[i] < xmax and y[i] > ymin and y[i] < ymax:
-            xp.append(x[i])
-            yp.append(y[i])
-            indices.append(i)
+    indices = np.nonzero((x > xmin) & (x < xmax) & (y > ymin) & (y < ymax))[0]
 
-    xp = np.asarray(xp)
-    yp = np.asarray(yp)
-    indices = np.asarray(indices)
+    xp = x[indices]
+    yp = y[indices]
 
     return xp, yp, indices
 
@@ -257,11 +290,15 @@ def skycoords_in_wcs(skycoords, wcs, filter_radius_multiplier=1.25):
     corner_sk = wcs.pixel_to_world(0, 0)
 
     # now get the maximum distance between the centre and the corners (x1.25 buffer)
-    max_sep = centre_sk.separation(corner_sk) * filter_radius_multiplier
+    max_sep = centre_sk.separation(corner_sk).rad * filter_radius_multiplier
 
     # We consider points within max_sep from the centre of the detector as candidate
-    # points to determine if they are in the detector's FOV
-    candidate_indices = skycoords.separation(centre_sk) < max_sep
+    # points to determine if they are in the detector's FOV. Rather than calculating the
+    # separation of every point, we compare the dot product of their unit vectors with that
+    # of the centre to cos(max_sep)
+    centre_vector = skycoords_to_unit_vectors(centre_sk)[0]
+    vectors = skycoords_to_unit_vectors(skycoords, frame=centre_sk)
+    candidate_indices = vectors @ centre_vector > np.cos(min(max_sep, np.pi))
 
     # Now detemrine which candidates are within the detector
     # (can alternatively use WCS.footprint_contains(SkyCoord))
@@ -22,15 +22,22 @@ __updated__ = "2021-08-31"
 # Boston, MA 02110-1301 USA
 
 import abc
+import copy
+import gzip
 import json
 import os
 import pathlib
 import pickle
 import shutil
-import subprocess
+import tarfile
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from os.path import exists, join
-from typing import Any, Callable, Dict, Generic, List, Optional, Sequence, Tuple, Type, TypeVar, Union
+from typing import (Any, BinaryIO, Callable, Dict, Generic, Iterable, List, Optional, Sequence, Tuple, Type, TypeVar,
+                    Union)
 
 import numpy as np
 from astropy.io import fits
@@ -45,13 +52,24 @@ from ElementsServices.DataSync import DataSync
 from ElementsServices.DataSync.DataSynchronizer import DownloadFailed
 from ST_DM_FilenameProvider.FilenameProvider import FileNameProvider
 from ST_DM_DmUtils.DmUtils import read_product_metadata, save_product_metadata
-from . import __version__
+from . import __version__, products
 from .constants.classes import ShearEstimationMethods
 from .constants.misc import DATA_SUBDIR, DEFAULT_WORKDIR, FILENAME_NONE
 from .constants.test_data import SYNC_CONF, TEST_DATADIR
 from .logging import getLogger
 from .utility import get_release_from_version, is_any_type_of_none, join_without_none
 
+# fcntl is only available on Unix systems, where it's used to create reflinks of files when copying them
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# zstandard is optional, and only needed for tar_files with compression="zstd"
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Constant strings for default values in filenames
 DEFAULT_TYPE_NAME = "UNKNOWN-FILE-TYPE"
@@ -86,8 +104,37 @@ MSG_WRITING_FITS_FILE = "Writing FITS file to %s in workdir %s"
 MSG_FINISHED_READING_FITS_FILE = "Finished reading FITS file from %s in workdir %s successfully"
 MSG_FINISHED_WRITING_FITS_FILE = "Finished writing FITS file to %s in workdir %s successfully"
 
+# Maximum number of data products kept in the process-wide product cache
+DEFAULT_PRODUCT_CACHE_SIZE = 256
+
+# Compression options for tar_files ("zstd" requires the zstandard package)
+TAR_COMPRESSION_OPTIONS = (None, "gz", "bz2", "xz", "zstd")
+
+# Number of files tar_files adds to a tarball between flushes to disk (and deletion of the added files, if requested)
+DEFAULT_TAR_CHUNK_SIZE = 64
+
+# Size of the blocks of the tar stream which tar_files compresses independently with "gz" compression
+TAR_GZIP_BLOCK_SIZE = 2 ** 20
+
+# Methods for copying files. COPY_METHOD_AUTO copies data with a reflink or copy_file_range if possible, falling back
+# to a normal copy. COPY_METHOD_HARDLINK creates hard links where possible, which share data with the source files, so
+# shouldn't be used if either might be modified afterwards.
+COPY_METHOD_AUTO = "auto"
+COPY_METHOD_HARDLINK = "hardlink"
+COPY_METHODS = (COPY_METHOD_AUTO, COPY_METHOD_HARDLINK)
+
+# Default number of threads used to copy the files pointed to by data products
+DEFAULT_COPY_MAX_WORKERS = 4
+
+# ioctl request code to clone the data of a file (a reflink), on Linux filesystems which support it, e.g. Btrfs and XFS
+FICLONE = 0x40049409
+
+# Size of the blocks in which files are compared to check if they're identical
+COMPARE_BUFSIZE = 2 ** 20
+
 MSG_SRC_NOT_EXIST = "In safe_copy, source file %s does not exist"
 MSG_DEST_EXIST = "In safe_copy, destination file %s already exists"
+MSG_DEST_IDENTICAL = "In safe_copy, destination file %s already exists and is identical to the source file"
 
 # Constants for strings in xml files
 STR_KEY = '<Key>'
@@ -105,6 +152,8 @@ filename_forbidden_chars = filename_provider.filename_forbidden_chars
 
 logger = getLogger(__name__)
 
+T = TypeVar('T')
+
 
 # Private functions for this module
 
@@ -127,6 +176,37 @@ def _get_optional_log_method(log_info: bool) -> Callable[..., None]:
     return logger.debug
 
 
+def _map_in_order(func: Callable[[Any], T], l_args: Sequence[Any], max_workers: Optional[int] = None) -> List[T]:
+    """Apply a function to each element of a sequence, optionally using a pool of threads, and return a list of the
+    results in the same order as the input sequence. If the function raises an exception for any element, the
+    exception for the first such element is raised, as it would be when applying the function serially.
+
+    Parameters
+    ----------
+    func : Callable[[Any], T]
+        The function to apply to each element.
+    l_args : Sequence[Any]
+        The sequence of elements to apply the function to.
+    max_workers : Optional[int], default=None
+        The maximum number of threads to use. If None or 1, the function is applied serially in the calling thread.
+
+    Returns
+    -------
+    l_results : List[T]
+        The results of applying the function to each element, in order.
+    """
+
+    if max_workers is None or max_workers <= 1 or len(l_args) <= 1:
+        return [func(arg) for arg in l_args]
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(l_args)))
+    try:
+        # `map` yields results in order, and raises any exception when reaching the element which raised it
+        return list(executor.map(func, l_args))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
 # Classes for custom exceptions raised by functions in this module
 
 class SheFileAccessError(IOError):
@@ -1154,6 +1234,9 @@ def _write_xml_product(product: Any, xml_filename: str, workdir: str) -> None:
 
     save_product_metadata(product, qualified_xml_filename)
 
+    # Make sure any cached version of a product previously at this location isn't used
+    product_cache.invalidate(qualified_xml_filename)
+
 
 @deprecated_renamed_argument("allow_pickled",
                              new_name=None,
@@ -1162,7 +1245,8 @@ def read_xml_product(xml_filename: str,
                      workdir: str = ".",
                      log_info: bool = False,
                      allow_pickled: bool = False,
-                     product_type: Optional[Type] = None) -> Any:
+                     product_type: Optional[Type] = None,
+                     use_cache: bool = False) -> Any:
     """Reads in an XML data product defined in the Euclid Data Model Bindings. Before calling this, it is necessary
     that the Data Model Binding class for the expected type of product be imported. It is recommended that this class
     is passed to the kwarg `product_type`, which will check that the product read-in is of this type.
@@ -1184,6 +1268,9 @@ def read_xml_product(xml_filename: str,
     product_type : Optional[Type], default=None
         If not None, this function will check that the product which has been read in is of this type, and raise a
         `TypeError` if not.
+    use_cache : bool, default=False
+        If True, the product will be taken from the process-wide `product_cache` if it has been read in before and
+        its file hasn't changed since, and otherwise added to it. A copy of the cached product is returned.
 
     Returns
     -------
@@ -1199,22 +1286,24 @@ def read_xml_product(xml_filename: str,
 
     try:
 
-        product = _read_xml_product(xml_filename, workdir)
+        product = _read_xml_product(xml_filename, workdir, use_cache=use_cache)
 
     except NamespaceError:
-        # If we hit a namespace error, it likely means the SHE_PPT.products module hasn't been imported.
-        # Try importing it and reading again. Note, this raises PEP8 violation errors, but actually serves a purpose
-        # with how reading data model products work. If we move to requiring the data product type, this can be removed.
-        from . import products  # noqa: F401
-
+        # If we hit a namespace error, it likely means the module in SHE_PPT.products for this type of product hasn't
+        # been imported yet (they're imported lazily). Import it and try reading again.
         try:
-            product = _read_xml_product(xml_filename, workdir)
+            products.load_product_modules_for_xml(find_file(xml_filename, workdir))
+            product = _read_xml_product(xml_filename, workdir, use_cache=use_cache)
         except Exception as e:
             raise SheFileReadError(filename=xml_filename, workdir=workdir) from e
 
     except Exception as e:
         raise SheFileReadError(filename=xml_filename, workdir=workdir) from e
 
+    # The binding for this product may have been imported without going through SHE_PPT.products, so make sure the
+    # SHE_PPT.products module for it has been imported and has initialised it
+    products.load_product_modules_for_binding(type(product).__name__)
+
     # Check the type of the read-in product if `product_type` is not None
     if (product_type is not None) and not isinstance(product, product_type):
         raise TypeError(f"Product read in from file {xml_filename} in directory {workdir} is of type "
@@ -1225,18 +1314,103 @@ def read_xml_product(xml_filename: str,
     return product
 
 
-def _read_xml_product(xml_filename: str, workdir: str) -> Any:
+def _read_xml_product(xml_filename: str, workdir: str, use_cache: bool = False) -> Any:
     """Private implementation of the core functionality of `read_xml_product`. See that function's documentation for
     details on functionality and parameters.
     """
 
     qualified_xml_filename = find_file(xml_filename, workdir)
 
+    if use_cache:
+        return product_cache.read_product(qualified_xml_filename)
+
     product = read_product_metadata(qualified_xml_filename)
 
     return product
 
 
+ProductCacheInfo = namedtuple("ProductCacheInfo", ["hits", "misses", "n_products", "max_size"])
+
+
+class ProductCache:
+    """Process-wide cache of data products read in from `.xml` files, so that a product which is read in several times
+    only needs to be parsed once. Products are keyed on the real path of their file, and are only reused while the
+    file's modification time and size are unchanged. Each read returns a deep copy of the cached product, so that
+    modifying a product which has been read in doesn't affect later reads. The least-recently-used products are
+    discarded to keep the number of cached products within `max_size`.
+
+    Attributes
+    ----------
+    max_size : int
+        The maximum number of products to keep in the cache
+    """
+
+    def __init__(self,
+                 max_size: int = DEFAULT_PRODUCT_CACHE_SIZE):
+
+        self.max_size = max_size
+
+        self._products: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def read_product(self, qualified_filename: str) -> Any:
+        """Reads in a data product from a fully-qualified filename, or gets it from the cache if it's been read in
+        before and its file hasn't changed since, returning a copy of it.
+        """
+
+        realpath = os.path.realpath(qualified_filename)
+        stat_result = os.stat(realpath)
+        file_stamp = (stat_result.st_mtime_ns, stat_result.st_size)
+
+        with self._lock:
+            cached = self._products.get(realpath)
+            if cached is not None and cached[0] == file_stamp:
+                self._hits += 1
+                self._products.move_to_end(realpath)
+                product = cached[1]
+            else:
+                self._misses += 1
+                product = None
+
+        if product is None:
+            # Parse outside of the lock, so that different products can be read in concurrently
+            product = read_product_metadata(qualified_filename)
+
+            with self._lock:
+                self._products[realpath] = (file_stamp, product)
+                self._products.move_to_end(realpath)
+                while len(self._products) > self.max_size:
+                    self._products.popitem(last=False)
+
+        return copy.deepcopy(product)
+
+    def invalidate(self, qualified_filename: str) -> None:
+        """Discards the cached product for a file, if there is one.
+        """
+        with self._lock:
+            self._products.pop(os.path.realpath(qualified_filename), None)
+
+    def cache_info(self) -> ProductCacheInfo:
+        """Returns the hit and miss statistics and current size of the cache.
+        """
+        with self._lock:
+            return ProductCacheInfo(self._hits, self._misses, len(self._products), self.max_size)
+
+    def cache_clear(self) -> None:
+        """Discards all cached products and resets the statistics.
+        """
+        with self._lock:
+            self._products.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+# Process-wide cache used by `read_xml_product` when called with `use_cache=True`
+product_cache = ProductCache()
+
+
 @deprecated(since="9.1",
             alternative="write_xml_product")
 def write_pickled_product(product,
@@ -1585,8 +1759,10 @@ def read_fits(filename: str,
 
 def read_d_l_method_table_filenames(l_product_filenames: Sequence[str],
                                     workdir: str,
-                                    log_info: bool = False) -> Tuple[Dict[ShearEstimationMethods, List[str]],
-                                                                     List[Any]]:
+                                    log_info: bool = False,
+                                    max_workers: Optional[int] = None) -> Tuple[Dict[ShearEstimationMethods,
+                                                                                     List[str]],
+                                                                                List[Any]]:
     """Read in a dict of lists of table filenames for each shear estimation method from a list of measurements product
     filenames. This function is intended for use with lists of data products which each (optionally) contain a
     data table for each shear estimation method.
@@ -1600,6 +1776,9 @@ def read_d_l_method_table_filenames(l_product_filenames: Sequence[str],
         The workdir in which the data exists.
     log_info : bool, default=False
         If True, all logging will be at the INFO level, otherwise some will be at the DEBUG level.
+    max_workers : Optional[int], default=None
+        If greater than 1, the data products will be read concurrently by a pool of up to this many threads. The
+        output is in the same order as when read serially.
 
     Returns
     -------
@@ -1615,16 +1794,16 @@ def read_d_l_method_table_filenames(l_product_filenames: Sequence[str],
     for method in ShearEstimationMethods:
         d_l_method_table_filenames[method] = []
 
-    # Read in the table filenames from each product, for each method
-    l_products: List[Any] = []
-    for product_filename in l_product_filenames:
-
+    def read_product(product_filename: str) -> Any:
         qualified_product_filename: str = get_qualified_filename(product_filename,
                                                                  workdir=workdir)
 
-        product = read_xml_product(qualified_product_filename,
-                                   log_info=log_info)
-        l_products.append(product)
+        return read_xml_product(qualified_product_filename,
+                                log_info=log_info)
+
+    # Read in each product, then the table filenames from each product, for each method
+    l_products: List[Any] = _map_in_order(read_product, l_product_filenames, max_workers=max_workers)
+    for product in l_products:
 
         # Get the list of table filenames for each method and store it if it exists
         for method in ShearEstimationMethods:
@@ -1637,8 +1816,9 @@ def read_d_l_method_table_filenames(l_product_filenames: Sequence[str],
 
 def read_d_l_method_tables(l_product_filenames: Sequence[str],
                            workdir: str,
-                           log_info: bool = False) -> Tuple[Dict[ShearEstimationMethods, List[Table]],
-                                                            List[Any]]:
+                           log_info: bool = False,
+                           max_workers: Optional[int] = None) -> Tuple[Dict[ShearEstimationMethods, List[Table]],
+                                                                       List[Any]]:
     """Read in a dict of lists of tables for each shear estimation method from a list of measurements product
     filenames. This function is intended for use with lists of data products which each (optionally) contain a
     data table for each shear estimation method.
@@ -1652,6 +1832,9 @@ def read_d_l_method_tables(l_product_filenames: Sequence[str],
         The workdir in which the data exists.
     log_info : bool, default=False
         If True, all logging will be at the INFO level, otherwise some will be at the DEBUG level.
+    max_workers : Optional[int], default=None
+        If greater than 1, the data products and tables will be read concurrently by a pool of up to this many
+        threads. The output is in the same order as when read serially.
 
     Returns
     -------
@@ -1665,17 +1848,24 @@ def read_d_l_method_tables(l_product_filenames: Sequence[str],
     (d_l_method_table_filenames,
      l_products) = read_d_l_method_table_filenames(l_product_filenames=l_product_filenames,
                                                    workdir=workdir,
-                                                   log_info=log_info)
+                                                   log_info=log_info,
+                                                   max_workers=max_workers)
 
-    # Load each table into a new dict
-    d_l_method_tables: Dict[ShearEstimationMethods, List[Table]] = {}
+    # Load all tables in one pass, so they can be read concurrently, then sort them into a new dict
+    l_method_filenames: List[Tuple[ShearEstimationMethods, str]] = [(method, filename)
+                                                                    for method in ShearEstimationMethods
+                                                                    for filename in d_l_method_table_filenames[method]]
 
-    for method in ShearEstimationMethods:
-        d_l_method_tables[method] = []
-        for filename in d_l_method_table_filenames[method]:
-            d_l_method_tables[method].append(read_table(filename=filename,
-                                                        workdir=workdir,
-                                                        log_info=log_info))
+    l_tables: List[Table] = _map_in_order(lambda method_filename: read_table(filename=method_filename[1],
+                                                                             workdir=workdir,
+                                                                             log_info=log_info),
+                                          l_method_filenames,
+                                          max_workers=max_workers)
+
+    d_l_method_tables: Dict[ShearEstimationMethods, List[Table]] = {method: [] for method in ShearEstimationMethods}
+
+    for (method, _), table in zip(l_method_filenames, l_tables):
+        d_l_method_tables[method].append(table)
 
     return d_l_method_tables, l_products
 
@@ -1850,23 +2040,104 @@ def try_remove_file(filename: str,
             logger.warning("Unable to delete file %s in workdir %s", filename, workdir)
 
 
-def safe_copy(qualified_src_filename: str,
-              qualified_dest_filename: str,
-              require_src_exist: bool = False,
-              require_dest_free: bool = False) -> None:
-    """Copy a file, without raising an exception if the source doesn't exist or destination does,
-    and making necessary directories.
+CopyReport = namedtuple("CopyReport", ["num_files", "num_copied", "num_skipped", "nbytes", "time"])
 
-    Parameters
-    ----------
-    qualified_src_filename : str
-        The fully-qualified path of the file to be copied.
-    qualified_dest_filename : str
-        The fully-qualified path of where the file at qualified_src_filename should be copied to.
-    require_src_exist : bool, default=False
-        If True, will raise an exception if the source file does not exist.
-    require_dest_free : bool, default=False
-        If True, will raise an exception if the destination file already exists.
+
+def _files_identical(qualified_filename_1: str, qualified_filename_2: str) -> bool:
+    """Checks if two files are identical, first checking their sizes, and then, only if these match, their contents.
+    """
+
+    if os.path.getsize(qualified_filename_1) != os.path.getsize(qualified_filename_2):
+        return False
+    if os.path.samefile(qualified_filename_1, qualified_filename_2):
+        return True
+
+    with open(qualified_filename_1, "rb") as fi1, open(qualified_filename_2, "rb") as fi2:
+        while True:
+            block_1 = fi1.read(COMPARE_BUFSIZE)
+            if block_1 != fi2.read(COMPARE_BUFSIZE):
+                return False
+            if not block_1:
+                return True
+
+
+def _clone_file_data(fi: BinaryIO, fo: BinaryIO) -> Optional[str]:
+    """Tries to copy the data of one open file to another in the kernel, without it passing through user space, first
+    with a reflink (which shares the data blocks until either file is modified), then with `os.copy_file_range`
+    (which may do a server-side copy on network filesystems). Returns the name of the method used if successful, or
+    None if neither is supported for these files.
+    """
+
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+            return "reflink"
+        except OSError:
+            pass
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            nbytes_copied = 0
+            while True:
+                nbytes = os.copy_file_range(fi.fileno(), fo.fileno(), 2 ** 30)
+                if nbytes <= 0:
+                    break
+                nbytes_copied += nbytes
+            # Some filesystems (e.g. procfs, or some FUSE and cross-filesystem copies) report success while copying
+            # nothing, so only trust the copy if all of the file was copied
+            if nbytes_copied == os.fstat(fi.fileno()).st_size:
+                return "copy_file_range"
+        except OSError:
+            pass
+
+        # Reset the files in case anything was copied before the failure
+        fi.seek(0)
+        fo.seek(0)
+        fo.truncate()
+
+    return None
+
+
+def _copy_file_data(qualified_src_filename: str,
+                    qualified_dest_filename: str,
+                    method: str = COPY_METHOD_AUTO) -> str:
+    """Copies a file and its permission bits to a new location, replacing any file already there, with the fastest
+    method available for the requested copy method. Returns the name of the method which was used.
+    """
+
+    # Remove any existing file first, rather than overwriting it, in case it's a hard link to another file
+    if os.path.lexists(qualified_dest_filename):
+        os.remove(qualified_dest_filename)
+
+    if method == COPY_METHOD_HARDLINK:
+        try:
+            os.link(qualified_src_filename, qualified_dest_filename)
+            return "hardlink"
+        except OSError as e:
+            # This will happen if e.g. the files are on different filesystems, so fall back to a copy
+            logger.debug("Cannot hard link %s to %s, so copying it instead: %s",
+                         qualified_src_filename, qualified_dest_filename, e)
+
+    with open(qualified_src_filename, "rb") as fi, open(qualified_dest_filename, "wb") as fo:
+        used_method = _clone_file_data(fi, fo)
+
+    if used_method is None:
+        shutil.copyfile(qualified_src_filename, qualified_dest_filename)
+        used_method = "copy"
+
+    shutil.copymode(qualified_src_filename, qualified_dest_filename)
+
+    return used_method
+
+
+def _copy_file(qualified_src_filename: str,
+               qualified_dest_filename: str,
+               require_src_exist: bool = False,
+               require_dest_free: bool = False,
+               overwrite: bool = False,
+               method: str = COPY_METHOD_AUTO) -> int:
+    """Copies a file if appropriate, implementing the logic of `safe_copy` and `copy_files`. Returns the number of
+    bytes copied, or -1 if the file was skipped.
     """
 
     # Check if the file already exists, and optionally skip if it does
@@ -1877,10 +2148,14 @@ def safe_copy(qualified_src_filename: str,
             raise SheFileWriteError(qualified_filename=qualified_dest_filename,
                                     message=MSG_DEST_EXIST % qualified_dest_filename)
 
-        # We don't require that it's free, so just note in debug log and return
-        logger.debug(MSG_DEST_EXIST, qualified_dest_filename)
-
-        return
+        # If we don't want to overwrite it, or it's the same as the source file, note in debug log and return
+        if not overwrite:
+            logger.debug(MSG_DEST_EXIST, qualified_dest_filename)
+            return -1
+        if os.path.exists(qualified_src_filename) and _files_identical(qualified_src_filename,
+                                                                       qualified_dest_filename):
+            logger.debug(MSG_DEST_IDENTICAL, qualified_dest_filename)
+            return -1
 
     # Check if the source file exists, and optionally skip if it doesn't
     if not os.path.exists(qualified_src_filename):
@@ -1893,20 +2168,143 @@ def safe_copy(qualified_src_filename: str,
         # We don't require that it exists, so just note in debug log and return
         logger.debug(MSG_SRC_NOT_EXIST, qualified_src_filename)
 
-        return
+        return -1
 
     # Make the containing directory for the file
     os.makedirs(os.path.split(qualified_dest_filename)[0], exist_ok=True)
 
     # Now that we know it's safe, copy the file
-    shutil.copy(qualified_src_filename, qualified_dest_filename)
+    used_method = _copy_file_data(qualified_src_filename, qualified_dest_filename, method=method)
+    logger.debug("Copied %s to %s with method: %s", qualified_src_filename, qualified_dest_filename, used_method)
+
+    return os.path.getsize(qualified_dest_filename)
+
+
+def safe_copy(qualified_src_filename: str,
+              qualified_dest_filename: str,
+              require_src_exist: bool = False,
+              require_dest_free: bool = False,
+              overwrite: bool = False,
+              method: str = COPY_METHOD_AUTO) -> None:
+    """Copy a file, without raising an exception if the source doesn't exist or destination does,
+    and making necessary directories.
+
+    Parameters
+    ----------
+    qualified_src_filename : str
+        The fully-qualified path of the file to be copied.
+    qualified_dest_filename : str
+        The fully-qualified path of where the file at qualified_src_filename should be copied to.
+    require_src_exist : bool, default=False
+        If True, will raise an exception if the source file does not exist.
+    require_dest_free : bool, default=False
+        If True, will raise an exception if the destination file already exists.
+    overwrite : bool, default=False
+        If True, the destination file will be replaced if it already exists, unless it is identical to the source
+        file. If False, the copy will be skipped if the destination file already exists.
+    method : str, default=COPY_METHOD_AUTO
+        The method to use to copy the file, one of `COPY_METHODS`.
+    """
+
+    _copy_file(qualified_src_filename=qualified_src_filename,
+               qualified_dest_filename=qualified_dest_filename,
+               require_src_exist=require_src_exist,
+               require_dest_free=require_dest_free,
+               overwrite=overwrite,
+               method=method)
+
+
+def copy_files(l_file_pairs: Sequence[Tuple[str, str]],
+               require_src_exist: bool = False,
+               require_dest_free: bool = False,
+               overwrite: bool = False,
+               method: str = COPY_METHOD_AUTO,
+               max_workers: Optional[int] = DEFAULT_COPY_MAX_WORKERS) -> CopyReport:
+    """Copies a list of files with a pool of threads, with the same logic as `safe_copy` for each, and logs the
+    throughput achieved.
+
+    Parameters
+    ----------
+    l_file_pairs : Sequence[Tuple[str, str]]
+        A sequence of tuples of the fully-qualified source and destination paths of each file to be copied.
+    require_src_exist : bool, default=False
+        If True, will raise an exception if any source file does not exist.
+    require_dest_free : bool, default=False
+        If True, will raise an exception if any destination file already exists.
+    overwrite : bool, default=False
+        If True, destination files will be replaced if they already exist, unless they are identical to the source
+        files. If False, copies will be skipped if the destination files already exist.
+    method : str, default=COPY_METHOD_AUTO
+        The method to use to copy the files, one of `COPY_METHODS`.
+    max_workers : Optional[int], default=DEFAULT_COPY_MAX_WORKERS
+        The maximum number of threads to use to copy files. If None or 1, files will be copied serially.
+
+    Returns
+    -------
+    report : CopyReport
+        A named tuple of the number of files, the number copied and skipped, the number of bytes copied, and the
+        time taken in seconds.
+    """
+
+    if method not in COPY_METHODS:
+        raise ValueError(f"Invalid copy method: {method}. Allowed values are: {COPY_METHODS}")
+
+    # Only copy to each destination once, to avoid multiple threads writing to the same file
+    d_src_filenames = {}
+    for qualified_src_filename, qualified_dest_filename in l_file_pairs:
+        d_src_filenames.setdefault(qualified_dest_filename, qualified_src_filename)
+
+    def copy_file_pair(file_pair: Tuple[str, str]) -> int:
+        return _copy_file(qualified_src_filename=file_pair[0],
+                          qualified_dest_filename=file_pair[1],
+                          require_src_exist=require_src_exist,
+                          require_dest_free=require_dest_free,
+                          overwrite=overwrite,
+                          method=method)
+
+    start_time = time.perf_counter()
+    l_nbytes = _map_in_order(copy_file_pair,
+                             [(qualified_src_filename, qualified_dest_filename)
+                              for qualified_dest_filename, qualified_src_filename in d_src_filenames.items()],
+                             max_workers=max_workers)
+    duration = time.perf_counter() - start_time
+
+    nbytes = sum(n for n in l_nbytes if n >= 0)
+    num_copied = sum(1 for n in l_nbytes if n >= 0)
+
+    report = CopyReport(num_files=len(l_nbytes),
+                        num_copied=num_copied,
+                        num_skipped=len(l_nbytes) - num_copied,
+                        nbytes=nbytes,
+                        time=duration)
+
+    logger.info("Copied %i of %i files (%.1f MB) in %.2f s (%.1f MB/s); skipped %i files",
+                report.num_copied, report.num_files, nbytes / 2 ** 20, duration,
+                nbytes / 2 ** 20 / duration if duration > 0 else 0., report.num_skipped)
+
+    return report
+
+
+def _get_product_file_pairs(product_filename: str,
+                            src_dir: str,
+                            dest_dir: str) -> List[Tuple[str, str]]:
+    """Gets a list of the fully-qualified source and destination paths of each data file pointed to by a data product,
+    when copying it from one directory to another.
+    """
+
+    p = read_xml_product(product_filename, workdir=src_dir, use_cache=True)
+
+    return [(os.path.join(src_dir, filename), os.path.join(dest_dir, filename))
+            for filename in p.get_all_filenames() if not is_any_type_of_none(filename)]
 
 
 def copy_product_between_dirs(product_filename: str,
                               src_dir: str,
                               dest_dir: str,
                               require_all_src_datafiles_exist: bool = False,
-                              require_all_dest_datafiles_free: bool = False) -> str:
+                              require_all_dest_datafiles_free: bool = False,
+                              method: str = COPY_METHOD_AUTO,
+                              max_workers: Optional[int] = DEFAULT_COPY_MAX_WORKERS) -> str:
     """Copies a data product and all files it points to from one directory to another
 
     Parameters
@@ -1922,6 +2320,10 @@ def copy_product_between_dirs(product_filename: str,
     require_all_dest_datafiles_free : bool, default=False
         If True, will raise an exception if any datafile pointed to by the product already exists in the target
         location.
+    method : str, default=COPY_METHOD_AUTO
+        The method to use to copy the files, one of `COPY_METHODS`.
+    max_workers : Optional[int], default=DEFAULT_COPY_MAX_WORKERS
+        The maximum number of threads to use to copy the datafiles. If None or 1, they will be copied serially.
 
     Returns
     -------
@@ -1938,25 +2340,15 @@ def copy_product_between_dirs(product_filename: str,
 
     safe_copy(qualified_src_filename=qualified_product_filename,
               qualified_dest_filename=qualified_copied_product_filename,
-              require_src_exist=True)
-
-    # Read in the product and get all filenames
-    p = read_xml_product(product_filename, workdir=src_dir)
-    l_filenames = p.get_all_filenames()
-
-    for filename in l_filenames:
-
-        if is_any_type_of_none(filename):
-            continue
+              require_src_exist=True,
+              method=method)
 
-        # Copy each file pointed to by this product
-        qualified_filename = os.path.join(src_dir, filename)
-        qualified_copied_filename = os.path.join(dest_dir, filename)
-
-        safe_copy(qualified_src_filename=qualified_filename,
-                  qualified_dest_filename=qualified_copied_filename,
-                  require_src_exist=require_all_src_datafiles_exist,
-                  require_dest_free=require_all_dest_datafiles_free)
+    # Copy each file pointed to by this product
+    copy_files(_get_product_file_pairs(product_filename, src_dir, dest_dir),
+               require_src_exist=require_all_src_datafiles_exist,
+               require_dest_free=require_all_dest_datafiles_free,
+               method=method,
+               max_workers=max_workers)
 
     return qualified_copied_product_filename
 
@@ -1965,7 +2357,9 @@ def copy_listfile_between_dirs(listfile_filename: str,
                                src_dir: str,
                                dest_dir: str,
                                require_all_datafiles_exist: bool = False,
-                               require_all_dest_datafiles_free: bool = False) -> str:
+                               require_all_dest_datafiles_free: bool = False,
+                               method: str = COPY_METHOD_AUTO,
+                               max_workers: Optional[int] = DEFAULT_COPY_MAX_WORKERS) -> str:
     """Copies a listfile, all products it points to, and all datafiles those products point to, from one directory
     to another.
 
@@ -1983,6 +2377,11 @@ def copy_listfile_between_dirs(listfile_filename: str,
     require_all_dest_datafiles_free : bool, default=False
         If True, will raise an exception if any datafile pointed to by the product already exists in the target
         location.
+    method : str, default=COPY_METHOD_AUTO
+        The method to use to copy the files, one of `COPY_METHODS`.
+    max_workers : Optional[int], default=DEFAULT_COPY_MAX_WORKERS
+        The maximum number of threads to use to copy the products and datafiles. If None or 1, they will be copied
+        serially.
 
     Returns
     -------
@@ -1996,17 +2395,28 @@ def copy_listfile_between_dirs(listfile_filename: str,
 
     safe_copy(qualified_src_filename=qualified_listfile_filename,
               qualified_dest_filename=qualified_copied_listfile_filename,
-              require_src_exist=True)
+              require_src_exist=True,
+              method=method)
 
-    # Read in the list of products
+    # Read in the list of products, and copy them all at once, followed by all files they point to
     l_product_filenames = read_listfile(qualified_listfile_filename)
 
-    for product_filename in l_product_filenames:
-        copy_product_between_dirs(product_filename=product_filename,
-                                  src_dir=src_dir,
-                                  dest_dir=dest_dir,
-                                  require_all_src_datafiles_exist=require_all_datafiles_exist,
-                                  require_all_dest_datafiles_free=require_all_dest_datafiles_free)
+    os.makedirs(os.path.join(dest_dir, DATA_SUBDIR), exist_ok=True)
+
+    copy_files([(os.path.join(src_dir, product_filename), os.path.join(dest_dir, product_filename))
+                for product_filename in l_product_filenames],
+               require_src_exist=True,
+               method=method,
+               max_workers=max_workers)
+
+    l_datafile_pairs = [file_pair for product_filename in l_product_filenames
+                        for file_pair in _get_product_file_pairs(product_filename, src_dir, dest_dir)]
+
+    copy_files(l_datafile_pairs,
+               require_src_exist=require_all_datafiles_exist,
+               require_dest_free=require_all_dest_datafiles_free,
+               method=method,
+               max_workers=max_workers)
 
     return qualified_copied_listfile_filename
 
@@ -2493,56 +2903,182 @@ def remove_files(l_qualified_filenames: Sequence[str]) -> None:
             logger.warning("Cannot delete file: %s", qualified_filename)
 
 
+class _ParallelGzipWriter:
+    """File-like object which gzip-compresses the data written to it in independent blocks with a thread pool, and
+    writes these in order to an underlying file as consecutive gzip members, which together form a valid gzip file.
+    Only the methods needed by `tarfile` are implemented.
+    """
+
+    def __init__(self,
+                 fileobj: BinaryIO,
+                 max_workers: Optional[int] = None,
+                 compresslevel: int = 6,
+                 block_size: int = TAR_GZIP_BLOCK_SIZE):
+
+        self._fileobj = fileobj
+        self._compresslevel = compresslevel
+        self._block_size = block_size
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # Limit the number of blocks being compressed at once, to limit memory use
+        self._max_pending = 2 * (max_workers or os.cpu_count() or 1)
+
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._offset = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._offset += len(data)
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self) -> None:
+        """Compresses any buffered data, and writes all compressed blocks to the underlying file.
+        """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._fileobj.write(self._pending.popleft().result())
+        self._fileobj.flush()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+
+    def _submit(self, block: bytes) -> None:
+        self._pending.append(self._executor.submit(gzip.compress, block, self._compresslevel, mtime=0))
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+
 def tar_files(tarball_filename: str,
-              l_filenames: Sequence[str],
+              l_filenames: Iterable[str],
               workdir: str = DEFAULT_WORKDIR,
-              delete_files: bool = False):
-    """Create a tarball containing all files in the provided list of filenames.
+              delete_files: bool = False,
+              compression: Optional[str] = None,
+              max_workers: Optional[int] = None,
+              chunk_size: int = DEFAULT_TAR_CHUNK_SIZE,
+              append: bool = False):
+    """Create a tarball containing all files in the provided list of filenames. Files are added to the tarball one at a
+    time, so the list may be arbitrarily long (and may be any iterable, e.g. a generator).
 
     Parameters
     ----------
     tarball_filename : str
         The desired fully-qualified or workdir-relative filename of the tarball to be created.
-    l_filenames : Sequence[str]
-        A sequence of workdir-relative filenames to be put into the tarball.
+    l_filenames : Iterable[str]
+        An iterable of workdir-relative filenames to be put into the tarball. Directories are added recursively.
     workdir : str, default="."
         The workdir in which the file exists. If `filename` is provided fully-qualified,
         it is not necessary for this to be provided (and it will be ignored if it is).
     delete_files : bool, default=False
-        If True, all files in `l_filenames` will be deleted after being put into the tarball
+        If True, all files in `l_filenames` will be deleted after being put into the tarball. This is done after each
+        chunk of files has been added and the tarball flushed to disk, except for "bz2" and "xz" compression, which
+        can't be flushed part-way, where it is done once the tarball is complete.
+    compression : Optional[str], default=None
+        The compression to apply to the tarball, one of `TAR_COMPRESSION_OPTIONS`: None (no compression), "gz",
+        "bz2", "xz" or "zstd". "gz" and "zstd" compression are multi-threaded, with "gz" compression writing a gzip file
+        of multiple members, which can be read by all standard tools. "zstd" compression requires the zstandard
+        package.
+    max_workers : Optional[int], default=None
+        The maximum number of threads to use for "gz" or "zstd" compression. If None, will use the number of CPUs.
+    chunk_size : int, default=DEFAULT_TAR_CHUNK_SIZE
+        The number of files to add to the tarball between flushes to disk, each of which is logged to report progress.
+    append : bool, default=False
+        If True and the tarball already exists, files will be appended to it rather than it being overwritten. This is
+        only possible for uncompressed tarballs.
     """
 
+    if compression not in TAR_COMPRESSION_OPTIONS:
+        raise ValueError(f"Invalid compression for tarball: {compression}. Allowed values are: "
+                         f"{TAR_COMPRESSION_OPTIONS}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression of tarballs requires the zstandard package, which is not available.")
+    if append and compression is not None:
+        raise ValueError("Files can only be appended to uncompressed tarballs.")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, but is {chunk_size}.")
+
     qualified_tarball_filename: str = get_qualified_filename(tarball_filename, workdir)
 
-    filename_string = " ".join(l_filenames)
+    if append and os.path.isfile(qualified_tarball_filename):
+        logger.info("Appending to tarball %s", qualified_tarball_filename)
+        file_mode = "r+b"
+        tar_mode = "a"
+    else:
+        logger.info("Creating tarball %s", qualified_tarball_filename)
+        file_mode = "wb"
+        tar_mode = "w"
 
-    # Tar the files and fully log the process
-    logger.info("Creating tarball %s", qualified_tarball_filename)
+    # bz2 and xz compressed streams can't be flushed part-way, so files can only be deleted once the tarball is complete
+    flushable = compression not in ("bz2", "xz")
 
-    tar_cmd = f"cd {workdir} && tar -cf {qualified_tarball_filename} {filename_string}"
-    tar_results = subprocess.run(tar_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    l_filenames_to_delete: List[str] = []
+    num_files = 0
 
-    logger.info("tar stdout: %s", tar_results.stdout)
-    logger.debug("tar stderr: %s", tar_results.stderr)
+    try:
+        with open(qualified_tarball_filename, file_mode) as fo:
+
+            # Set up the (possibly compressing) file object for the tar stream to be written to
+            if compression == "gz":
+                tar_fileobj = _ParallelGzipWriter(fo, max_workers=max_workers)
+            elif compression == "zstd":
+                tar_fileobj = zstandard.ZstdCompressor(threads=max_workers or -1).stream_writer(fo, closefd=False)
+            else:
+                tar_fileobj = fo
+            if compression in ("bz2", "xz"):
+                tar_mode = f"w:{compression}"
 
-    # Check that the tar process succeeded
-    if not os.path.isfile(qualified_tarball_filename):
-        base_error = FileNotFoundError(f"{qualified_tarball_filename} not found. "
-                                       f"stderr from tar process was: \n"
-                                       f"{tar_results.stderr}")
-        raise SheFileWriteError(filename=tarball_filename, workdir=workdir) from base_error
-    if tar_results.returncode:
-        base_error = ValueError(f"Tarring of {qualified_tarball_filename} failed. stderr from tar process was: \n"
-                                f"{tar_results.stderr}")
-        raise SheFileWriteError(filename=tarball_filename, workdir=workdir) from base_error
+            try:
+                with tarfile.open(fileobj=tar_fileobj, mode=tar_mode) as tar:
+
+                    def flush_chunk():
+                        """Flush everything written so far to disk, then delete the files which were written if
+                        desired.
+                        """
+                        if flushable:
+                            tar_fileobj.flush()
+                            fo.flush()
+                            if delete_files:
+                                os.fsync(fo.fileno())
+                                remove_files(l_filenames_to_delete)
+                                l_filenames_to_delete.clear()
+                        logger.info("Added %i files (%i bytes before compression) to tarball %s",
+                                    num_files, tar.offset, qualified_tarball_filename)
+
+                    for filename in l_filenames:
+
+                        qualified_filename = get_qualified_filename(filename, workdir)
+                        tar.add(qualified_filename, arcname=filename)
+                        num_files += 1
+
+                        if delete_files:
+                            l_filenames_to_delete.append(qualified_filename)
+                        if num_files % chunk_size == 0:
+                            flush_chunk()
+
+            finally:
+                if tar_fileobj is not fo:
+                    tar_fileobj.close()
 
-    # Delete the files if desired
-    if delete_files:
-        l_qualified_filenames = [get_qualified_filename(filename, workdir) for filename in l_filenames]
-        remove_files(l_qualified_filenames)
+    except Exception as e:
+        raise SheFileWriteError(filename=tarball_filename, workdir=workdir) from e
 
+    logger.info("Finished writing %i files to tarball %s", num_files, qualified_tarball_filename)
 
-T = TypeVar('T')
+    # Delete any files not yet deleted if desired
+    if delete_files:
+        remove_files(l_filenames_to_delete)
 
 
 class FileLoader(abc.ABC, Generic[T]):
@@ -2812,16 +3348,18 @@ class MultiFileLoader(Generic[T]):
             self.l_file_loaders = []
             self.l_filenames = []
 
-    def load_all(self, *args, **kwargs):
+    def load_all(self, *args, max_workers: Optional[int] = None, **kwargs):
         """Load all files.
 
         Parameters
         ----------
         *args, **kwargs : Any
             Any arguments passed to this will be forwarded to the appropriate method to load in the objects.
+        max_workers : Optional[int], default=None
+            If greater than 1, the files will be loaded concurrently by a pool of up to this many threads.
         """
-        for file_loader in self.l_file_loaders:
-            file_loader.load(*args, **kwargs)
+        _map_in_order(lambda file_loader: file_loader.load(*args, **kwargs), self.l_file_loaders,
+                      max_workers=max_workers)
 
     def open_all(self, *args, **kwargs):
         """Alias to load_all.
@@ -2834,15 +3372,24 @@ class MultiFileLoader(Generic[T]):
         for file_loader in self.l_file_loaders:
             file_loader.close()
 
-    def get_all(self, *args, **kwargs) -> List[T]:
+    def get_all(self, *args, max_workers: Optional[int] = None, **kwargs) -> List[T]:
         """Get a list of all files (load and return, but don't keep a reference within this object).
 
+        Parameters
+        ----------
+        *args, **kwargs : Any
+            Any arguments passed to this will be forwarded to the appropriate method to load in the objects.
+        max_workers : Optional[int], default=None
+            If greater than 1, the files will be loaded concurrently by a pool of up to this many threads. The list
+            is in the same order as when loaded serially.
+
         Returns
         -------
         List[T]
             A list of loaded-in objects.
         """
-        return [file_loader.get(*args, **kwargs) for file_loader in self.l_file_loaders]
+        return _map_in_order(lambda file_loader: file_loader.get(*args, **kwargs), self.l_file_loaders,
+                             max_workers=max_workers)
 
 
 class MultiProductLoader(MultiFileLoader):
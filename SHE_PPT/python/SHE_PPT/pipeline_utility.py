@@ -24,7 +24,6 @@ import os
 from argparse import Namespace
 from enum import EnumMeta
 from functools import lru_cache
-from shutil import copyfile
 from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, TextIO, Tuple, Type, TypeVar, Union
 
 import numpy as np
@@ -33,8 +32,8 @@ from .constants.classes import AllowedEnum
 from .constants.config import (AnalysisConfigKeys, CTI_GAL_VALIDATION_HEAD, CalibrationConfigKeys, ConfigKeys,
                                GlobalConfigKeys, ReconciliationConfigKeys, SHEAR_BIAS_VALIDATION_HEAD,
                                ScalingExperimentsConfigKeys, VALIDATION_HEAD, ValidationConfigKeys, )
-from .file_io import (DEFAULT_WORKDIR, SheFileReadError, find_file, get_qualified_filename, read_listfile,
-                      read_xml_product, )
+from .file_io import (COPY_METHOD_AUTO, DEFAULT_COPY_MAX_WORKERS, DEFAULT_WORKDIR, SheFileReadError, copy_files,
+                      find_file, get_qualified_filename, read_listfile, read_xml_product, safe_copy, )
 from .logging import getLogger
 from .utility import is_any_type_of_none
 
@@ -140,8 +139,11 @@ def get_global_enum(task_value: str,
 
 def archive_product(product_filename: str,
                     archive_dir: str,
-                    workdir: str) -> None:
-    """Copies an already-written data product to an archive directory.
+                    workdir: str,
+                    method: str = COPY_METHOD_AUTO,
+                    max_workers: Optional[int] = DEFAULT_COPY_MAX_WORKERS) -> None:
+    """Copies an already-written data product to an archive directory. Files already in the archive are replaced,
+    unless they're identical to the files being archived, in which case they're left as they are.
 
     Parameters
     ----------
@@ -152,6 +154,11 @@ def archive_product(product_filename: str,
         will be added after this to keep separate runs from conflicting).
     workdir : str
         The working directory for this task
+    method : str, default=COPY_METHOD_AUTO
+        The method to use to copy the files, one of `SHE_PPT.file_io.COPY_METHODS`.
+    max_workers : Optional[int], default=DEFAULT_COPY_MAX_WORKERS
+        The maximum number of threads to use to copy the files the product points to. If None or 1, they will be
+        copied serially.
     """
 
     logger = getLogger(__name__)
@@ -170,25 +177,27 @@ def archive_product(product_filename: str,
 
     # Copy the file to the archive
     qualified_filename = os.path.join(workdir, product_filename)
-    copyfile(qualified_filename, os.path.join(full_archive_dir, product_filename))
+    safe_copy(qualified_filename, os.path.join(full_archive_dir, product_filename),
+              require_src_exist=True,
+              overwrite=True,
+              method=method)
 
     # Copy any files it points to to the archive as well
     try:
-        p = read_xml_product(qualified_filename)
+        p = read_xml_product(qualified_filename, use_cache=True)
 
         # Copy all files this points to
         if hasattr(p, "get_all_filenames"):
-            for data_filename in p.get_all_filenames():
-                if data_filename is not None and data_filename != "default_filename.fits" and data_filename != "":
-                    qualified_data_filename = os.path.join(workdir, data_filename)
-                    qualified_archive_data_filename = os.path.join(full_archive_dir, data_filename)
-
-                    # The filename will likely also contain a subdir, so figure that out
-                    full_archive_data_subpath = os.path.split(qualified_archive_data_filename)[0]
-                    if not os.path.exists(full_archive_data_subpath):
-                        os.makedirs(full_archive_data_subpath)
-
-                    copyfile(qualified_data_filename, qualified_archive_data_filename)
+            l_file_pairs = [(os.path.join(workdir, data_filename), os.path.join(full_archive_dir, data_filename))
+                            for data_filename in p.get_all_filenames()
+                            if data_filename is not None and data_filename != "default_filename.fits"
+                            and data_filename != ""]
+
+            copy_files(l_file_pairs,
+                       require_src_exist=True,
+                       overwrite=True,
+                       method=method,
+                       max_workers=max_workers)
 
         else:
             logger.warning("Product %s has no 'get_all_filenames' method.", qualified_filename)
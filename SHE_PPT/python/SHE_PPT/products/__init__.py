@@ -17,17 +17,143 @@
 # the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
 # Boston, MA 02110-1301 USA
 
+# Each module in this package is imported, and its Data Model binding initialised with its init() function, only when
+# it is first accessed as an attribute of this package (including through `from SHE_PPT.products import <module>`), or
+# when a product of the type it handles is read in through `SHE_PPT.file_io.read_xml_product`. This avoids the cost of
+# loading every binding for executables which only use a few of them.
+
 import glob
+import re
+import threading
+from importlib import import_module
 from os.path import basename, dirname, isfile
+from typing import Dict, List, Optional
+from xml.etree import ElementTree
+
+_D_MODULE_FILENAMES = {basename(f)[:-3]: f for f in glob.glob(dirname(__file__) + "/*.py")
+                       if isfile(f) and not f.endswith('__init__.py')}
+
+__all__ = sorted(_D_MODULE_FILENAMES)
+
+# Binding classes initialised through the general init functions of SHE_PPT.product_utility, which the modules using
+# them don't reference by name
+_D_GENERAL_INIT_BINDINGS = {"init_intermediate_general": "dpdSheIntermediateGeneral",
+                            "init_int_obs_cat": "dpdSheIntermediateObservationCatalog",
+                            "init_placeholder_general": "dpdShePlaceholderGeneral", }
+
+_lock = threading.RLock()
+_s_initialised_modules = set()
+_d_l_binding_modules: Optional[Dict[str, List[str]]] = None
+
+
+def __getattr__(name: str):
+    if name in _D_MODULE_FILENAMES:
+        return load_product_module(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
+
+
+def load_product_module(name: str):
+    """Imports a module of this package, and initialises its Data Model binding if this hasn't already been done.
+
+    Parameters
+    ----------
+    name : str
+        The name of the module, e.g. "she_psf_model_image"
+
+    Returns
+    -------
+    module : ModuleType
+        The imported module
+    """
+
+    with _lock:
+        module = import_module(f"{__name__}.{name}")
+        if name not in _s_initialised_modules:
+            module.init()
+            _s_initialised_modules.add(name)
+
+    return module
+
+
+def init_all() -> None:
+    """Imports all modules of this package and initialises their Data Model bindings.
+    """
+    for name in __all__:
+        load_product_module(name)
+
+
+def load_product_modules_for_binding(binding_class_name: str) -> bool:
+    """Imports and initialises the modules of this package which handle products of a given Data Model binding class.
+
+    Parameters
+    ----------
+    binding_class_name : str
+        The name of the binding class, e.g. "dpdShePsfModelImage"
+
+    Returns
+    -------
+    found : bool
+        Whether any module handling this binding class was found.
+    """
+
+    l_names = _get_d_l_binding_modules().get(binding_class_name, [])
+    for name in l_names:
+        if name not in _s_initialised_modules:
+            load_product_module(name)
+
+    return len(l_names) > 0
+
+
+def load_product_modules_for_xml(qualified_filename: str) -> None:
+    """Imports and initialises the modules of this package needed to read in a product from an .xml file, identified
+    from the file's root element. If this can't be determined, all modules are imported and initialised.
+
+    Parameters
+    ----------
+    qualified_filename : str
+        The fully-qualified filename of the .xml file
+    """
+
+    try:
+        _, root = next(ElementTree.iterparse(qualified_filename, events=("start",)))
+        # The root element is named as the binding class, but capitalised, e.g. "DpdShePsfModelImage"
+        root_name = root.tag.rsplit("}", 1)[-1]
+        found = load_product_modules_for_binding(root_name[:1].lower() + root_name[1:])
+    except (ElementTree.ParseError, StopIteration):
+        found = False
+
+    if not found:
+        init_all()
+
+
+def _get_d_l_binding_modules() -> Dict[str, List[str]]:
+    """Gets a dict of the names of the modules of this package which handle each binding class, built the first time
+    it's needed by searching the modules' source code (so that they don't need to be imported to build it).
+    """
+
+    global _d_l_binding_modules
+
+    with _lock:
+        if _d_l_binding_modules is None:
+
+            d_l_binding_modules: Dict[str, List[str]] = {}
+
+            for name, filename in sorted(_D_MODULE_FILENAMES.items()):
+                with open(filename) as fi:
+                    source = fi.read()
 
-# Import all modules in this package when we import it
-modules = glob.glob(dirname(__file__) + "/*.py")
-__all__ = [basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
+                s_binding_class_names = set(re.findall(r"\b(dpd[A-Z]\w*)\b", source))
+                for init_function_name, binding_class_name in _D_GENERAL_INIT_BINDINGS.items():
+                    if init_function_name in source:
+                        s_binding_class_names.add(binding_class_name)
 
-from . import *  # noqa: F401,E402,F403
+                for binding_class_name in s_binding_class_names:
+                    d_l_binding_modules.setdefault(binding_class_name, []).append(name)
 
-for f in modules:
-    if isfile(f) and not f.endswith('__init__.py'):
-        globals()[basename(f)[:-3]].init()
+            _d_l_binding_modules = d_l_binding_modules
 
-del modules, dirname, basename, isfile, glob
+    return _d_l_binding_modules
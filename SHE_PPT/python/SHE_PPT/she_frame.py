@@ -23,13 +23,14 @@ __updated__ = "2021-08-13"
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import os.path
+import threading
 import weakref
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from copy import deepcopy
 
 import numpy as np
 from astropy.io import fits
-from astropy.io.fits import BinTableHDU, HDUList, ImageHDU, PrimaryHDU
 from astropy.table import Table
 from astropy.wcs import WCS
 
@@ -37,9 +38,10 @@ import EL_CoordsUtils.telescope_coords as tc
 from EL_PythonUtils.utilities import run_only_once
 from . import logging, products
 from .constants.fits import (CCDID_LABEL, EXTNAME_LABEL, MASK_TAG, NOISEMAP_TAG, PSF_CAT_TAG, SCI_TAG, SEGMENTATION_TAG)
+from .coordinates import radec_to_unit_vectors
 from .detector import get_id_string
 from .file_io import read_xml_product
-from .she_image import SHEImage
+from .she_image import SHEImage, _read_hdu
 from .table_formats.mer_final_catalog import tf as mfc_tf
 from .table_formats.she_psf_model_image import tf as pstf
 from .table_utility import is_in_format
@@ -53,6 +55,331 @@ logger = logging.getLogger(__name__)
 
 CoordTuple = namedtuple("CoordTuple", "x_fov y_fov detno_x detno_y x_det y_det")
 
+# Fractional tolerance added to the radius of each detector's footprint in the DetectorFootprintIndex
+FOOTPRINT_RADIUS_TOLERANCE = 0.05
+
+# Value of `load_images` for SHEFrame.read to load the images of each detector only when they're first needed
+LOAD_IMAGES_LAZY = "lazy"
+
+# Default memory budget for the images of detectors loaded on demand - enough for a few full VIS detectors
+DEFAULT_DETECTOR_CACHE_NBYTES = 2 * 1024 ** 3
+
+DetectorCacheInfo = namedtuple("DetectorCacheInfo", ["hits", "misses", "n_detectors", "nbytes", "max_nbytes"])
+
+
+class _DetectorCacheEntry(object):
+    """Private record of a detector in a LoadedDetectorCache."""
+
+    __slots__ = ("detector_ref", "nbytes", "loaded", "n_pins", "load_lock")
+
+    def __init__(self, detector, callback=None):
+        self.detector_ref = weakref.ref(detector, callback)
+        self.nbytes = 0
+        self.loaded = False
+
+        # The number of callers currently using the detector, which can't be unloaded while this is non-zero
+        self.n_pins = 0
+
+        # Held while loading the detector's images, so that only one thread loads them
+        self.load_lock = threading.Lock()
+
+
+class LoadedDetectorCache(object):
+    """Least-recently-used record of the detectors whose images have been loaded on demand by SHEFrames read with
+    `load_images="lazy"`. When loading another detector takes the total size of the loaded images over the memory
+    budget, the images of the least-recently-used detectors are unloaded again (leaving their headers, WCSs and
+    shapes in place), until it's back within the budget. Detectors currently in use are never unloaded, and the most
+    recently used detector is always kept, even if it alone is over the budget.
+
+    Detectors are loaded without holding the cache's lock, so different detectors can be loaded and used by different
+    threads at the same time.
+
+    Attributes
+    ----------
+    max_nbytes : int
+        The memory budget for the loaded images in bytes
+    """
+
+    def __init__(self, max_nbytes=DEFAULT_DETECTOR_CACHE_NBYTES):
+
+        self.max_nbytes = max_nbytes
+
+        # Keyed by id of the detector, with values of _DetectorCacheEntry
+        self._detectors = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def loaded_detector(self, frame, x_i, y_i):
+        """Context manager which loads the images of a detector of a frame if they aren't already, and yields the
+        detector. The detector won't be unloaded by another thread while in the context.
+
+        Parameters
+        ----------
+        frame : SHEFrame
+            The frame containing the detector, which must have been read with `load_images="lazy"`
+        x_i : int
+            The first index of the detector in the frame's detectors array
+        y_i : int
+            idem for the second index
+        """
+
+        # Pin the detector's entry, creating it if necessary
+        with self._lock:
+            detector = frame.detectors[x_i, y_i]
+            key = id(detector)
+
+            entry = self._detectors.get(key)
+            if entry is None or entry.detector_ref() is not detector:
+                if entry is not None:
+                    # A stale entry for a deleted detector which had the same id
+                    self._nbytes -= entry.nbytes
+                entry = _DetectorCacheEntry(detector, self._get_drop_callback(key))
+                self._detectors[key] = entry
+            else:
+                self._detectors.move_to_end(key)
+
+            entry.n_pins += 1
+
+        try:
+            # Load the images if needed, with any other threads using this detector waiting until they're loaded
+            with entry.load_lock:
+                if entry.loaded:
+                    with self._lock:
+                        self._hits += 1
+                else:
+                    nbytes = frame._load_detector_images(x_i, y_i)
+                    with self._lock:
+                        self._misses += 1
+                        entry.nbytes = nbytes
+                        entry.loaded = True
+                        self._nbytes += nbytes
+                        self._unload_excess()
+
+            yield detector
+
+        finally:
+            with self._lock:
+                entry.n_pins -= 1
+
+                # Drop the entry if its images failed to load and nobody else is trying to
+                if not entry.loaded and entry.n_pins == 0 and self._detectors.get(key) is entry:
+                    del self._detectors[key]
+
+                self._unload_excess()
+
+    def _get_drop_callback(self, key):
+        """Gets a callback for the weak reference to a detector, which drops its entry from the cache when the
+        detector is deleted, so that its images no longer count towards the budget."""
+
+        # Only hold a weak reference to the cache, so that the callback doesn't keep it alive
+        cache_ref = weakref.ref(self)
+
+        def drop_entry(detector_ref):
+            cache = cache_ref()
+            if cache is None:
+                return
+            with cache._lock:
+                entry = cache._detectors.get(key)
+                if entry is not None and entry.detector_ref is detector_ref:
+                    del cache._detectors[key]
+                    cache._nbytes -= entry.nbytes
+
+        return drop_entry
+
+    def _unload_excess(self):
+        """Unloads the least-recently-used detectors which aren't in use until the cache is within its budget. Must be
+        called with the lock held."""
+
+        if self._nbytes <= self.max_nbytes:
+            return
+
+        l_keys = list(self._detectors)
+
+        # Never unload the most recently used detector
+        for key in l_keys[:-1]:
+            entry = self._detectors.get(key)
+            if entry is None or entry.n_pins > 0 or not entry.loaded:
+                continue
+
+            self._detectors.pop(key, None)
+            self._nbytes -= entry.nbytes
+            old_detector = entry.detector_ref()
+            if old_detector is not None:
+                _unload_detector_images(old_detector)
+
+            if self._nbytes <= self.max_nbytes:
+                break
+
+    def cache_info(self):
+        """Returns the hit and miss statistics and current size of the cache."""
+        with self._lock:
+            return DetectorCacheInfo(self._hits, self._misses, len(self._detectors), self._nbytes, self.max_nbytes)
+
+    def cache_clear(self):
+        """Unloads the images of all detectors in the cache which aren't in use, and resets the statistics."""
+        with self._lock:
+            for key, entry in list(self._detectors.items()):
+                # Skip detectors in use, and any dropped since the list was made because they were deleted
+                if entry.n_pins > 0 or self._detectors.pop(key, None) is not entry:
+                    continue
+                self._nbytes -= entry.nbytes
+                detector = entry.detector_ref()
+                if detector is not None and entry.loaded:
+                    _unload_detector_images(detector)
+            self._hits = 0
+            self._misses = 0
+
+
+def _unload_detector_images(detector):
+    """Private function to discard the images of a detector loaded on demand, returning it to its unloaded state
+    (which keeps the shape it was given when read)."""
+
+    # Deleting the data first marks the images as not loaded, so the data can then be reset to an empty array
+    del detector.data
+    detector.data = None
+
+    detector.mask = None
+    detector.noisemap = None
+    detector.background_map = None
+    detector.weight_map = None
+    detector.segmentation_map = None
+
+
+# The cache used by SHEFrames read with load_images="lazy", unless another is supplied to SHEFrame.read
+loaded_detector_cache = LoadedDetectorCache()
+
+
+class DetectorFootprintIndex(object):
+    """Precomputed index of the sky footprints of an array of detectors, used to find which detector(s) a sky
+    position may lie on without inverting the WCS of every detector.
+
+    Each detector's footprint is approximated by a cone on the celestial sphere, described by the unit vector of
+    the detector's centre and the angular radius enclosing its corners (plus a tolerance). A position can only lie
+    on a detector if it is within this cone, which is tested with a single dot product per detector. Only these
+    candidate detectors (normally one or two) then need their WCS inverted to confirm the position.
+
+    Attributes
+    ----------
+    detector_indices : np.ndarray[int]
+        Array of shape (n, 2) of the indices of the indexed detectors in the detectors array, in the order the
+        detectors array is iterated over (first index outermost)
+    centres : np.ndarray[float]
+        Array of shape (n, 3) of the unit vectors of the centres of the detectors
+    radii : np.ndarray[float]
+        The angular radius (in radians) of the footprint of each detector
+    pixel_scales : np.ndarray[float]
+        The approximate angular size (in radians) of a pixel on each detector, used to expand the footprints to
+        accommodate a pixel buffer
+    """
+
+    def __init__(self, detectors, tolerance=FOOTPRINT_RADIUS_TOLERANCE):
+        """
+        Parameters
+        ----------
+        detectors : np.ndarray<SHE_PPT.she_image.SHEImage>
+            2D array of SHEImage objects (or None)
+        tolerance : float
+            Fractional tolerance added to the radius of each detector's footprint
+        """
+
+        self.tolerance = tolerance
+
+        l_detector_indices = []
+        l_centres = []
+        l_radii = []
+        l_pixel_scales = []
+
+        num_x, num_y = np.shape(detectors)
+
+        for x_i in range(num_x):
+            for y_i in range(num_y):
+
+                detector = detectors[x_i, y_i]
+                if detector is None or detector.wcs is None:
+                    continue
+
+                nx = float(detector.shape[0])
+                ny = float(detector.shape[1])
+
+                # Sky coordinates of the centre and the four corners of the detector, with the first pixel indexed
+                # as 1
+                ras, decs = detector.pix2world(x=np.array([(nx + 1) / 2, 1, nx, nx, 1]),
+                                               y=np.array([(ny + 1) / 2, 1, 1, ny, ny]),
+                                               origin=1)
+
+                vectors = radec_to_unit_vectors(ras, decs)
+                centre = vectors[0]
+
+                radius = np.arccos(np.clip(vectors[1:] @ centre, -1., 1.)).max()
+
+                # Half the length of the diagonal of the detector in pixels
+                half_diagonal = 0.5 * np.hypot(nx - 1, ny - 1)
+
+                l_detector_indices.append((x_i, y_i))
+                l_centres.append(centre)
+                l_radii.append(radius)
+                l_pixel_scales.append(radius / half_diagonal if half_diagonal > 0 else 0.)
+
+        self.detector_indices = np.array(l_detector_indices, dtype=int).reshape(-1, 2)
+        self.centres = np.array(l_centres, dtype=float).reshape(-1, 3)
+        self.radii = np.array(l_radii, dtype=float)
+        self.pixel_scales = np.array(l_pixel_scales, dtype=float)
+
+    def __len__(self):
+        return len(self.radii)
+
+    def _get_cos_radii(self, x_buffer=0, y_buffer=0):
+        """Gets the cosine of the radius of each detector's footprint, expanded to include the pixel buffer."""
+
+        buffer = np.hypot(max(x_buffer, 0), max(y_buffer, 0))
+
+        radii = (self.radii + buffer * self.pixel_scales) * (1 + self.tolerance)
+
+        return np.cos(np.minimum(radii, np.pi))
+
+    def get_candidates(self, x_world, y_world, x_buffer=0, y_buffer=0):
+        """Gets a boolean matrix indicating which detectors each position may lie on.
+
+        Parameters
+        ----------
+        x_world : float or np.ndarray[float]
+            The x sky co-ordinate(s) (R.A.)
+        y_world : float or np.ndarray[float]
+            The y sky co-ordinate(s) (Dec.)
+        x_buffer : float
+            The size of the buffer region in pixels around a detector, x-dimension
+        y_buffer : float
+            The size of the buffer region in pixels around a detector, y-dimension
+
+        Return
+        ------
+        candidates : np.ndarray[bool]
+            Array of shape (n_detectors, n_positions), True where a position may lie on a detector
+        """
+
+        vectors = radec_to_unit_vectors(x_world, y_world)
+
+        cos_radii = self._get_cos_radii(x_buffer, y_buffer)
+
+        return (self.centres @ vectors.T) >= cos_radii[:, None]
+
+    def get_candidate_detectors(self, x_world, y_world, x_buffer=0, y_buffer=0):
+        """Gets the indices of the detectors a single position may lie on.
+
+        Return
+        ------
+        detector_indices : np.ndarray[int]
+            Array of shape (n_candidates, 2) of the indices of the candidate detectors in the detectors array, in the
+            order the detectors array is iterated over
+        """
+
+        candidates = self.get_candidates(x_world, y_world, x_buffer, y_buffer)[:, 0]
+
+        return self.detector_indices[candidates]
+
 
 class SHEFrame(object):
     """Structure containing an array of SHEImageData objects, representing either an individual exposure or the
@@ -76,8 +403,10 @@ class SHEFrame(object):
 
     # Data
     _detectors = None
+    _footprint_index = None
     _psf_data_hdulist = None
     _psf_catalogue = None
+    _d_psf_hdu_indices = None
 
     # Parent references
     _parent_frame_stack = None
@@ -106,8 +435,13 @@ class SHEFrame(object):
     _seg_filename = None
     _d_seg_hdus = {}
 
+    # Whether psf_data_hdulist was opened by SHEFrame.read, and so should be closed by the frame
+    _owns_psf_data_hdulist = False
+
     # Options
     _images_loaded = False
+    _lazy_load_images = False
+    _detector_cache = None
 
     def __init__(self,
                  detectors,
@@ -162,6 +496,9 @@ class SHEFrame(object):
         # Perform the attribution
         self._detectors = detectors
 
+        # Any footprint index for previous detectors is now invalid
+        self._footprint_index = None
+
         # Set this as the parent for all detectors
         for detector in self._detectors.ravel():
             if detector is not None:
@@ -173,6 +510,25 @@ class SHEFrame(object):
         for detector in self._detectors.ravel():
             del detector
         self._detectors = None
+        self._footprint_index = None
+
+    @property
+    def psf_catalogue(self):
+        return self._psf_catalogue
+
+    @psf_catalogue.setter
+    def psf_catalogue(self, psf_catalogue):
+        self._psf_catalogue = psf_catalogue
+
+        # Any index of PSF HDUs for a previous catalogue is now invalid
+        self._d_psf_hdu_indices = None
+
+    @property
+    def footprint_index(self):
+        """Index of the sky footprints of the detectors, built when first needed."""
+        if self._footprint_index is None:
+            self._footprint_index = DetectorFootprintIndex(self.detectors)
+        return self._footprint_index
 
     @property
     def parent_frame_stack(self):
@@ -233,6 +589,23 @@ class SHEFrame(object):
             del segmentation_product
         del self._segmentation_product
 
+    def close(self):
+        """Closes the PSF data file, if it was opened when reading the frame. PSFs can't be extracted from the frame
+        after this. This is also done when the frame is deleted, or on exit if it's used as a context manager.
+        """
+        if self._owns_psf_data_hdulist:
+            self.psf_data_hdulist.close()
+            self._owns_psf_data_hdulist = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
     def __eq__(self, rhs):
         """Equality test for SHEFrame class.
         """
@@ -278,67 +651,180 @@ class SHEFrame(object):
         """ Finds the detector where a given position in world coordinates is.
         """
 
-        # Loop over the detectors, and use the WCS of each to determine if it's
-        # on it or not
-        found = False
+        # Use the footprint index to get the detectors the position may be on, and use the WCS of each of these
+        # to determine if it's on it or not
+        for x_i, y_i in self.footprint_index.get_candidate_detectors(x_world, y_world, x_buffer, y_buffer).tolist():
 
-        num_x, num_y = np.shape(self.detectors)
+            detector = self.detectors[x_i, y_i]
 
-        for x_i in range(num_x):
-            for y_i in range(num_y):
+            x, y = detector.world2pix(x_world, y_world)
+            if ((x < 1 - x_buffer) or (x > detector.shape[0] + x_buffer) or
+                    (y < 1 - y_buffer) or (y > detector.shape[1] + y_buffer)):
+                continue
 
-                detector = self.detectors[x_i, y_i]
-                if detector is None:
-                    continue
+            return detector, x, y, x_i, y_i
 
-                x, y = detector.world2pix(x_world, y_world)
-                if ((x < 1 - x_buffer) or (x > detector.shape[0] + x_buffer) or
-                        (y < 1 - y_buffer) or (y > detector.shape[1] + y_buffer)):
-                    continue
+        return None, None, None, None, None
 
-                found = True
+    def find_positions(self, x_world, y_world, x_buffer=0, y_buffer=0):
+        """ Vectorised version of _find_position. Finds the detectors where an array of positions in world
+            coordinates are, inverting the WCS of each detector once for all positions which may be on it.
 
-                break
+           Parameters
+           ----------
+           x_world : np.ndarray[float]
+               The x sky co-ordinates (R.A.)
+           y_world : np.ndarray[float]
+               The y sky co-ordinates (Dec.)
+           x_buffer : float
+               The size of the buffer region in pixels around a detector, x-dimension
+           y_buffer : float
+               The size of the buffer region in pixels around a detector, y-dimension
 
-            if found:
-                break
+           Return
+           ------
+           x_i : np.ndarray[int]
+               The first index of the detector each position is on in the detectors array, or -1 if not found
+           y_i : np.ndarray[int]
+               idem for the second index
+           x : np.ndarray[float]
+               The x pixel coordinate of each position on its detector, or NaN if not found
+           y : np.ndarray[float]
+               idem for y
+        """
 
-        if not found:
-            detector = None
+        x_world = np.atleast_1d(np.asarray(x_world, dtype=float))
+        y_world = np.atleast_1d(np.asarray(y_world, dtype=float))
+
+        n = len(x_world)
+
+        x_i = np.full(n, -1, dtype=int)
+        y_i = np.full(n, -1, dtype=int)
+        x = np.full(n, np.nan)
+        y = np.full(n, np.nan)
+
+        footprint_index = self.footprint_index
+
+        candidates = footprint_index.get_candidates(x_world, y_world, x_buffer, y_buffer)
+
+        # Go through the detectors in the same order as _find_position, so each position is assigned to the same
+        # detector
+        for (d_x_i, d_y_i), l_candidates in zip(footprint_index.detector_indices, candidates):
+
+            l_indices = np.flatnonzero(l_candidates & (x_i < 0))
+            if len(l_indices) == 0:
+                continue
+
+            detector = self.detectors[d_x_i, d_y_i]
 
-        return detector, x, y, x_i, y_i
+            l_x, l_y = detector.world2pix(x_world[l_indices], y_world[l_indices])
 
-    def get_objects_in_exposure(self, object_coords):
+            l_good = ((l_x >= 1 - x_buffer) & (l_x <= detector.shape[0] + x_buffer) &
+                      (l_y >= 1 - y_buffer) & (l_y <= detector.shape[1] + y_buffer))
+
+            l_indices = l_indices[l_good]
+
+            x_i[l_indices] = d_x_i
+            y_i[l_indices] = d_y_i
+            x[l_indices] = l_x[l_good]
+            y[l_indices] = l_y[l_good]
+
+        return x_i, y_i, x, y
+
+    def set_up_wcs_approximations(self, **kwargs):
+        """ Sets up approximations to the WCSs of all detectors (see SHEImage.set_up_wcs_approximation), which
+            are then used for vectorised coordinate transformations on the detectors and stamps extracted from them.
+
+           Parameters
+           ----------
+           **kwargs : Union[int, float]
+               Keyword arguments to pass to SHEImage.set_up_wcs_approximation
+        """
+
+        for detector in self.detectors.ravel():
+            if detector is not None and detector.wcs is not None and detector.wcs.has_celestial:
+                detector.set_up_wcs_approximation(**kwargs)
+
+    def get_objects_in_exposure(self, object_coords, x_buffer=0, y_buffer=0):
         """Returns the indices of the input object coorinates that are found within this observation,
-           along with lists of their x and y coordinates, and the detector they belong to"""
+           along with lists of their x and y coordinates, and the detector they belong to.
 
-        num_x, num_y = np.shape(self.detectors)
+           The unit vectors of the objects are computed once, and the footprint index is used to select the
+           candidate objects for each detector with a single dot product per object, so that only these candidates
+           need to be checked with each detector's WCS.
 
-        # get arrays/lists to hold all the objects and their attributes found in this exposure
-        all_inds = np.empty(0, np.int64)
-        all_xs = np.empty(0, np.float64)
-        all_ys = np.empty(0, np.float64)
-        detectors = []
+           Parameters
+           ----------
+           object_coords : astropy.coordinates.SkyCoord
+               The coordinates of the objects to be checked
+           x_buffer : float
+               The size of the buffer region in pixels around a detector, x-dimension
+           y_buffer : float
+               The size of the buffer region in pixels around a detector, y-dimension
 
-        for x_i in range(num_x):
-            for y_i in range(num_y):
+           Return
+           ------
+           all_inds : np.ndarray[int]
+               The indices of the objects found on each detector, in the order the detectors array is iterated over
+               (an object may appear more than once if it is on more than one detector)
+           all_xs : np.ndarray[float]
+               The x pixel coordinate of each object on its detector
+           all_ys : np.ndarray[float]
+               idem for y
+           detectors : np.ndarray[int]
+               Array of shape (n, 2) of the indices of the detector in the detectors array for each object
+        """
 
-                detector = self.detectors[x_i, y_i]
+        l_ra = np.atleast_1d(object_coords.ra.deg)
+        l_dec = np.atleast_1d(object_coords.dec.deg)
 
-                if detector is None:
-                    continue
+        vectors = radec_to_unit_vectors(l_ra, l_dec)
 
-                inds, xs, ys = detector.get_objects_in_detector(object_coords)
+        footprint_index = self.footprint_index
+        cos_radii = footprint_index._get_cos_radii(x_buffer, y_buffer)
 
-                all_inds = np.concatenate((all_inds, inds))
-                all_xs = np.concatenate((all_xs, xs))
-                all_ys = np.concatenate((all_ys, ys))
-                detectors += [(x_i, y_i) for i in range(len(inds))]
+        l_inds = []
+        l_xs = []
+        l_ys = []
+        l_det_indices = []
 
-        n_objs = len(all_inds)
-        logger.info(f"Found {n_objs} objects in exposure")
+        for (x_i, y_i), centre, cos_radius in zip(footprint_index.detector_indices,
+                                                  footprint_index.centres,
+                                                  cos_radii):
+
+            l_candidate_indices = np.flatnonzero(vectors @ centre >= cos_radius)
+            if len(l_candidate_indices) == 0:
+                continue
+
+            detector = self.detectors[x_i, y_i]
 
-        detectors = np.asarray(detectors)
+            inds, xs, ys = detector._confirm_objects_in_detector(l_ra, l_dec, l_candidate_indices,
+                                                                 x_buffer=x_buffer,
+                                                                 y_buffer=y_buffer)
+
+            l_inds.append(inds)
+            l_xs.append(xs)
+            l_ys.append(ys)
+            l_det_indices.append((x_i, y_i))
+
+        # Fill the output arrays for all detectors at once
+        n_objs = sum(len(inds) for inds in l_inds)
+
+        all_inds = np.empty(n_objs, np.int64)
+        all_xs = np.empty(n_objs, np.float64)
+        all_ys = np.empty(n_objs, np.float64)
+        detectors = np.empty((n_objs, 2), int)
+
+        start = 0
+        for inds, xs, ys, det_indices in zip(l_inds, l_xs, l_ys, l_det_indices):
+            end = start + len(inds)
+            all_inds[start:end] = inds
+            all_xs[start:end] = xs
+            all_ys[start:end] = ys
+            detectors[start:end] = det_indices
+            start = end
+
+        logger.info(f"Found {n_objs} objects in exposure")
 
         return all_inds, all_xs, all_ys, detectors
 
@@ -407,12 +893,56 @@ class SHEFrame(object):
         if detector is None:
             return None
 
+        return self.extract_detector_stamp(x_i=x_i,
+                                           y_i=y_i,
+                                           x=x,
+                                           y=y,
+                                           width=width,
+                                           height=height,
+                                           keep_header=keep_header)
+
+    def extract_detector_stamp(self, x_i, y_i, x, y, width, height=None, keep_header=False):
+        """Extracts a postage stamp centred on the provided pixel co-ordinates of a given detector, e.g. as
+           found by find_positions, without transforming any sky co-ordinates.
+
+           Parameters
+           ----------
+           x_i : int
+               The first index of the detector in the detectors array
+           y_i : int
+               idem for the second index
+           x : float
+               The x pixel co-ordinate on the detector
+           y : float
+               idem for y
+           width : int
+               The desired width of the postage stamp in pixels
+           height : int
+               The desired height of the postage stamp in pixels (default = width)
+           keep_header : bool
+               If True, will copy the detector's header to the stamp's
+
+           Return
+           ------
+           stamp : SHEImage
+               The extracted stamp
+        """
+
+        detector = self.detectors[x_i, y_i]
+
         if self._images_loaded:
             stamp = detector.extract_stamp(x=x,
                                            y=y,
                                            width=width,
                                            height=height,
                                            keep_header=keep_header, )
+        elif self._lazy_load_images:
+            with self._detector_cache.loaded_detector(self, x_i, y_i) as detector:
+                stamp = detector.extract_stamp(x=x,
+                                               y=y,
+                                               width=width,
+                                               height=height,
+                                               keep_header=keep_header, )
         else:
 
             xy = (x_i, y_i)
@@ -469,6 +999,65 @@ class SHEFrame(object):
 
         return stamp
 
+    def _load_detector_images(self, x_i, y_i):
+        """Loads the images of a detector from the files the frame was read from (for frames read with
+           load_images="lazy"), and returns their total size in bytes.
+        """
+
+        detector = self.detectors[x_i, y_i]
+
+        xy = (x_i, y_i)
+
+        def read_or_none(filename, d_hdus):
+            if filename is None or xy not in d_hdus:
+                return None
+            return _read_hdu(filename, d_hdus[xy]).transpose()
+
+        # Read all images before setting any, so the detector is left unchanged if any read fails
+        data = read_or_none(self._data_filename, self._d_data_hdus)
+        mask = read_or_none(self._mask_filename, self._d_mask_hdus)
+        noisemap = read_or_none(self._noisemap_filename, self._d_noisemap_hdus)
+        background_map = read_or_none(self._bkg_filename, self._d_bkg_hdus)
+        weight_map = read_or_none(self._wgt_filename, self._d_wgt_hdus)
+        segmentation_map = read_or_none(self._seg_filename, self._d_seg_hdus)
+
+        if data is None:
+            return 0
+
+        detector.data = data
+        detector.mask = mask
+        detector.noisemap = noisemap
+        detector.background_map = background_map
+        detector.weight_map = weight_map
+        detector.segmentation_map = segmentation_map
+
+        return sum(a.nbytes for a in (detector.data, detector.mask, detector.noisemap, detector.background_map,
+                                      detector.weight_map, detector.segmentation_map) if a is not None)
+
+    def _get_psf_hdu_indices(self, gal_id):
+        """Gets the indices of the bulge and disk PSF HDUs for a given galaxy, using a dict keyed by object ID which is
+        built from the PSF catalogue the first time it's needed.
+
+        Parameters
+        ----------
+        gal_id : int
+            ID of the galaxy
+
+        Return
+        ------
+        bulge_index : int
+
+        disk_index : int
+
+        """
+
+        if self._d_psf_hdu_indices is None:
+            l_bulge_disk_indices = zip(self.psf_catalogue[pstf.bulge_index].data.tolist(),
+                                       self.psf_catalogue[pstf.disk_index].data.tolist())
+            self._d_psf_hdu_indices = dict(zip(self.psf_catalogue[pstf.ID].data.tolist(), l_bulge_disk_indices))
+
+        return self._d_psf_hdu_indices[gal_id]
+
     def extract_psf(self, gal_id, keep_header=False):
         """Extracts the bulge and disk psfs for a given galaxy.
 
@@ -487,23 +1076,18 @@ class SHEFrame(object):
 
         """
 
-        try:
-            row = self.psf_catalogue.loc[gal_id]
-        except ValueError as e:
-            if not str(e) == "Cannot create TableLoc object with no indices":
-                raise
-            self.psf_catalogue.add_index(pstf.ID)
-            row = self.psf_catalogue.loc[gal_id]
+        bulge_index, disk_index = self._get_psf_hdu_indices(gal_id)
 
-        bulge_hdu = self.psf_data_hdulist[row[pstf.bulge_index]]
-        bulge_psf_stamp = SHEImage(data=bulge_hdu.data.transpose(),
-                                   header=bulge_hdu.header,
+        # Copy the data out of the (possibly memory-mapped) HDUs so that the stamps don't depend on the open file
+        bulge_hdu = self.psf_data_hdulist[bulge_index]
+        bulge_psf_stamp = SHEImage(data=np.array(bulge_hdu.data.transpose()),
+                                   header=bulge_hdu.header.copy(),
                                    parent_frame_stack=self.parent_frame_stack,
                                    parent_frame=self)
 
-        disk_hdu = self.psf_data_hdulist[row[pstf.disk_index]]
-        disk_psf_stamp = SHEImage(data=disk_hdu.data.transpose(),
-                                  header=disk_hdu.header,
+        disk_hdu = self.psf_data_hdulist[disk_index]
+        disk_psf_stamp = SHEImage(data=np.array(disk_hdu.data.transpose()),
+                                  header=disk_hdu.header.copy(),
                                   parent_frame_stack=self.parent_frame_stack,
                                   parent_frame=self)
 
@@ -533,34 +1117,28 @@ class SHEFrame(object):
                 A (fov_x, fov_y) tuple if present, or None if not present.
         """
 
-        # Loop over the detectors, and use the WCS of each to determine if it's on it or not
+        # Use the footprint index to get the detectors the position may be on, and use the WCS of each of these
+        # to determine if it's on it or not
         found = False
 
         # detector IDs are "y-x", and indexing self.detectors[i,j] gives detector "i-j"
         # Therefore to get detector x, y, we need self.detectors[y_i, x_i]
 
-        num_y, num_x = np.shape(self.detectors)
-
-        for y_i in range(num_y):
-            for x_i in range(num_x):
+        for y_i, x_i in self.footprint_index.get_candidate_detectors(x_world, y_world, x_buffer, y_buffer).tolist():
 
-                detector = self.detectors[y_i, x_i]
-                if detector is None:
-                    continue
-                x, y = detector.world2pix(x_world, y_world)
-                if (x <= 1 - x_buffer) or (x >= detector.shape[0] + x_buffer):
-                    continue
-                if (y <= 1 - y_buffer) or (y >= detector.shape[1] + y_buffer):
-                    continue
+            detector = self.detectors[y_i, x_i]
 
-                found = True
+            x, y = detector.world2pix(x_world, y_world)
+            if (x <= 1 - x_buffer) or (x >= detector.shape[0] + x_buffer):
+                continue
+            if (y <= 1 - y_buffer) or (y >= detector.shape[1] + y_buffer):
+                continue
 
-                break
+            found = True
 
-            if found:
-                break
+            break
 
-        if (detector is None) or (not found):
+        if not found:
             return None
 
         # Get the co-ordinates from the detector's method
@@ -589,6 +1167,7 @@ class SHEFrame(object):
              y_max=6,
              save_products=False,
              load_images=True,
+             detector_cache=None,
              **kwargs):
         """Reads a SHEFrame from disk
 
@@ -599,7 +1178,8 @@ class SHEFrame(object):
         seg_product_filename : str
             Filename of the Mosaic (segmentation map) data product
         psf_product_filename : str
-            Filename of the PSF Image data product
+            Filename of the PSF Image data product. The PSF data file is kept open until the frame is closed or
+            deleted
         detections_catalogue : astropy.table.Table
             The detections catalogue - only needed if prune_images=True
         prune_images : bool
@@ -612,12 +1192,22 @@ class SHEFrame(object):
             Maximum y-coordinate of detectors
         save_products : bool
             If True, will save references to data products read in
-        load_images : bool
-            If set to False, image data will not be loaded, and filehandles will be closed.
+        load_images : bool or str
+            If set to False, image data will not be loaded, and filehandles will be closed. If set to "lazy"
+            (LOAD_IMAGES_LAZY), the images of each detector will be loaded when a stamp is first extracted from it,
+            and unloaded again when the least recently used if the detector cache's memory budget is exceeded.
+        detector_cache : LoadedDetectorCache
+            The cache of detectors to use if load_images is "lazy". If None (default), the module's shared
+            `loaded_detector_cache` is used.
 
         Any kwargs are passed to the reading of the fits data
         """
 
+        # Lazy loading is handled the same way as not loading the images while reading
+        lazy_load_images = isinstance(load_images, str) and load_images == LOAD_IMAGES_LAZY
+        if lazy_load_images:
+            load_images = False
+
         # Check if we're pruning images that we have a detections catalogue, and if so, load in positions
         if not load_images:
 
@@ -653,26 +1243,6 @@ class SHEFrame(object):
                 wcs = WCS(header)
                 return True, wcs
 
-        if prune_images:
-
-            def check_if_psf_needed(psf_cat, hdu_index):
-
-                id_list = detections_catalogue[mfc_tf.ID].data
-
-                need_psf = False
-                for object_id in id_list:
-                    row = psf_cat.loc[object_id]
-                    if row[pstf.bulge_index] == hdu_index or row[pstf.disk_index] == hdu_index:
-                        need_psf = True
-                        break
-
-                return need_psf
-
-        else:
-
-            def check_if_psf_needed(*_args, **_kwargs):
-                return True
-
         def join_or_none(a, b):
             if a is None or b is None:
                 return None
@@ -900,33 +1470,12 @@ class SHEFrame(object):
 
             qualified_psf_filename = os.path.join(workdir, psf_data_filename)
 
-            input_psf_data_hdulist = fits.open(qualified_psf_filename, **kwargs)
-
-            psf_cat_i = find_extension(input_psf_data_hdulist, PSF_CAT_TAG)
-            psf_cat = Table.read(input_psf_data_hdulist[psf_cat_i])
+            # Keep the file open rather than copying out its HDUs, so that each PSF image is only read from disk if
+            # and when it's requested through extract_psf
+            psf_data_hdulist = fits.open(qualified_psf_filename, **kwargs)
 
-            # Add the object ID as an index to the PSF catalog
-            psf_cat.add_index(pstf.ID)
-
-            psf_data_hdulist = HDUList()
-            for i, hdu in enumerate(input_psf_data_hdulist):
-                if i == 0:
-                    psf_data_hdulist.append(PrimaryHDU())
-                elif i == 1:
-                    psf_data_hdulist.append(BinTableHDU(data=deepcopy(hdu.data),
-                                                        header=deepcopy(hdu.header)))
-                else:
-                    if check_if_psf_needed(psf_cat, i):
-                        # Add the PSF image if needed
-                        psf_data_hdulist.append(ImageHDU(data=deepcopy(hdu.data),
-                                                         header=deepcopy(hdu.header)))
-                    else:
-                        # Otherwise add a dummy HDU (to preserve file structure)
-                        psf_data_hdulist.append(ImageHDU())
-
-            # Clean up
-            del input_psf_data_hdulist
-            psf_cat.remove_indices(pstf.ID)
+            psf_cat_i = find_extension(psf_data_hdulist, PSF_CAT_TAG)
+            psf_cat = Table.read(psf_data_hdulist[psf_cat_i])
 
             if not is_in_format(psf_cat, pstf):
                 raise ValueError(
@@ -941,6 +1490,8 @@ class SHEFrame(object):
                              psf_data_hdulist=psf_data_hdulist,
                              psf_catalogue=psf_cat)
 
+        new_frame._owns_psf_data_hdulist = psf_data_hdulist is not None
+
         # Fill out the product references
         if save_products:
             new_frame.exposure_product = frame_prod
@@ -949,6 +1500,10 @@ class SHEFrame(object):
 
         # File out file references
         new_frame._images_loaded = load_images
+        new_frame._lazy_load_images = lazy_load_images
+
+        if lazy_load_images:
+            new_frame._detector_cache = detector_cache if detector_cache is not None else loaded_detector_cache
 
         if not load_images:
             new_frame._data_filename = qualified_data_filename
@@ -23,8 +23,10 @@ __updated__ = "2021-08-13"
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from typing import Iterable, List, Optional
+from typing import Iterable, List, Optional, Union
 
 import astropy.wcs
 import numpy as np
@@ -44,6 +46,21 @@ from .utility import find_extension
 
 logger = logging.getLogger(__name__)
 
+# Columns of the table returned by SHEFrameStack.get_object_placements
+PLACEMENT_OBJ_INDEX = "obj_index"
+PLACEMENT_EXP_INDEX = "exp_index"
+PLACEMENT_DET_IX = "det_ix"
+PLACEMENT_DET_IY = "det_iy"
+PLACEMENT_X = "x"
+PLACEMENT_Y = "y"
+PLACEMENT_DTYPES = {PLACEMENT_OBJ_INDEX: int,
+                    PLACEMENT_EXP_INDEX: int,
+                    PLACEMENT_DET_IX: int,
+                    PLACEMENT_DET_IY: int,
+                    PLACEMENT_X: float,
+                    PLACEMENT_Y: float, }
+PLACEMENT_COLUMNS = list(PLACEMENT_DTYPES)
+
 
 class SHEFrameStack():
     """Structure containing all needed data shape measurement, represented as a list of SHEFrames for
@@ -263,6 +280,20 @@ class SHEFrameStack():
     def object_id_list_product(self):
         del self._object_id_list_product
 
+    def close(self):
+        """Closes the files kept open by the exposures of the frame stack. This is also done on exit if the frame stack
+        is used as a context manager.
+        """
+        for exposure in self.exposures:
+            if exposure is not None:
+                exposure.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
     def __eq__(self, rhs):
         """Equality test for SHEFrame class.
         """
@@ -358,6 +389,64 @@ class SHEFrameStack():
 
         return self.extract_stamp_stack(x_world, y_world, width, *args, **kwargs)
 
+    def iter_galaxy_stacks(self, gal_ids, width, *args, prefetch=4, **kwargs):
+        """Iterates over postage stamps centred on each of a list of galaxies in the detections tables. The stamps
+           for the next `prefetch` galaxies are extracted in a background thread while the caller processes the
+           current one, so that reading the data (from memory, or from disk if the images weren't loaded) overlaps
+           with the caller's processing. At most `prefetch` stamp stacks are held in memory ahead of the caller.
+           If the generator is closed early, the background thread is stopped.
+
+           Parameters
+           ----------
+           gal_ids : Iterable[int]
+               The galaxies' unique IDs
+           width : int
+               The desired width of the postage stamps in pixels of the exposures
+           *args, **kwargs
+               Other arguments and keyword arguments are forwarded to extract_stamp_stack()
+           prefetch : int
+               The number of galaxies to extract stamps for ahead of the caller. If 0, the stamps are extracted
+               in the calling thread when needed.
+
+            Return
+           ------
+           stamp_stacks : Generator[SHEImageStack]
+               The stamp stack for each galaxy, in the order of `gal_ids`
+        """
+
+        if prefetch < 0:
+            raise ValueError(f"prefetch must be non-negative, but is {prefetch}")
+
+        # Make sure the detections catalogue is indexed here, so the background thread doesn't modify it
+        if not self.detections_catalogue.indices:
+            self.detections_catalogue.add_index(mfc_tf.ID)
+
+        if prefetch == 0:
+            for gal_id in gal_ids:
+                yield self.extract_galaxy_stack(gal_id, width, *args, **kwargs)
+            return
+
+        # A single worker thread reads the stamps in order, so reads of the files are never concurrent
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            gal_id_iter = iter(gal_ids)
+            futures = deque()
+
+            def submit_next():
+                for gal_id in gal_id_iter:
+                    futures.append(executor.submit(self.extract_galaxy_stack, gal_id, width, *args, **kwargs))
+                    return
+
+            for _ in range(prefetch):
+                submit_next()
+
+            while futures:
+                stamp_stack = futures.popleft().result()
+                submit_next()
+                yield stamp_stack
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def extract_psf_stacks(self, gal_id, make_stacked_psf=False, keep_header=False):
         """Extracts bulge and disk PSF stacks for a given galaxy in the detections catalogue.
 
@@ -426,26 +515,79 @@ class SHEFrameStack():
 
         return bulge_psf_stack, disk_psf_stack
 
-    def get_objects_in_observation(self, objects_coords):
-        """ Given a list (array) of object coordinates, returns the indices of the objects found in this observation"""
-        # TODO also return some structure containing info on which exposure, detector and pixels the objects can be
-        #  found in
+    def get_objects_in_observation(self, objects_coords, x_buffer=0, y_buffer=0, return_placements=False):
+        """ Given a list (array) of object coordinates, returns the indices (sorted in increasing order) of the
+            objects found in any exposure of this observation, and optionally a table of where each object is found
+            in each exposure (see get_object_placements)"""
 
-        all_inds = np.empty(0, np.int64)
-        for exposure in self.exposures:
+        placements = self.get_object_placements(objects_coords, x_buffer=x_buffer, y_buffer=y_buffer)
 
-            inds, xs, ys, detectors = exposure.get_objects_in_exposure(objects_coords)
-
-            all_inds = np.concatenate((all_inds, inds))
-
-        unique_inds = np.asarray(list(set(all_inds)))
+        unique_inds = np.unique(placements[PLACEMENT_OBJ_INDEX].data)
 
         num_objects = len(unique_inds)
 
         logger.info(f"Found {num_objects} unique objects in the observation")
 
+        if return_placements:
+            return unique_inds, placements
+
         return unique_inds
 
+    def get_object_placements(self, objects_coords, x_buffer=0, y_buffer=0):
+        """Finds which detector of each exposure each of a list of objects is on, and its pixel co-ordinates there.
+           The sky co-ordinates of all objects are transformed together for each detector they may be on, so that
+           each object's position is computed once per exposure. The positions can be passed to extract_stamp_stack
+           so that they don't need to be computed again.
+
+           Parameters
+           ----------
+           objects_coords : SkyCoord
+               The coordinates of the objects
+           x_buffer : int
+               The size of the buffer region in pixels around a detector, x-dimension
+           y_buffer : int
+               The size of the buffer region in pixels around a detector, y-dimension
+
+           Return
+           ------
+           placements : astropy.table.Table
+               Table with a row for each object in each exposure it is found in, sorted by object index then
+               exposure index, with columns:
+               - obj_index: the index of the object in objects_coords
+               - exp_index: the index of the exposure
+               - det_ix, det_iy: the indices of the detector in the exposure's detectors array
+               - x, y: the pixel co-ordinates of the object on the detector
+        """
+
+        x_world = np.atleast_1d(objects_coords.ra.deg)
+        y_world = np.atleast_1d(objects_coords.dec.deg)
+
+        l_columns = {name: [] for name in PLACEMENT_COLUMNS}
+
+        for exp_index, exposure in enumerate(self.exposures):
+
+            if exposure is None:
+                continue
+
+            det_ix, det_iy, x, y = exposure.find_positions(x_world, y_world, x_buffer=x_buffer, y_buffer=y_buffer)
+
+            obj_index = np.flatnonzero(det_ix >= 0)
+
+            l_columns[PLACEMENT_OBJ_INDEX].append(obj_index)
+            l_columns[PLACEMENT_EXP_INDEX].append(np.full(len(obj_index), exp_index, dtype=int))
+            l_columns[PLACEMENT_DET_IX].append(det_ix[obj_index])
+            l_columns[PLACEMENT_DET_IY].append(det_iy[obj_index])
+            l_columns[PLACEMENT_X].append(x[obj_index])
+            l_columns[PLACEMENT_Y].append(y[obj_index])
+
+        d_columns = {name: (np.concatenate(l_arrays) if l_arrays else np.empty(0, dtype=PLACEMENT_DTYPES[name]))
+                     for name, l_arrays in l_columns.items()}
+
+        # Sort by object, keeping the exposures in order for each object
+        order = np.argsort(d_columns[PLACEMENT_OBJ_INDEX], kind="stable")
+
+        return Table({name: array[order] for name, array in d_columns.items()})
+
     def extract_wcs_stamp_stack(self, x_world, y_world, none_if_out_of_bounds=False, extract_stacked_stamp=True,
                                 extract_exposure_stamps=True):
         """Extracts an "empty" postage stamp centred on the provided sky co-ordinates, which only contains WCS
@@ -514,7 +656,7 @@ class SHEFrameStack():
     def extract_stamp_stack(self, x_world, y_world, width, height=None, x_buffer=0, y_buffer=0,
                             keep_header=False,
                             none_if_out_of_bounds=False, extract_stacked_stamp=True,
-                            extract_exposure_stamps=True):
+                            extract_exposure_stamps=True, placements=None):
         """Extracts a postage stamp centred on the provided sky co-ordinates, by using each detector's WCS
            to determine which (if any) it lies on. If x/y_buffer >0, it will also extract from a detector if
            the position is within this many pixels of the edge of it.
@@ -544,6 +686,10 @@ class SHEFrameStack():
                If set to False, the stamp from the stacked image won't be extracted (and will be set to None)
            extract_exposure_stamps : bool
                If set to False, the stamps from the exposure images won't be extracted (and will all be set to None)
+           placements : astropy.table.Table
+               If provided, the rows for this object of the table returned by get_object_placements (e.g.
+               `placements[placements["obj_index"] == i]`). The exposure stamps are then extracted at these
+               positions rather than by transforming the sky co-ordinates again, and x/y_buffer are ignored.
 
            Return
            ------
@@ -599,9 +745,24 @@ class SHEFrameStack():
 
         # Get the stamps for each exposure
 
+        if placements is not None:
+            d_placements = {int(row[PLACEMENT_EXP_INDEX]): row for row in placements}
+
         exposure_stamps = []
-        for exposure in self.exposures:
-            if extract_exposure_stamps and exposure is not None:
+        for exp_index, exposure in enumerate(self.exposures):
+            if placements is not None and extract_exposure_stamps and exposure is not None:
+                row = d_placements.get(exp_index)
+                if row is None:
+                    exposure_stamps.append(None)
+                else:
+                    exposure_stamps.append(exposure.extract_detector_stamp(x_i=int(row[PLACEMENT_DET_IX]),
+                                                                           y_i=int(row[PLACEMENT_DET_IY]),
+                                                                           x=float(row[PLACEMENT_X]),
+                                                                           y=float(row[PLACEMENT_Y]),
+                                                                           width=width,
+                                                                           height=height,
+                                                                           keep_header=keep_header))
+            elif extract_exposure_stamps and exposure is not None:
                 exposure_stamps.append(exposure.extract_stamp(x_world=x_world,
                                                               y_world=y_world,
                                                               width=width,
@@ -674,7 +835,7 @@ class SHEFrameStack():
     def _read_product_extension(cls, product_filename, tags=None, workdir=".", dtype=None,
                                 filetype="science", load_images=True, **kwargs):
 
-        product = read_xml_product(os.path.join(workdir, product_filename))
+        product = read_xml_product(os.path.join(workdir, product_filename), use_cache=True)
 
         # Check it's the right type if necessary
         if dtype is not None and not isinstance(product, dtype):
@@ -818,8 +979,9 @@ class SHEFrameStack():
              object_id_list_product_filename: Optional[str] = None,
              workdir: str = ".",
              save_products: bool = False,
-             load_images: bool = True,
+             load_images: Union[bool, str] = True,
              prune_images: Optional[bool] = None,
+             max_workers: Optional[int] = None,
              **kwargs):
         """Reads a SHEFrameStack from relevant data products.
 
@@ -850,8 +1012,18 @@ class SHEFrameStack():
             Work directory
         save_products : bool
             If set to True, will save references to data products. Otherwise these references will be None
-        load_images : bool
-            If set to False, image data will not be loaded, and filehandles will be closed.
+        load_images : Union[bool, str]
+            If set to False, image data will not be loaded, and filehandles will be closed. If set to "lazy"
+            (SHE_PPT.she_frame.LOAD_IMAGES_LAZY), the stacked image will be loaded, and the images of each exposure
+            detector will be loaded when first needed, within the memory budget of the shared detector cache
+            (see SHEFrame.read).
+        max_workers : Optional[int]
+            If set, the exposures will be read concurrently by a pool of this many threads, while the stacked image
+            is read by the calling thread. The exposures are returned in the same order as when read serially, and
+            any exception raised while reading an exposure is raised here. If None (default), everything is read
+            serially. Each exposure is read through its own astropy file objects; the fitsio file handles which are
+            later shared to read stamps from unloaded images are locked while in use, so the frame stack can be used
+            from multiple threads.
 
         Any kwargs are passed to the reading of the fits objects
         """
@@ -976,29 +1148,103 @@ class SHEFrameStack():
         else:
             num_exposures = 0
 
-        for exposure_i in range(num_exposures):
+        def read_exposure(exposure_i):
 
             exposure_filename = cls.index_or_none(exposure_filenames, exposure_i)
             seg_filename = cls.index_or_none(seg_filenames, exposure_i)
             psf_filename = cls.index_or_none(psf_filenames, exposure_i)
 
-            exposure = SHEFrame.read(frame_product_filename=exposure_filename,
-                                     seg_product_filename=seg_filename,
-                                     psf_product_filename=psf_filename,
-                                     detections_catalogue=detections_catalogue,
-                                     prune_images=prune_images,
-                                     workdir=workdir,
-                                     save_products=save_products,
-                                     load_images=load_images,
-                                     **kwargs)
-
-            exposures.append(exposure)
-            if save_products:
+            return SHEFrame.read(frame_product_filename=exposure_filename,
+                                 seg_product_filename=seg_filename,
+                                 psf_product_filename=psf_filename,
+                                 detections_catalogue=detections_catalogue,
+                                 prune_images=prune_images,
+                                 workdir=workdir,
+                                 save_products=save_products,
+                                 load_images=load_images,
+                                 **kwargs)
+
+        if max_workers is None:
+            executor = None
+            for exposure_i in range(num_exposures):
+                exposures.append(read_exposure(exposure_i))
+        else:
+            # Start reading the exposures in the background - we collect them after reading the stacked image
+            logger.info("Reading %d exposures with %d threads", num_exposures, max_workers)
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            exposure_futures = [executor.submit(read_exposure, exposure_i) for exposure_i in range(num_exposures)]
+
+        try:
+            (stacked_image,
+             stacked_image_product,
+             stacked_segmentation_product,
+             d_stacked_hdus) = cls.__read_stacked_image(stacked_image_product_filename,
+                                                        stacked_seg_product_filename,
+                                                        workdir=workdir,
+                                                        load_images=bool(load_images),
+                                                        **kwargs)
+
+            if executor is not None:
+                # Collect the exposures in order. Any exception raised while reading an exposure is raised here
+                exposures = [future.result() for future in exposure_futures]
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        if save_products:
+            for exposure in exposures:
                 exposure_products.append(exposure.exposure_product)
                 psf_products.append(exposure.psf_product)
                 exposure_segmentation_products.append(exposure.segmentation_product)
 
-        # Load in the stacked products now
+        # Construct a SHEFrameStack object
+        new_frame_stack = SHEFrameStack(exposures=exposures,
+                                        stacked_image=stacked_image,
+                                        detections_catalogue=pruned_detections_catalogue)
+
+        # If we're saving products, add in those references
+        if save_products:
+
+            new_frame_stack.exposure_products = exposure_products
+            new_frame_stack.psf_products = psf_products
+            new_frame_stack.exposure_segmentation_products = exposure_segmentation_products
+
+            new_frame_stack.stacked_image_product = stacked_image_product
+            new_frame_stack.stacked_segmentation_product = stacked_segmentation_product
+
+            new_frame_stack.detections_catalogue_products = detections_catalogue_products
+
+            new_frame_stack.object_id_list_product = object_id_list_product
+
+        new_frame_stack._images_loaded = bool(load_images)
+
+        if not load_images:
+
+            new_frame_stack._stacked_data_filename = d_stacked_hdus["data"][0]
+            new_frame_stack._stacked_data_hdu = d_stacked_hdus["data"][1]
+
+            new_frame_stack._stacked_noisemap_filename = d_stacked_hdus["noisemap"][0]
+            new_frame_stack._stacked_noisemap_hdu = d_stacked_hdus["noisemap"][1]
+
+            new_frame_stack._stacked_mask_filename = d_stacked_hdus["mask"][0]
+            new_frame_stack._stacked_mask_hdu = d_stacked_hdus["mask"][1]
+
+            new_frame_stack._stacked_bkg_filename = d_stacked_hdus["bkg"][0]
+            new_frame_stack._stacked_bkg_hdu = d_stacked_hdus["bkg"][1]
+
+            new_frame_stack._stacked_seg_filename = d_stacked_hdus["seg"][0]
+            new_frame_stack._stacked_seg_hdu = d_stacked_hdus["seg"][1]
+
+        # Return the constructed product
+        return new_frame_stack
+
+    @classmethod
+    def __read_stacked_image(cls, stacked_image_product_filename, stacked_seg_product_filename, workdir=".",
+                             load_images=True, **kwargs):
+        """Reads the stacked image and its segmentation map, returning the stacked SHEImage (or None), the stacked
+        image and segmentation map products, and a dict of the (qualified filename, HDU index) of each of the
+        stacked images ("data", "noisemap", "mask", "bkg", "seg").
+        """
 
         # Get the stacked image and background image
 
@@ -1089,43 +1335,10 @@ class SHEFrameStack():
             if not load_images:
                 stacked_image.shape = stacked_image_shape
 
-        # Construct a SHEFrameStack object
-        new_frame_stack = SHEFrameStack(exposures=exposures,
-                                        stacked_image=stacked_image,
-                                        detections_catalogue=pruned_detections_catalogue)
-
-        # If we're saving products, add in those references
-        if save_products:
-
-            new_frame_stack.exposure_products = exposure_products
-            new_frame_stack.psf_products = psf_products
-            new_frame_stack.exposure_segmentation_products = exposure_segmentation_products
-
-            new_frame_stack.stacked_image_product = stacked_image_product
-            new_frame_stack.stacked_segmentation_product = stacked_segmentation_product
-
-            new_frame_stack.detections_catalogue_products = detections_catalogue_products
-
-            new_frame_stack.object_id_list_product = object_id_list_product
-
-        new_frame_stack._images_loaded = load_images
-
-        if not load_images:
+        d_stacked_hdus = {"data": (qualified_data_filename, data_hdu_indices[0]),
+                          "noisemap": (qualified_data_filename, data_hdu_indices[1]),
+                          "mask": (qualified_data_filename, data_hdu_indices[2]),
+                          "bkg": (qualified_bkg_filename, bkg_hdu_index),
+                          "seg": (qualified_seg_filename, seg_hdu_index), }
 
-            new_frame_stack._stacked_data_filename = qualified_data_filename
-            new_frame_stack._stacked_data_hdu = data_hdu_indices[0]
-
-            new_frame_stack._stacked_noisemap_filename = qualified_data_filename
-            new_frame_stack._stacked_noisemap_hdu = data_hdu_indices[1]
-
-            new_frame_stack._stacked_mask_filename = qualified_data_filename
-            new_frame_stack._stacked_mask_hdu = data_hdu_indices[2]
-
-            new_frame_stack._stacked_bkg_filename = qualified_bkg_filename
-            new_frame_stack._stacked_bkg_hdu = bkg_hdu_index
-
-            new_frame_stack._stacked_seg_filename = qualified_seg_filename
-            new_frame_stack._stacked_seg_hdu = seg_hdu_index
-
-        # Return the constructed product
-        return new_frame_stack
+        return stacked_image, stacked_image_product, stacked_segmentation_product, d_stacked_hdus
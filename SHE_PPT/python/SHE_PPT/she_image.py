@@ -23,7 +23,9 @@ __updated__ = "2022-02-25"
 # the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import os
+import threading
 import weakref
+from collections import OrderedDict, namedtuple
 from copy import deepcopy
 from functools import lru_cache
 from typing import Any, Dict, Iterable, Literal, Optional, Sequence, TYPE_CHECKING, Tuple, Type, TypeVar, Union
@@ -46,9 +48,11 @@ from .constants.fits import (BACKGROUND_TAG, CCDID_LABEL, EXPTIME_LABEL, GAIN_LA
                              SEGMENTATION_TAG,
                              WEIGHT_TAG, ZERO_POINT_LABEL, )
 from .constants.misc import SEGMAP_UNASSIGNED_VALUE
+from .coordinates import radec_to_unit_vectors
 from .file_io import DEFAULT_WORKDIR, write_fits
 from .mask import as_bool, is_masked_bad, is_masked_suspect_or_bad
 from .utility import neq
+from .wcs_approximation import ApproximateWCS, get_decompositions
 
 if TYPE_CHECKING:
     from .she_frame_stack import SHEFrameStack
@@ -65,6 +69,10 @@ KEY_Y_OFFSET = "SHEIOFY"
 DETECTOR_SHAPE = (4096, 4136)
 DEFAULT_STAMP_SIZE = 384
 
+# Side length of the tiles used to cache images read from FITS files, and the default memory budget for the cache
+DEFAULT_TILE_SIZE = 128
+DEFAULT_TILE_CACHE_NBYTES = 1024 ** 3
+
 # TODO: Replace use of indexconv with origin
 D_INDEXCONV_DEFS = {"numpy": 0.0,
                     "sextractor": 0.5}
@@ -106,10 +114,15 @@ MSG_ADDING_DEFAULT_ATTR = "Adding default `%s` to `SHEImage`."
 logger = logging.getLogger(__name__)
 
 
+# Lock held while getting or using the cached fitsio handles below. These are shared by all threads, and fitsio
+# handles can't safely be used by more than one thread at once
+_fits_handle_lock = threading.RLock()
+
+
 @lru_cache(maxsize=50)
 def _get_fits_handle(qualified_filename: str) -> fitsio.FITS:
     """Private function to open a FITS file handle from a filename. Uses caching to limit number of open
-    FITS file handles to 50.
+    FITS file handles to 50. The handle must only be used while holding `_fits_handle_lock`.
     """
     f = fitsio.FITS(qualified_filename)
     return f
@@ -119,23 +132,147 @@ def _get_fits_handle(qualified_filename: str) -> fitsio.FITS:
 def _get_hdu_handle(qualified_filename: str,
                     hdu_i: Union[int, str]) -> fitsio.hdu.base.HDUBase:
     """Private function to open a FITS HDU file handle from a filename and HDU index. Uses caching to limit number of
-    open HDU file handles to 50.
+    open HDU file handles to 50. The handle must only be used while holding `_fits_handle_lock`.
     """
     h = _get_fits_handle(qualified_filename)[hdu_i]
     return h
 
 
-@lru_cache(maxsize=2000)
+def _read_hdu(qualified_filename: str,
+              hdu_i: Union[int, str]) -> np.ndarray:
+    """Private function to read all the data of a FITS HDU through the cached HDU file handles.
+    """
+    with _fits_handle_lock:
+        return _get_hdu_handle(qualified_filename, hdu_i).read()
+
+
+TileCacheInfo = namedtuple("TileCacheInfo", ["hits", "misses", "n_tiles", "nbytes", "max_nbytes"])
+
+
+class FitsTileCache:
+    """Cache of square tiles of the images in FITS files, used to read stamps from images which haven't been loaded
+    into memory. Stamps are assembled from the tiles they overlap, so neighbouring and overlapping stamps share the
+    cached tiles rather than re-reading the same data. The least-recently-used tiles are discarded to keep the total
+    size of the cached tiles within a memory budget.
+
+    Attributes
+    ----------
+    max_nbytes : int
+        The memory budget for the cached tiles in bytes
+    tile_size : int
+        The side length of the tiles in pixels
+    """
+
+    def __init__(self,
+                 max_nbytes: int = DEFAULT_TILE_CACHE_NBYTES,
+                 tile_size: int = DEFAULT_TILE_SIZE):
+
+        self.max_nbytes = max_nbytes
+        self.tile_size = tile_size
+
+        self._tiles: "OrderedDict[Tuple[str, Union[int, str], int, int], np.ndarray]" = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def read_stamp(self,
+                   xmin: int,
+                   ymin: int,
+                   xmax: int,
+                   ymax: int,
+                   qualified_filename: str,
+                   hdu_i: Union[int, str]) -> np.ndarray:
+        """Reads a stamp, which must lie within the image, from a FITS file, returning it indexed as (x,y).
+        """
+
+        t = self.tile_size
+
+        with self._lock:
+            with _fits_handle_lock:
+                hdu = _get_hdu_handle(qualified_filename, hdu_i)
+
+            stamp = None
+
+            for tile_iy in range(ymin // t, (ymax - 1) // t + 1):
+                for tile_ix in range(xmin // t, (xmax - 1) // t + 1):
+                    tile = self._get_tile(hdu, qualified_filename, hdu_i, tile_ix, tile_iy)
+
+                    if stamp is None:
+                        stamp = np.empty((ymax - ymin, xmax - xmin), dtype=tile.dtype)
+
+                    # The overlap of the stamp and the tile, in image coordinates
+                    y0, y1 = max(ymin, tile_iy * t), min(ymax, (tile_iy + 1) * t)
+                    x0, x1 = max(xmin, tile_ix * t), min(xmax, (tile_ix + 1) * t)
+
+                    stamp[y0 - ymin:y1 - ymin, x0 - xmin:x1 - xmin] = tile[y0 - tile_iy * t:y1 - tile_iy * t,
+                                                                           x0 - tile_ix * t:x1 - tile_ix * t]
+
+        return stamp.transpose()
+
+    def cache_info(self) -> TileCacheInfo:
+        """Returns the hit and miss statistics (counted per tile) and current size of the cache.
+        """
+        with self._lock:
+            return TileCacheInfo(self._hits, self._misses, len(self._tiles), self._nbytes, self.max_nbytes)
+
+    def cache_clear(self) -> None:
+        """Discards all cached tiles and resets the statistics.
+        """
+        with self._lock:
+            self._tiles.clear()
+            self._nbytes = 0
+            self._hits = 0
+            self._misses = 0
+
+    def _get_tile(self,
+                  hdu: fitsio.hdu.base.HDUBase,
+                  qualified_filename: str,
+                  hdu_i: Union[int, str],
+                  tile_ix: int,
+                  tile_iy: int) -> np.ndarray:
+        """Private method to get a tile (indexed as (y,x)) from the cache, or read it from the file if it isn't cached.
+        """
+
+        key = (qualified_filename, hdu_i, tile_ix, tile_iy)
+
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._hits += 1
+            self._tiles.move_to_end(key)
+            return tile
+
+        self._misses += 1
+
+        t = self.tile_size
+        with _fits_handle_lock:
+            ny, nx = hdu.get_dims()
+            tile = hdu[tile_iy * t:min((tile_iy + 1) * t, ny), tile_ix * t:min((tile_ix + 1) * t, nx)]
+
+        self._tiles[key] = tile
+        self._nbytes += tile.nbytes
+
+        # Discard the least-recently-used tiles until we're within the budget
+        while self._nbytes > self.max_nbytes and self._tiles:
+            _, old_tile = self._tiles.popitem(last=False)
+            self._nbytes -= old_tile.nbytes
+
+        return tile
+
+
+# The cache used by SHEImage to read stamps from images which aren't loaded
+stamp_tile_cache = FitsTileCache()
+
+
 def _read_stamp(xmin: int,
                 ymin: int,
                 xmax: int,
                 ymax: int,
                 qualified_filename: str,
                 hdu_i: Union[int, str]) -> np.ndarray:
-    """Private function to read a stamp from a FITS file. Uses caching to limit number of stamps in memory to 2000.
+    """Private function to read a stamp from a FITS file, through the tile cache `stamp_tile_cache`.
     """
-    data = _get_hdu_handle(qualified_filename, hdu_i)[ymin:ymax, xmin:xmax].transpose()
-    return data
+    return stamp_tile_cache.read_stamp(xmin, ymin, xmax, ymax, qualified_filename, hdu_i)
 
 
 def _return_none() -> None:
@@ -167,6 +304,7 @@ class SHEImage:
     offset : Tuple[float,float]
     wcs : Optional[astropy.wcs.WCS]
     galsim_wcs : Optional[galsim.wcs.BaseWCS]
+    wcs_approximation : Optional[ApproximateWCS]
     shape : Tuple[int, int]
     det_ix : int
     det_iy : int
@@ -192,6 +330,7 @@ class SHEImage:
     _wcs = None
     _shape: Optional[Tuple[int, int]] = None
     _galsim_wcs = None
+    _wcs_approximation: Optional[ApproximateWCS] = None
     _det_ix: Optional[int] = None
     _det_iy: Optional[int] = None
     _qualified_science_data_filename = None
@@ -738,8 +877,9 @@ class SHEImage:
             raise TypeError("`wcs` must be None or an instance of `astropy.wcs.WCS`")
         self._wcs = wcs
 
-        # Unload the galsim wcs
+        # Unload the galsim wcs and the approximation to the wcs
         self._galsim_wcs = None
+        self._wcs_approximation = None
 
     @wcs.deleter
     def wcs(self) -> None:
@@ -747,6 +887,7 @@ class SHEImage:
         """
         self._wcs = None
         self._galsim_wcs = None
+        self._wcs_approximation = None
 
     @property
     def galsim_wcs(self) -> Optional[galsim.wcs.BaseWCS]:
@@ -790,6 +931,41 @@ class SHEImage:
         """
         self._galsim_wcs = None
 
+    @property
+    def wcs_approximation(self) -> Optional[ApproximateWCS]:
+        """The approximation to the WCS used for coordinate transformations, if one has been set up with
+        `set_up_wcs_approximation`.
+
+        Returns
+        -------
+        wcs_approximation : Optional[ApproximateWCS]
+            The approximation to the WCS, if present; None otherwise.
+        """
+        return self._wcs_approximation
+
+    @wcs_approximation.setter
+    def wcs_approximation(self, wcs_approximation: Optional[ApproximateWCS]) -> None:
+        """Convenience setter of the WCS approximation, e.g. to share the approximation of a detector's WCS with
+        stamps extracted from it.
+
+        Parameters
+        ----------
+        wcs_approximation : Optional[ApproximateWCS]
+            The approximation to the WCS. This must approximate this object's `wcs`.
+        """
+        if wcs_approximation is not None:
+            if not isinstance(wcs_approximation, ApproximateWCS):
+                raise TypeError("`wcs_approximation` must be None or an instance of `ApproximateWCS`")
+            if wcs_approximation.wcs is not self.wcs:
+                raise ValueError("`wcs_approximation` must be an approximation of this object's `wcs`")
+        self._wcs_approximation = wcs_approximation
+
+    @wcs_approximation.deleter
+    def wcs_approximation(self) -> None:
+        """Simple deleter for the `wcs_approximation` attribute.
+        """
+        self._wcs_approximation = None
+
     @property
     def shape(self) -> Tuple[int, int]:
         """The shape of the image, equivalent to `self.data.shape`.
@@ -1414,6 +1590,9 @@ class SHEImage:
                              parent_image=self,
                              )
 
+        # Share the approximation to the WCS (which is in the parent's pixel coordinates) with the stamp
+        new_image.wcs_approximation = self.wcs_approximation
+
         if not np.all(new_image.shape == (width, height)):
             raise ValueError(f"The extracted stamp has shape {new_image.shape}, but the requested shape was "
                              f"{(width, height)}. This could perhaps be due to the image's `shape` attribute being "
@@ -1551,6 +1730,45 @@ class SHEImage:
 
         self.wcs = astropy.wcs.WCS(Header())
 
+    def set_up_wcs_approximation(self,
+                                 **kwargs: Union[int, float]) -> ApproximateWCS:
+        """Sets up an approximation to this object's WCS over the area of the image, which is then used by this
+        object (and stamps extracted from it) for the vectorised coordinate transformations: `pix2world` and
+        `world2pix` with arrays of coordinates, `get_pix2world_jacobians`, `get_pix2world_decompositions` and
+        `get_world2pix_decompositions`. Transformations of single positions always use the exact WCS, as the
+        overhead of the approximation makes it slower for them.
+
+        The approximation fits low-order polynomials to the WCS, and is validated to be within an error bound. If the
+        bound can't be met, or for positions outside of the image, the exact WCS is used instead.
+
+        Parameters
+        ----------
+        **kwargs : Union[int, float]
+            Keyword arguments (max_error, max_jacobian_error, max_order, n_fit) to pass to the initializer of
+            `ApproximateWCS`.
+
+        Raises
+        ------
+        AttributeError
+            This object does not have a wcs set up
+
+        Return
+        ------
+        ApproximateWCS
+            The approximation to the WCS.
+        """
+
+        if self.wcs is None:
+            raise AttributeError("`set_up_wcs_approximation` called by SHEImage object that doesn't have a WCS set up.")
+
+        # Cover the full area of all pixels, in the pixel coordinates of the wcs
+        xmin, ymin = self.offset - 0.5
+        xmax, ymax = self.offset + np.array(self.shape) - 0.5
+
+        self._wcs_approximation = ApproximateWCS(self.wcs, xmin, xmax, ymin, ymax, **kwargs)
+
+        return self._wcs_approximation
+
     def pix2world(self,
                   x: Union[float, Sequence[float]],
                   y: Union[float, Sequence[float]],
@@ -1589,7 +1807,11 @@ class SHEImage:
             x = x + self.offset[0]
             y = y + self.offset[1]
 
-        ra, dec = self.wcs.all_pix2world(x, y, origin)
+        # The approximation is only faster than the exact WCS for arrays of coordinates
+        if self.wcs_approximation is not None and (np.ndim(x) > 0 or np.ndim(y) > 0):
+            ra, dec = self.wcs_approximation.pix2world(x, y, origin)
+        else:
+            ra, dec = self.wcs.all_pix2world(x, y, origin)
 
         # If input was scalars, output scalars
         if (not hasattr(x, '__len__')) and (not hasattr(y, '__len__')):
@@ -1632,7 +1854,11 @@ class SHEImage:
         if self.wcs is None:
             raise AttributeError("`world2pix` called by SHEImage object that doesn't have a WCS set up.")
 
-        x, y = self.wcs.all_world2pix(ra, dec, origin)
+        # The approximation is only faster than the exact WCS for arrays of coordinates
+        if self.wcs_approximation is not None and (np.ndim(ra) > 0 or np.ndim(dec) > 0):
+            x, y = self.wcs_approximation.world2pix(ra, dec, origin)
+        else:
+            x, y = self.wcs.all_world2pix(ra, dec, origin)
 
         # Correct for offset if applicable
         if self.offset is not None:
@@ -2074,6 +2300,149 @@ class SHEImage:
 
         return local_wcs.inverse().getDecomposition()
 
+    def get_pix2world_jacobians(self,
+                                x: Sequence[float],
+                                y: Sequence[float],
+                                origin: Literal[0, 1] = 0) -> np.ndarray[float]:
+        """Gets the local Jacobians of the transformation between image (x/y) and world coordinates at many locations
+        at once, in the convention of `galsim.wcs.JacobianWCS` (arcsec per pixel, with +u pointing west and +v
+        pointing north). This is fastest if an approximation to the WCS has been set up with
+        `set_up_wcs_approximation`.
+
+        Parameters
+        ----------
+        x : Sequence[float]
+            x pixel coordinates
+        y : Sequence[float]
+            idem for y
+        origin : {0, 1}
+            Coordinate in the upper left corner of the image.
+            In FITS and Fortran standards, this is 1.
+            In Numpy and C standards this is 0.
+            (from astropy.wcs)
+
+        Raises
+        ------
+        AttributeError
+            This object does not have a wcs set up
+
+        Returns
+        -------
+        jacobians : np.ndarray[float]
+            Array of shape (..., 2, 2) of the Jacobians in the format [[ du/dx , du/dy ],
+                                                                      [ dv/dx , dv/dy ]]
+        """
+
+        if self.wcs is None:
+            raise AttributeError("`get_pix2world_jacobians` called by SHEImage object that doesn't have a WCS set up.")
+
+        # Correct for offset
+        x = np.asarray(x, dtype=float) + self.offset[0]
+        y = np.asarray(y, dtype=float) + self.offset[1]
+
+        if self.wcs_approximation is not None:
+            return self.wcs_approximation.local_jacobians(x, y, origin)
+
+        # GalSim assumes origin of 1, so correct for that
+        jacobians = [self.galsim_wcs.jacobian(image_pos=galsim.PositionD(x_i + 1 - origin,
+                                                                         y_i + 1 - origin)).getMatrix()
+                     for x_i, y_i in zip(x.ravel(), y.ravel())]
+
+        return np.reshape(jacobians, x.shape + (2, 2))
+
+    def get_pix2world_decompositions(self,
+                                     x: Sequence[float],
+                                     y: Sequence[float],
+                                     origin: Literal[0, 1] = 0) -> Tuple[np.ndarray[float],
+                                                                         np.ndarray[float],
+                                                                         np.ndarray[float],
+                                                                         np.ndarray[float],
+                                                                         np.ndarray[bool]]:
+        """Vectorised version of `get_pix2world_decomposition`, which gets the local WCS decompositions between image
+        (x/y) and world (ra/dec) coordinates at many locations at once. This is fastest if an approximation to the WCS
+        has been set up with `set_up_wcs_approximation`.
+
+        Parameters
+        ----------
+        x : Sequence[float]
+            x pixel coordinates
+        y : Sequence[float]
+            idem for y
+        origin : {0, 1}
+            Coordinate in the upper left corner of the image.
+            In FITS and Fortran standards, this is 1.
+            In Numpy and C standards this is 0.
+            (from astropy.wcs)
+
+        Raises
+        ------
+        AttributeError
+            This object does not have a wcs set up
+
+        Returns
+        -------
+        scale : np.ndarray[float]
+            Scale factors of the decompositions
+        g1 : np.ndarray[float]
+            g1 components of the shears of the decompositions
+        g2 : np.ndarray[float]
+            g2 components of the shears of the decompositions
+        theta : np.ndarray[float]
+            Rotation angles of the decompositions in radians
+        flip : np.ndarray[bool]
+            Whether or not the WCS includes a flip at each location
+        """
+
+        return get_decompositions(self.get_pix2world_jacobians(x, y, origin))
+
+    def get_world2pix_decompositions(self,
+                                     ra: Sequence[float],
+                                     dec: Sequence[float]) -> Tuple[np.ndarray[float],
+                                                                    np.ndarray[float],
+                                                                    np.ndarray[float],
+                                                                    np.ndarray[float],
+                                                                    np.ndarray[bool]]:
+        """Vectorised version of `get_world2pix_decomposition`, which gets the local WCS decompositions between world
+        (ra/dec) and pixel coordinates at many locations at once. This is fastest if an approximation to the WCS has
+        been set up with `set_up_wcs_approximation`.
+
+        Parameters
+        ----------
+        ra : Sequence[float]
+            Right Ascension (RA) world coordinates in degrees
+        dec : Sequence[float]
+            idem for Declination
+
+        Raises
+        ------
+        AttributeError
+            This object does not have a wcs set up
+
+        Returns
+        -------
+        scale : np.ndarray[float]
+            Scale factors of the decompositions
+        g1 : np.ndarray[float]
+            g1 components of the shears of the decompositions
+        g2 : np.ndarray[float]
+            g2 components of the shears of the decompositions
+        theta : np.ndarray[float]
+            Rotation angles of the decompositions in radians
+        flip : np.ndarray[bool]
+            Whether or not the WCS includes a flip at each location
+        """
+
+        if self.wcs is None:
+            raise AttributeError("`get_world2pix_decompositions` called by SHEImage object that doesn't have a WCS "
+                                 "set up.")
+
+        # Get the pix2world Jacobians at the pixel positions of the objects, and invert them
+        x, y = self.world2pix(np.asarray(ra, dtype=float), np.asarray(dec, dtype=float))
+
+        pix2world_jacobians = self.get_pix2world_jacobians(x, y)
+
+        return get_decompositions(np.linalg.inv(pix2world_jacobians))
+
     # TODO: Remove these deprecated methods
     @deprecated("9.1",
                 message="To get rotation matrix, please use `get_pix2world_rotation`, and to get "
@@ -2220,7 +2589,8 @@ class SHEImage:
                                 objects_coords: SkyCoord,
                                 x_buffer: float = 0.,
                                 y_buffer: float = 0.,
-                                origin: Literal[0, 1] = 0):
+                                origin: Literal[0, 1] = 0,
+                                objects_vectors: Optional[np.ndarray[float]] = None):
         """Returns an array containing the indices of the objects in the detector, and arrays of the x and y pixel
         coordinates for these objects.
 
@@ -2238,6 +2608,10 @@ class SHEImage:
             In FITS and Fortran standards, this is 1.
             In Numpy and C standards this is 0.
             (from astropy.wcs)
+        objects_vectors : Optional[np.ndarray[float]]
+            Array of shape (N, 3) of the unit vectors of the objects on the celestial sphere, as returned by
+            `SHE_PPT.coordinates.radec_to_unit_vectors`. If checking the same objects against many detectors,
+            this can be computed once and passed to each call to save time; otherwise it will be computed here.
 
         Returns
         -------
@@ -2249,34 +2623,55 @@ class SHEImage:
             idem for y
         """
 
+        l_ra: np.ndarray[float] = np.atleast_1d(objects_coords.ra.deg)
+        l_dec: np.ndarray[float] = np.atleast_1d(objects_coords.dec.deg)
+
+        if objects_vectors is None:
+            objects_vectors = radec_to_unit_vectors(l_ra, l_dec)
+
         nx = float(self.shape[0])
         ny = float(self.shape[1])
 
-        # Get the sky coordinates of the centre pixels in the detector
-        sc_centre_coords = SkyCoord(*self.pix2world(x=np.array((nx + 1) / 2),
-                                                    y=np.array((ny + 1) / 2),
-                                                    origin=1), unit='deg')
-
-        # now get the sky coords for the 4 corners of the image, using convention where first pixel is indexed as 1
-        sc_corners_coords = SkyCoord(*self.pix2world(x=[1 - x_buffer, nx + x_buffer, nx + x_buffer, 1 - x_buffer],
-                                                     y=[1 - y_buffer, 1 - y_buffer, ny + y_buffer, ny + y_buffer],
-                                                     origin=1), unit='deg')
+        # Get the unit vectors of the centre pixel in the detector and the 4 corners of the image, using convention
+        # where first pixel is indexed as 1
+        ras, decs = self.pix2world(x=np.array([(nx + 1) / 2, 1 - x_buffer, nx + x_buffer, nx + x_buffer, 1 - x_buffer]),
+                                   y=np.array([(ny + 1) / 2, 1 - y_buffer, 1 - y_buffer, ny + y_buffer, ny + y_buffer]),
+                                   origin=1)
+        vectors = radec_to_unit_vectors(ras, decs)
+        centre = vectors[0]
 
         # now measure the angular distance between the corners and the image centre, and get the maximum distance (
         # plus a 5% tolerance) away from the centre
-        max_dist = sc_corners_coords.separation(sc_centre_coords).deg.max() * 1.05
+        max_dist = np.arccos(np.clip(vectors[1:] @ centre, -1., 1.)).max() * 1.05
+
+        # we consider objects only closer to the centre than max_dist as candidates for being in the image, which we
+        # test by comparing the dot product of their unit vectors with that of the centre to cos(max_dist)
+        l_candidate_indices: np.ndarray[int] = np.flatnonzero(objects_vectors @ centre >= np.cos(min(max_dist, np.pi)))
 
-        # get the distances of all objects from the centre pixel of the detector
-        # we consider objects only closer to the centre than max_dist as candidates for being in the image
-        l_candidate_indices: np.ndarray[int] = np.where(objects_coords.separation(sc_centre_coords).deg <= max_dist)[0]
+        return self._confirm_objects_in_detector(l_ra, l_dec, l_candidate_indices,
+                                                 x_buffer=x_buffer,
+                                                 y_buffer=y_buffer,
+                                                 origin=origin)
 
-        # For these candidates, get their sky coords and convert them into pixel coordinates
-        sc_candidate_coords = objects_coords[l_candidate_indices]
+    def _confirm_objects_in_detector(self,
+                                     l_ra: np.ndarray[float],
+                                     l_dec: np.ndarray[float],
+                                     l_candidate_indices: np.ndarray[int],
+                                     x_buffer: float = 0.,
+                                     y_buffer: float = 0.,
+                                     origin: Literal[0, 1] = 0):
+        """Protected method to check which candidate objects are in the detector, returning their indices and
+        their x and y pixel coordinates in the same format as `get_objects_in_detector`.
+        """
+
+        nx = float(self.shape[0])
+        ny = float(self.shape[1])
 
+        # For these candidates, convert their sky coords into pixel coordinates
         l_x_candidates: np.ndarray[float]
         l_y_candidates: np.ndarray[float]
-        l_x_candidates, l_y_candidates = self.world2pix(ra=sc_candidate_coords.ra,
-                                                        dec=sc_candidate_coords.dec,
+        l_x_candidates, l_y_candidates = self.world2pix(ra=l_ra[l_candidate_indices],
+                                                        dec=l_dec[l_candidate_indices],
                                                         origin=origin)
 
         # now check if these pixel coordinates are in the image
@@ -26,6 +26,12 @@
 
 
 import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from astropy.io import fits
 from astropy.wcs import WCS
 
@@ -34,12 +40,44 @@ import json
 
 import ElementsKernel.Logging as log
 
+from ST_DM_DmUtils.DmUtils import read_product_metadata
+
 from .profiling import io_stats
 
+# hdf5plugin provides the blosc and zstd filters. It is optional, and only needed for these compression options
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
 logger = log.getLogger(__name__)
 
+# Compression options for convert_to_hdf5 ("blosc" and "zstd" require hdf5plugin)
+COMPRESSION_OPTIONS = ("gzip", "lzf", "blosc", "zstd", None)
+
+# gzip compression level (the h5py default)
+GZIP_LEVEL = 4
 
-def convert_to_hdf5(det_file, bkg_file, wgt_file, seg_file, output_filename, chunk=None):
+# Typical stamp size (matches SHE_PPT.she_image.DEFAULT_STAMP_SIZE), used to choose chunk shapes with chunk="auto"
+DEFAULT_STAMP_SIZE = 384
+
+# With chunk="auto", the chunks are 1/CHUNKS_PER_STAMP of the stamp size along each axis, so that a stamp at an
+# arbitrary position reads about (1 + 1/CHUNKS_PER_STAMP)**2 times its own area, from at most
+# (CHUNKS_PER_STAMP + 1)**2 chunks
+CHUNKS_PER_STAMP = 4
+
+
+def convert_to_hdf5(
+    det_file,
+    bkg_file,
+    wgt_file,
+    seg_file,
+    output_filename,
+    chunk=None,
+    compression="gzip",
+    shuffle=False,
+    max_workers=None,
+):
     """
     Converts a set of FITS files corresponding to a VIS exposure to a HDF5 file
 
@@ -50,18 +88,24 @@ def convert_to_hdf5(det_file, bkg_file, wgt_file, seg_file, output_filename, chu
       - seg_file: The reprojected segmentation map FITS filename
       - output_filename: The name of the created hdf5 file
       - chunk: [optional] whether to chunk the file or not. If chunking is requested, this should be a tuple
-        of integers denoting the chunk size
+        of integers denoting the chunk size, or "auto" to use chunks matched to the stamp size (see get_chunk_shape)
+      - compression: [optional] the compression to use if chunking is enabled, one of "gzip" (default), "lzf",
+        "blosc", "zstd" or None. "blosc" and "zstd" need the hdf5plugin package (and it must also be installed to
+        read the file)
+      - shuffle: [optional] whether to apply the shuffle filter before compressing, which usually improves the
+        compression ratio of floating point images
+      - max_workers: [optional] the number of worker threads used to read (and for gzip, compress) detectors while
+        the main thread writes previous detectors to the output file. If None (default), the detectors are
+        converted serially
 
     """
 
+    if compression not in COMPRESSION_OPTIONS:
+        raise ValueError("Compression %s not known. Choose from %s" % (compression, COMPRESSION_OPTIONS))
+
     if os.path.exists(output_filename):
         logger.warning("Output file %s exists. This will be overwritten!", output_filename)
 
-    if chunk is None:
-        logger.info("No chunking will be applied to the output file")
-    else:
-        logger.info("Using chunks of size %s in the output file", chunk)
-
     # open the FITS files
     # Do not memory map. We read a detector in one at a time and convert it. Memory mapping only slows this down
     logger.info("Opening %s", det_file)
@@ -94,6 +138,16 @@ def convert_to_hdf5(det_file, bkg_file, wgt_file, seg_file, output_filename, chu
 
     assert len(sci_list) == len(rms_list) == len(flg_list) == n_det
 
+    if chunk == "auto":
+        chunk = get_chunk_shape(sci_list[0].shape)
+
+    if chunk is None:
+        logger.info("No chunking will be applied to the output file")
+    else:
+        logger.info("Using chunks of size %s in the output file, with %s compression", chunk, compression)
+
+    filter_kwargs = get_filter_kwargs(compression, shuffle) if chunk else {}
+
     detector_names = []
     if "QUADID" in det_hdul[1].header:
         for k in range(n_det):
@@ -130,40 +184,176 @@ def convert_to_hdf5(det_file, bkg_file, wgt_file, seg_file, output_filename, chu
     logger.info("Set the detector, header and wcs list attributes")
 
     logger.info(detector_names)
-    # make the datasets
-    for name, sci, rms, flg, wgt, bkg, seg, wcs in zip(
-        detector_names, sci_list, rms_list, flg_list, wgt_list, bkg_list, seg_list, wcs_list
-    ):
-
-        @io_stats
-        def create_dataset_from_hdu(group, name, hdu, chunk):
-            # NOTE: If chunking is requested, we want to compress the images.
-            # This saves disk space. If chunking is not enabled, it is not possible to
-            # compress the data :(
-            if chunk:
-                compression = "gzip"
-            else:
-                compression = None
-            ds = group.create_dataset(name, data=hdu.data, chunks=chunk, compression=compression)
-            ds.attrs["header"] = hdu.header.tostring()
-
-            logger.info("Created dataset %s", ds.name)
-
-            # ensure the HDU's data is cleaned up by the garbage collector
-            del hdu.data
-
-            return ds
 
+    dataset_names = ("sci", "rms", "flg", "wgt", "bkg", "seg")
+    hdu_lists = (sci_list, rms_list, flg_list, wgt_list, bkg_list, seg_list)
+
+    # Each FITS file can only be read by one thread at a time, so give each file a lock
+    file_locks = {id(hdul): threading.Lock() for hdul in (det_hdul, bkg_hdul, wgt_hdul, seg_hdul)}
+    hdu_locks = [file_locks[id(det_hdul)]] * 3 + [file_locks[id(wgt_hdul)], file_locks[id(bkg_hdul)]]
+    hdu_locks.append(file_locks[id(seg_hdul)])
+
+    # We compress gzip chunks ourselves in the worker threads (zlib releases the GIL), as HDF5 can only compress
+    # in the thread writing the data
+    precompress = max_workers is not None and chunk is not None and compression == "gzip"
+
+    def read_detector(det_i):
+        images = []
+        for dataset_name, hdu_list, lock in zip(dataset_names, hdu_lists, hdu_locks):
+            hdu = hdu_list[det_i]
+            with lock:
+                data = hdu.data
+                # ensure the HDU's data is cleaned up by the garbage collector
+                del hdu.data
+            compressed_chunks = _compress_gzip_chunks(data, chunk, shuffle) if precompress else None
+            images.append((dataset_name, hdu.header.tostring(), data, compressed_chunks))
+        return images
+
+    @io_stats
+    def create_detector_group(name, wcs, images):
         logger.info("Creating group %s", name)
         g = h.create_group(name)
         g.attrs["wcs"] = wcs.to_header_string()
 
-        create_dataset_from_hdu(g, "sci", sci, chunk)
-        create_dataset_from_hdu(g, "rms", rms, chunk)
-        create_dataset_from_hdu(g, "flg", flg, chunk)
-        create_dataset_from_hdu(g, "wgt", wgt, chunk)
-        create_dataset_from_hdu(g, "bkg", bkg, chunk)
-        create_dataset_from_hdu(g, "seg", seg, chunk)
+        for dataset_name, header_str, data, compressed_chunks in images:
+            if compressed_chunks is None:
+                ds = g.create_dataset(dataset_name, data=data, chunks=chunk, **filter_kwargs)
+            else:
+                ds = g.create_dataset(dataset_name, shape=data.shape, dtype=data.dtype, chunks=chunk, **filter_kwargs)
+                for chunk_offset, chunk_bytes in compressed_chunks:
+                    ds.id.write_direct_chunk(chunk_offset, chunk_bytes)
+            ds.attrs["header"] = header_str
+
+            logger.info("Created dataset %s", ds.name)
+
+    if max_workers is None:
+        for det_i, (name, wcs) in enumerate(zip(detector_names, wcs_list)):
+            create_detector_group(name, wcs, read_detector(det_i))
+    else:
+        # Pipeline the conversion: the worker threads read detectors ahead of the main thread, which writes them
+        # in order. Only a limited number of detectors are read ahead, to bound the memory used.
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = deque()
+            for det_i in range(min(2 * max_workers, n_det)):
+                futures.append(executor.submit(read_detector, det_i))
+            for det_i, (name, wcs) in enumerate(zip(detector_names, wcs_list)):
+                images = futures.popleft().result()
+                if det_i + len(futures) + 1 < n_det:
+                    futures.append(executor.submit(read_detector, det_i + len(futures) + 1))
+                create_detector_group(name, wcs, images)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     logger.info("Closing the output file %s", output_filename)
     h.close()
+
+
+def convert_exposures_to_hdf5(vis_prods, seg_prods, output_filenames, workdir=".", **kwargs):
+    """
+    Converts a list of VIS exposures to HDF5 files, which can be read with
+    read_vis_data(..., method="hdf5", hdf5_files=output_filenames)
+
+    Inputs:
+      - vis_prods: a list of VIS product (DpdVisCalibratedFrame) filenames
+      - seg_prods: a list of reprojected segmentation map product filenames
+      - output_filenames: a list of the HDF5 filenames to create (relative to the workdir)
+      - workdir: the workdir
+      - **kwargs: keyword arguments passed to convert_to_hdf5 (chunk, compression, shuffle, max_workers)
+
+    """
+
+    if not len(vis_prods) == len(seg_prods) == len(output_filenames):
+        raise ValueError(
+            "Number of VIS products (%d), segmentation map products (%d) and output filenames (%d) differ"
+            % (len(vis_prods), len(seg_prods), len(output_filenames))
+        )
+
+    datadir = os.path.join(workdir, "data")
+
+    for vis_prod, seg_prod, output_filename in zip(vis_prods, seg_prods, output_filenames):
+        vis_dpd = read_product_metadata(os.path.join(workdir, vis_prod))
+        seg_dpd = read_product_metadata(os.path.join(workdir, seg_prod))
+
+        convert_to_hdf5(
+            os.path.join(datadir, vis_dpd.Data.DataStorage.DataContainer.FileName),
+            os.path.join(datadir, vis_dpd.Data.BackgroundStorage.DataContainer.FileName),
+            os.path.join(datadir, vis_dpd.Data.WeightStorage.DataContainer.FileName),
+            os.path.join(datadir, seg_dpd.Data.DataStorage.DataContainer.FileName),
+            os.path.join(workdir, output_filename),
+            **kwargs
+        )
+
+
+def get_chunk_shape(shape, stamp_size=DEFAULT_STAMP_SIZE):
+    """
+    Returns a chunk shape matched to the size of the stamps that will be read from an image
+
+    Inputs:
+      - shape: the shape of the image
+      - stamp_size: the (typical) size of the stamps
+
+    Returns:
+      - chunk: the chunk shape, with sides of stamp_size / CHUNKS_PER_STAMP (no larger than the image)
+    """
+
+    side = max(stamp_size // CHUNKS_PER_STAMP, 1)
+
+    return tuple(min(side, n) for n in shape)
+
+
+def get_filter_kwargs(compression, shuffle=False):
+    """
+    Returns the keyword arguments to pass to h5py.Group.create_dataset for the requested compression
+
+    Inputs:
+      - compression: one of COMPRESSION_OPTIONS
+      - shuffle: whether to shuffle the data before compressing it
+
+    Returns:
+      - kwargs: dictionary of keyword arguments
+    """
+
+    if compression in ("blosc", "zstd") and hdf5plugin is None:
+        logger.warning("hdf5plugin is not available for %s compression. Using gzip compression", compression)
+        compression = "gzip"
+
+    if compression is None:
+        return {}
+    elif compression == "gzip":
+        return dict(compression="gzip", compression_opts=GZIP_LEVEL, shuffle=shuffle)
+    elif compression == "lzf":
+        return dict(compression="lzf", shuffle=shuffle)
+    elif compression == "blosc":
+        # blosc does its own shuffling
+        blosc_shuffle = hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE
+        return dict(hdf5plugin.Blosc(cname="lz4", clevel=5, shuffle=blosc_shuffle))
+    elif compression == "zstd":
+        return dict(hdf5plugin.Zstd(), shuffle=shuffle)
+    else:
+        raise ValueError("Compression %s not known. Choose from %s" % (compression, COMPRESSION_OPTIONS))
+
+
+def _compress_gzip_chunks(data, chunk, shuffle):
+    """Splits a 2D array into chunks and compresses them as the HDF5 (shuffle and) gzip filters would, returning
+    a list of (chunk_offset, compressed_bytes) for h5py's write_direct_chunk"""
+
+    cy, cx = chunk
+    ny, nx = data.shape
+
+    compressed_chunks = []
+    for y in range(0, ny, cy):
+        for x in range(0, nx, cx):
+            block = data[y:y + cy, x:x + cx]
+            if block.shape != chunk:
+                # HDF5 stores edge chunks at their full size
+                padded = np.zeros(chunk, dtype=data.dtype)
+                padded[: block.shape[0], : block.shape[1]] = block
+                block = padded
+            chunk_bytes = np.ascontiguousarray(block).tobytes()
+            if shuffle:
+                # the shuffle filter stores the first byte of every element, then the second byte etc.
+                chunk_bytes = np.frombuffer(chunk_bytes, dtype=np.uint8).reshape(-1, data.dtype.itemsize).T.tobytes()
+            compressed_chunks.append(((y, x), zlib.compress(chunk_bytes, GZIP_LEVEL)))
+
+    return compressed_chunks
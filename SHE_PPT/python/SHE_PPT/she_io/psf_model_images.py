@@ -25,6 +25,11 @@
 """
 
 import os
+import zlib
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
@@ -44,6 +49,17 @@ from .profiling import io_stats
 
 logger = log.getLogger(__name__)
 
+# Layouts of the PSF images in a PSFModelImages file: "datasets" stores each object's image in its own dataset in the
+# IMAGES group, "stacked" stores all images in a single 3D dataset, with each object's index into it in the table
+PSF_LAYOUT_DATASETS = "datasets"
+PSF_LAYOUT_STACKED = "stacked"
+
+STACKED_IMAGES_NAME = "STACKED_IMAGES"
+IMAGE_INDEX_COLNAME = "IMAGE_INDEX"
+
+# Compression level used for the PSF images (the default for h5py's gzip filter)
+GZIP_LEVEL = 4
+
 
 def read_psf_model_images(psf_prods, workdir="."):
     """
@@ -121,11 +137,30 @@ class PSFModelImage(ABC):
         return self.get_model_images(obj_id)
 
 
+@dataclass
+class ObjectModelImageBatch:
+    """Contains the stacked bulge and disk model images for a batch of objects, along with their quality flags"""
+
+    bulge: np.ndarray
+    disk: np.ndarray
+    quality_flags: np.ndarray
+    # Whether each object has a model image (the images of objects without one are filled with zeros)
+    modelled: np.ndarray
+    table_rows: Table
+
+
 class PSFModelImageHDF5(PSFModelImage):
     """Class for interfacing with a psf_model_image HDF5 file"""
 
     @io_stats
-    def __init__(self, filename):
+    def __init__(self, filename, cache_size=0):
+        """
+        Inputs:
+          - filename: The qualified filename of the ShePSFModelImage file
+          - cache_size: The maximum number of objects whose model images are kept in memory, so that objects
+            requested more than once are only read from disk once. If 0 (default), no images are kept. Cached images
+            are shared between calls, so are returned read-only.
+        """
 
         self.file = h5py.File(filename, "r")
 
@@ -135,29 +170,209 @@ class PSFModelImageHDF5(PSFModelImage):
         # of read ops :)
         self.table = read_table_hdf5(self.file["TABLE"])
 
-        # index table by object_id
-        self.table.add_index("OBJECT_ID")
+        # Hashed index of each object's row in the table, so that lookups are O(1) rather than a scan of all objects
+        self.object_index = {obj_id: i for i, obj_id in enumerate(self.table["OBJECT_ID"].data.tolist())}
+
+        # store reference to the images - either the IMAGES group, or the single dataset of stacked images
+        if STACKED_IMAGES_NAME in self.file:
+            self.layout = PSF_LAYOUT_STACKED
+            self.images = None
+            self.stacked_images = self.file[STACKED_IMAGES_NAME]
+            self.image_indices = np.asarray(self.table[IMAGE_INDEX_COLNAME])
+        else:
+            self.layout = PSF_LAYOUT_DATASETS
+            self.images = self.file["IMAGES"]
+            self.stacked_images = None
+            self.image_indices = None
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+        self._objects = None
+
+    @property
+    def objects(self):
+        """The names of the datasets in the IMAGES group (the object ids as strings). This list is built the first
+        time it's accessed, which is O(N) in the number of objects. Use object_index to check if an object is present
+        in the file."""
+        if self._objects is None:
+            if self.images is None:
+                self._objects = [str(obj_id) for obj_id in self.object_index]
+            else:
+                self._objects = list(self.images.keys())
+        return self._objects
+
+    def _get_row_index(self, obj_id):
+        try:
+            return self.object_index[int(obj_id)]
+        except KeyError as e:
+            raise KeyError("Object %s not present in PSFModelImages file %s" % (obj_id, self.file.filename)) from e
+
+    def _get_cached(self, obj_id):
+        model = self._cache.get(obj_id)
+        if model is not None:
+            self._cache.move_to_end(obj_id)
+        return model
 
-        # store reference to the IMAGES group
-        self.images = self.file["IMAGES"]
+    def _add_to_cache(self, obj_id, model):
+        if self.cache_size <= 0:
+            return
 
-        # Get the list of objects in the file
-        self.objects = list(self.images.keys())
+        model.bulge.flags.writeable = False
+
+        self._cache[obj_id] = model
+        self._cache.move_to_end(obj_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
 
     @io_stats
     def get_model_images(self, obj_id):
 
-        # a HDF5 dataset's name is a string
-        if str(obj_id) not in self.objects:
-            raise KeyError("Object %s not present in PSFModelImages file %s" % (obj_id, self.file.filename))
+        obj_id = int(obj_id)
+
+        model = self._get_cached(obj_id)
+        if model is not None:
+            return model
+
+        row_index = self._get_row_index(obj_id)
 
-        image = self.images[str(obj_id)][:, :]
+        if self.stacked_images is None:
+            # a HDF5 dataset's name is a string
+            image = self.images[str(obj_id)][:, :]
+        elif self.image_indices[row_index] >= 0:
+            image = self.stacked_images[self.image_indices[row_index]]
+        else:
+            # Not modelled, so return an empty image as for the NULL dataset of the datasets layout
+            image = np.zeros((0, 0))
 
-        row = self.table.loc[int(obj_id)]
+        row = self.table[row_index]
 
         quality_flag = row["SHE_PSF_QUAL_FLAG"]
 
-        return ObjectModelImage(bulge=image, disk=image, quality_flag=quality_flag, table_row=row)
+        model = ObjectModelImage(bulge=image, disk=image, quality_flag=quality_flag, table_row=row)
+
+        self._add_to_cache(obj_id, model)
+
+        return model
+
+    @io_stats
+    def get_model_images_batch(self, obj_ids):
+        """
+        Returns an ObjectModelImageBatch object containing the stacked disk and bulge PSF images for the requested
+        object ids. Each object's image is read directly into the stacked array, and objects requested more than once
+        are only read once.
+
+        Inputs:
+          - obj_ids: the object ids for the objects whose images we wish to extract
+
+        Returns:
+          - batch: ObjectModelImageBatch with images of shape (len(obj_ids), ny, nx). Objects without a model image
+            have zero-filled images and modelled=False.
+        """
+
+        obj_ids = [int(obj_id) for obj_id in obj_ids]
+
+        # Check all objects are present before reading anything
+        row_indices = np.array([self._get_row_index(obj_id) for obj_id in obj_ids], dtype=np.int64)
+
+        if self.stacked_images is not None:
+            return self._get_stacked_model_images_batch(row_indices)
+
+        d_sources = {}
+        shape = None
+        dtype = None
+        for obj_id in obj_ids:
+            if obj_id in d_sources:
+                continue
+
+            source = self._get_cached(obj_id)
+            if source is not None:
+                source = source.bulge
+            else:
+                source = self.images[str(obj_id)]
+            d_sources[obj_id] = source
+
+            if source.size == 0:
+                continue
+            if shape is None:
+                shape, dtype = source.shape, source.dtype
+            elif source.shape != shape:
+                raise ValueError("Cannot stack PSF model images of different shapes (%s and %s) from file %s" %
+                                 (shape, source.shape, self.file.filename))
+
+        if shape is None:
+            shape, dtype = (0, 0), np.float64
+
+        images = np.zeros((len(obj_ids),) + shape, dtype=dtype)
+        modelled = np.zeros(len(obj_ids), dtype=bool)
+
+        d_first_index = {}
+        for i, obj_id in enumerate(obj_ids):
+
+            # Copy within the stack for repeated objects rather than reading them again
+            if obj_id in d_first_index:
+                j = d_first_index[obj_id]
+                images[i] = images[j]
+                modelled[i] = modelled[j]
+                continue
+            d_first_index[obj_id] = i
+
+            source = d_sources[obj_id]
+            modelled[i] = source.size > 0
+
+            if isinstance(source, np.ndarray):
+                if modelled[i]:
+                    images[i] = source
+            else:
+                if modelled[i]:
+                    source.read_direct(images, dest_sel=np.s_[i])
+                if self.cache_size > 0:
+                    image = images[i].copy() if modelled[i] else source[()]
+                    row = self.table[row_indices[i]]
+                    self._add_to_cache(obj_id, ObjectModelImage(bulge=image,
+                                                                disk=image,
+                                                                quality_flag=row["SHE_PSF_QUAL_FLAG"],
+                                                                table_row=row))
+
+        table_rows = self.table[row_indices]
+
+        return ObjectModelImageBatch(bulge=images,
+                                     disk=images,
+                                     quality_flags=np.asarray(table_rows["SHE_PSF_QUAL_FLAG"]),
+                                     modelled=modelled,
+                                     table_rows=table_rows)
+
+    def _get_stacked_model_images_batch(self, row_indices):
+        """Reads a batch of images from the stacked layout, reading each run of consecutive images in one operation.
+        This bypasses the cache, as reads are cheap in this layout."""
+
+        image_indices = self.image_indices[row_indices]
+        modelled = image_indices >= 0
+
+        images = np.zeros((len(row_indices),) + self.stacked_images.shape[1:], dtype=self.stacked_images.dtype)
+
+        if modelled.any():
+            unique_indices, inverse = np.unique(image_indices[modelled], return_inverse=True)
+
+            unique_images = np.empty((len(unique_indices),) + self.stacked_images.shape[1:],
+                                     dtype=self.stacked_images.dtype)
+            l_runs = np.split(unique_indices, np.flatnonzero(np.diff(unique_indices) != 1) + 1)
+            start = 0
+            for run in l_runs:
+                self.stacked_images.read_direct(unique_images,
+                                                source_sel=np.s_[run[0]:run[-1] + 1],
+                                                dest_sel=np.s_[start:start + len(run)])
+                start += len(run)
+
+            images[modelled] = unique_images[inverse]
+
+        table_rows = self.table[row_indices]
+
+        return ObjectModelImageBatch(bulge=images,
+                                     disk=images,
+                                     quality_flags=np.asarray(table_rows["SHE_PSF_QUAL_FLAG"]),
+                                     modelled=modelled,
+                                     table_rows=table_rows)
 
     def get_oversampling_factor(self):
         try:
@@ -168,7 +383,8 @@ class PSFModelImageHDF5(PSFModelImage):
 
 class PSFModelImagesWriter():
     """Class to create PSFModelImage HDF5 files"""
-    def __init__(self, object_ids, filename, oversampling_factor):
+    def __init__(self, object_ids, filename, oversampling_factor, layout=PSF_LAYOUT_DATASETS, block_size=64,
+                 compression_workers=0):
         """
         Initialises the PSFWriter class:
           - opens the PSFModelImages file
@@ -178,16 +394,27 @@ class PSFModelImagesWriter():
           - object_ids: list of object_ids we wish to store in this file.
           - filename: the name of the file to write to
           - oversampling_factor - the oversampling factor for the PSFs
+          - layout: PSF_LAYOUT_DATASETS (default) to write each PSF to its own dataset, or PSF_LAYOUT_STACKED to
+            write all PSFs (which must then have the same shape and dtype) to a single 3D dataset, with the index of
+            each object's PSF in the IMAGE_INDEX column of the table (-1 if not modelled). The stacked layout avoids
+            the metadata overhead of one dataset per object, so is much faster to open and read for many objects.
+          - block_size: (stacked layout only) the number of PSFs to buffer in memory before appending them to the file
+          - compression_workers: (stacked layout only) if greater than 1, the number of threads used to compress each
+            block of PSFs in parallel, rather than with HDF5's serial gzip filter
         """
 
+        if layout not in (PSF_LAYOUT_DATASETS, PSF_LAYOUT_STACKED):
+            raise ValueError(f"Invalid PSF layout {layout}: must be {PSF_LAYOUT_DATASETS} or {PSF_LAYOUT_STACKED}")
+
         self.filename = filename
+        self.layout = layout
+        self.block_size = block_size
+        self.compression_workers = compression_workers
 
         logger.info("Initialised PSF writer to write PSFModelImages to %s", self.filename)
 
         self.hdf5_root = h5py.File(self.filename, "w")
 
-        self.hdf5_image_group = self.hdf5_root.create_group("IMAGES")
-
         self.hdf5_root.attrs["PSF_OVERSAMPLING_FACTOR"] = oversampling_factor
 
         n_objs = len(object_ids)
@@ -207,12 +434,23 @@ class PSFModelImagesWriter():
         )
         self.psf_table.add_index("OBJECT_ID")
 
-        # create the null dataset for objects without PSFs (e.g. objects not in this exposure)
-        # This is used as a placeholder dataset for all objects not modelled
-        self.null_dataset = self.hdf5_image_group.create_dataset(
-            "NULL",
-            data=np.zeros((0, 0)),
-        )
+        if self.layout == PSF_LAYOUT_STACKED:
+            self.psf_table.add_column(Column(name=IMAGE_INDEX_COLNAME, data=np.full(n_objs, -1, dtype=np.int64)))
+
+            # The stacked dataset is created when the first block is written, once the shape of the PSFs is known
+            self.stacked_dataset = None
+            self._block = []
+            self._num_images = 0
+            self._executor = ThreadPoolExecutor(self.compression_workers) if self.compression_workers > 1 else None
+        else:
+            self.hdf5_image_group = self.hdf5_root.create_group("IMAGES")
+
+            # create the null dataset for objects without PSFs (e.g. objects not in this exposure)
+            # This is used as a placeholder dataset for all objects not modelled
+            self.null_dataset = self.hdf5_image_group.create_dataset(
+                "NULL",
+                data=np.zeros((0, 0)),
+            )
 
         self._finalised = False
 
@@ -235,22 +473,25 @@ class PSFModelImagesWriter():
 
         self._check_finalised()
 
-        # NOTE: we use compression to save disk space (around 40%). This requires chunking.
-        # A chunk size of 160 is chosen as this is the default size of a un-oversampled PSF,
-        # such that we will always have an integer number of chunks in each direction.
-        # We want a relatively large chunksize to minimize read/write operations.
-        self.hdf5_image_group.create_dataset(
-            str(obj_id),
-            data=psf,
-            chunks=(160, 160),
-            compression="gzip"
-        )
-
         try:
             row = self.psf_table.loc[obj_id]
         except KeyError as e:
             raise KeyError(f"Unexpected object id {obj_id}: not in table of objects") from e
 
+        if self.layout == PSF_LAYOUT_STACKED:
+            row[IMAGE_INDEX_COLNAME] = self._append_to_block(psf)
+        else:
+            # NOTE: we use compression to save disk space (around 40%). This requires chunking.
+            # A chunk size of 160 is chosen as this is the default size of a un-oversampled PSF,
+            # such that we will always have an integer number of chunks in each direction.
+            # We want a relatively large chunksize to minimize read/write operations.
+            self.hdf5_image_group.create_dataset(
+                str(obj_id),
+                data=psf,
+                chunks=(160, 160),
+                compression="gzip"
+            )
+
         row["SHE_PSF_QUAL_FLAG"] = quality_flag
 
         row["MODELLED"] = True
@@ -268,6 +509,65 @@ class PSFModelImagesWriter():
         if r:
             row["R"] = r
 
+    def _append_to_block(self, psf):
+        """Adds a PSF to the block of PSFs to be appended to the stacked dataset, writing the block if it's full, and
+        returns the PSF's index in the stacked dataset"""
+
+        # Copy the PSF, since the caller may reuse its array for the next PSF before the block is written
+        psf = np.array(psf, copy=True)
+
+        if self._block and psf.shape != self._block[0].shape:
+            raise ValueError(f"PSF of shape {psf.shape} does not match the shape {self._block[0].shape} of previous "
+                             "PSFs, as required for the stacked layout")
+        if self.stacked_dataset is not None and psf.shape != self.stacked_dataset.shape[1:]:
+            raise ValueError(f"PSF of shape {psf.shape} does not match the shape {self.stacked_dataset.shape[1:]} of "
+                             "previous PSFs, as required for the stacked layout")
+
+        self._block.append(psf)
+
+        image_index = self._num_images
+        self._num_images += 1
+
+        if len(self._block) >= self.block_size:
+            self._write_block()
+
+        return image_index
+
+    def _write_block(self):
+        """Appends the buffered block of PSFs to the stacked dataset"""
+
+        if not self._block:
+            return
+
+        if self.stacked_dataset is None:
+            shape = self._block[0].shape
+            # Each PSF is its own chunk, so that reading one PSF only decompresses that PSF
+            self.stacked_dataset = self.hdf5_root.create_dataset(
+                STACKED_IMAGES_NAME,
+                shape=(0,) + shape,
+                maxshape=(None,) + shape,
+                chunks=(1,) + shape,
+                dtype=self._block[0].dtype,
+                compression="gzip",
+                compression_opts=GZIP_LEVEL,
+            )
+
+        block = np.ascontiguousarray(np.stack(self._block), dtype=self.stacked_dataset.dtype)
+        start = self.stacked_dataset.shape[0]
+
+        self.stacked_dataset.resize(start + len(block), axis=0)
+
+        if self._executor is None:
+            self.stacked_dataset[start:] = block
+        else:
+            # The HDF5 gzip filter stores chunks as zlib streams, so we can compress them ourselves in parallel (zlib
+            # releases the GIL) and write the compressed chunks directly
+            compress = partial(zlib.compress, level=GZIP_LEVEL)
+            for i, chunk in enumerate(self._executor.map(compress, block)):
+                self.stacked_dataset.id.write_direct_chunk((start + i,) + (0,) * (block.ndim - 1), chunk)
+
+        self._block = []
+
     def close(self):
         """
         Writes necessary bookkeeping data to the hdf5 file and closes it.
@@ -278,11 +578,21 @@ class PSFModelImagesWriter():
 
         self._check_finalised()
 
-        # For all objects not modelled, link them to the null dataset
-        for row in self.psf_table:
-            if not row["MODELLED"]:
-                obj_id = str(row["OBJECT_ID"])
-                self.hdf5_image_group[obj_id] = self.null_dataset
+        if self.layout == PSF_LAYOUT_STACKED:
+            self._write_block()
+
+            # Make sure the dataset exists even if no PSFs were written, so that the layout can be identified
+            if self.stacked_dataset is None:
+                self.hdf5_root.create_dataset(STACKED_IMAGES_NAME, data=np.zeros((0, 0, 0)))
+
+            if self._executor is not None:
+                self._executor.shutdown()
+        else:
+            # For all objects not modelled, link them to the null dataset
+            for row in self.psf_table:
+                if not row["MODELLED"]:
+                    obj_id = str(row["OBJECT_ID"])
+                    self.hdf5_image_group[obj_id] = self.null_dataset
 
         # Write the table to the file
         self.psf_table.write(self.hdf5_root, "TABLE")
@@ -24,6 +24,7 @@
 
 """
 
+import warnings
 from dataclasses import dataclass
 
 from typing import List
@@ -33,17 +34,22 @@ import numpy as np
 from astropy.coordinates import SkyCoord
 from astropy.units import degree
 from astropy.io import fits
-from astropy.wcs import WCS
+from astropy.wcs import WCS, NoConvergence
 from astropy.nddata.utils import Cutout2D
+from astropy.wcs.utils import skycoord_to_pixel
 
 import ElementsKernel.Logging as log
 
-from SHE_PPT.she_io.vis_exposures import VisExposure
+from SHE_PPT.coordinates import skycoords_to_unit_vectors
+from SHE_PPT.she_io.vis_exposures import VisExposure, read_regions
 from SHE_PPT.she_io.profiling import io_stats
 
 
 logger = log.getLogger(__name__)
 
+# Multiplier applied to the radius of each detector's footprint when pre-filtering objects (as in skycoords_in_wcs)
+FOOTPRINT_RADIUS_MULTIPLIER = 1.25
+
 
 @dataclass
 class Stamp:
@@ -178,6 +184,209 @@ def extract_exposure_stamp(exposure: VisExposure, ra, dec, size, x_buffer=0, y_b
     return stamp
 
 
+@io_stats
+def extract_stamps_batch(exposure: VisExposure, ra_array, dec_array, size, x_buffer=0, y_buffer=0) -> List[Stamp]:
+    """
+    Extracts stamps for many objects from a VisExposure object. This gives the same stamps as calling
+    extract_exposure_stamp for each object, but assigns all the objects to detectors in a single vectorised pass
+    and then extracts the stamps detector-by-detector, so that each detector is only accessed once.
+
+    Inputs:
+      - exposure: a VisExposure object (or subclass of)
+      - ra_array: array of the right ascensions of the objects
+      - dec_array: array of the declinations of the objects
+      - size: the size of the stamps in pixels
+      - x_buffer: number of pixels around the x edge of the image to exclude objects from (see
+        extract_exposure_stamp)
+      - y_buffer: number of pixels around the y edge of the image to exclude objects from.
+
+    Returns:
+      - stamps: a list of Stamp objects, in the same order as the input coordinates. If no stamp can be extracted
+        for an object (e.g. its coords are outside the FOV of the exposure) then None is returned in the list.
+
+    """
+
+    ra_array = np.atleast_1d(np.asarray(ra_array, dtype=float))
+    dec_array = np.atleast_1d(np.asarray(dec_array, dtype=float))
+
+    if ra_array.shape != dec_array.shape:
+        raise ValueError("ra_array (shape %s) and dec_array (shape %s) differ in shape" % (ra_array.shape,
+                                                                                           dec_array.shape))
+
+    det_inds, x, y = get_detector_assignments(exposure, ra_array, dec_array, x_buffer, y_buffer)
+
+    stamps = [None] * len(ra_array)
+
+    n_missing = np.count_nonzero(det_inds < 0)
+    if n_missing > 0:
+        logger.warning("%d of %d objects not in observation", n_missing, len(ra_array))
+
+    for det_id in np.unique(det_inds[det_inds >= 0]):
+        det = exposure[int(det_id)]
+        wcs = exposure.get_wcs_list()[det_id]
+
+        # Extract the stamps in order of increasing y then x so we sweep through the detector's data in the
+        # order it is stored on disk
+        obj_inds = np.flatnonzero(det_inds == det_id)
+        obj_inds = obj_inds[np.lexsort((x[obj_inds], y[obj_inds]))]
+
+        positions = [(x[i], y[i]) for i in obj_inds]
+
+        for i, stamp in zip(obj_inds, _extract_detector_stamps(det, wcs, positions, size)):
+            stamps[i] = stamp
+
+    return stamps
+
+
+def get_detector_assignments(exposure: VisExposure, ra_array, dec_array, x_buffer=0, y_buffer=0):
+    """
+    Determines which detector of an exposure each of a set of objects lies in, using one vectorised coordinate
+    transform per detector. As in extract_exposure_stamp, an object is assigned to the first detector that contains
+    it.
+
+    Inputs:
+      - exposure: a VisExposure object (or subclass of)
+      - ra_array: array of the right ascensions of the objects
+      - dec_array: array of the declinations of the objects
+      - x_buffer: number of pixels around the x edge of the image to exclude objects from
+      - y_buffer: number of pixels around the y edge of the image to exclude objects from
+
+    Returns:
+      - det_inds: array of the detector index for each object, or -1 if the object is in no detector
+      - x: array of the position of each object to pass to Cutout2D (NaN if the object is in no detector)
+      - y: array of the position of each object to pass to Cutout2D (NaN if the object is in no detector)
+    """
+
+    if type(x_buffer) is not int or type(y_buffer) is not int:
+        raise ValueError("WCS pixel buffer must be an integer")
+
+    n_objs = len(ra_array)
+
+    det_inds = np.full(n_objs, -1, dtype=int)
+    x = np.full(n_objs, np.nan)
+    y = np.full(n_objs, np.nan)
+
+    wcs_list = exposure.get_wcs_list()
+
+    linear = "LINEAR" in wcs_list[0].wcs.ctype
+
+    if not linear:
+        skycoords = SkyCoord(ra_array, dec_array, unit=degree)
+        vectors = skycoords_to_unit_vectors(skycoords)
+
+    for i, w in enumerate(wcs_list):
+
+        # only consider objects not already assigned to a detector
+        unassigned = np.flatnonzero(det_inds < 0)
+        if len(unassigned) == 0:
+            break
+
+        nx, ny = w.pixel_shape
+
+        if not linear:
+            # Only transform objects within a cone around the detector. Besides being faster, this avoids
+            # all_world2pix failing to converge for positions far outside the detector with a distorted WCS
+            centre, cos_radius = _get_footprint_cone(w, skycoords[0], x_buffer, y_buffer)
+            unassigned = unassigned[vectors[unassigned] @ centre >= cos_radius]
+            if len(unassigned) == 0:
+                continue
+
+        if linear:
+            # fudge for the static test data which use a linear WCS (see extract_exposure_stamp)
+            px, py = w.all_world2pix(ra_array[unassigned], dec_array[unassigned], 0)
+            in_det = (x_buffer < px) & (px <= nx - x_buffer) & (y_buffer < py) & (py <= ny - y_buffer)
+
+            sel = unassigned[in_det]
+            x[sel] = ra_array[sel]
+            y[sel] = dec_array[sel]
+
+        else:
+            # Equivalent to wcs_with_buffer(w, x_buffer, y_buffer).footprint_contains(skycoords), but also gives
+            # us the pixel coordinates of the objects in the (unbuffered) detector
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                try:
+                    px, py = skycoord_to_pixel(skycoords[unassigned], w, origin=0, mode="all")
+                except NoConvergence as e:
+                    # Use the positions which converged, and treat those which didn't as not in the detector
+                    px, py = np.array(e.best_solution, dtype=float).T
+                    for failed in (e.divergent, e.slow_conv):
+                        if failed is not None:
+                            px[failed] = np.nan
+                            py[failed] = np.nan
+            in_det = (x_buffer < px) & (px < nx - x_buffer) & (y_buffer < py) & (py < ny - y_buffer)
+
+            sel = unassigned[in_det]
+            x[sel] = px[in_det]
+            y[sel] = py[in_det]
+
+        det_inds[sel] = i
+
+    return det_inds, x, y
+
+
+def _get_footprint_cone(w, frame, x_buffer=0, y_buffer=0):
+    """Gets the unit vector (in the given frame) of the centre of a detector's footprint, and the cosine of the
+    angular radius of a cone around it which contains the whole detector (expanded for any negative pixel buffer)."""
+
+    nx, ny = w.pixel_shape
+
+    # Sky coordinates of the centre and the four corners of the detector
+    skycoords = w.pixel_to_world(np.array([nx / 2, 0, nx, nx, 0]), np.array([ny / 2, 0, 0, ny, ny]))
+
+    vectors = skycoords_to_unit_vectors(skycoords, frame=frame)
+    centre = vectors[0]
+
+    radius = np.arccos(np.clip(vectors[1:] @ centre, -1., 1.)).max()
+
+    # A negative buffer includes objects outside the detector, so expand the cone to include these
+    half_diagonal = 0.5 * np.hypot(nx, ny)
+    buffer = np.hypot(max(-x_buffer, 0), max(-y_buffer, 0))
+    radius *= (1 + buffer / half_diagonal) * FOOTPRINT_RADIUS_MULTIPLIER
+
+    return centre, np.cos(min(radius, np.pi))
+
+
+def _extract_detector_stamps(det, wcs, positions, size):
+    """Extracts stamps centred on each of a list of pixel positions from a Detector. The geometry (slices and WCS)
+    of each stamp is computed once with Cutout2D, without reading any data, and then the overlaps of all the stamps
+    with each of the detector's images are read at once with read_regions."""
+
+    # Cutout2D on a zero-strided dummy array gives us the geometry of the cutouts without reading the data
+    dummy = np.broadcast_to(np.zeros((), dtype=det.sci.dtype), det.sci.shape)
+    geometries = [
+        Cutout2D(dummy, position, size, wcs=wcs, mode="partial", fill_value=0, copy=False) for position in positions
+    ]
+
+    regions = [g.slices_original for g in geometries]
+
+    def _cutouts(data, fill_value):
+        if data is None:
+            return [None] * len(geometries)
+        cutouts = []
+        for g, extracted in zip(geometries, read_regions(data, regions)):
+            if extracted.shape != g.shape:
+                # the stamp overlaps the edge of the detector, so pad it with fill_value (as Cutout2D does)
+                cutout = np.full(g.shape, fill_value, dtype=extracted.dtype)
+                cutout[g.slices_cutout] = extracted
+                extracted = cutout
+            cutouts.append(extracted)
+        return cutouts
+
+    return [
+        Stamp(det.header, g.wcs, sci, rms, flg, wgt, bkg, seg, det.dpd)
+        for g, sci, rms, flg, wgt, bkg, seg in zip(
+            geometries,
+            _cutouts(det.sci, 0),
+            _cutouts(det.rms, 0),
+            _cutouts(det.flg, 1),
+            _cutouts(det.wgt, 0),
+            _cutouts(det.bkg, 0),
+            _cutouts(det.seg, 0),
+        )
+    ]
+
+
 def wcs_with_buffer(wcs, x_buffer=0, y_buffer=0):
     """Creates a WCS with an expanded/contracted detector size to accommodate the pixel buffer"""
     if x_buffer == 0 and y_buffer == 0:
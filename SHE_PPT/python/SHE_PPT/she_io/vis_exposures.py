@@ -27,6 +27,9 @@
 import os
 import json
 import gc
+import hashlib
+import pickle
+import tempfile
 from itertools import repeat
 
 from abc import ABC, abstractmethod
@@ -35,12 +38,20 @@ from dataclasses import dataclass
 
 import numpy as np
 
+import astropy
 from astropy.io import fits
 from astropy.wcs import WCS
 
 import fitsio
 import h5py
 
+# Importing hdf5plugin registers the blosc and zstd filters with HDF5, so that we can read files compressed with
+# them. It is optional, and only needed for these files
+try:
+    import hdf5plugin  # noqa: F401
+except ImportError:
+    pass
+
 import ElementsKernel.Logging as log
 
 from ST_DM_DmUtils.DmUtils import read_product_metadata
@@ -51,8 +62,37 @@ logger = log.getLogger(__name__)
 
 QUADRANT_DICT = {0: "E", 1: "F", 2: "G", 3: "H", "E": 0, "F": 1, "G": 2, "H": 3}
 
+# Suffix of the filename of an exposure's header/WCS cache, which is "<data filename>.<class name><suffix>"
+HEADER_CACHE_SUFFIX = ".hdrcache"
+
+# Increment this if the contents of the header/WCS cache change, to invalidate existing caches
+HEADER_CACHE_VERSION = 1
+
+# Number of bytes read from each end of a file to compute its fingerprint for the header/WCS cache
+FINGERPRINT_NBYTES = 1024 * 1024
+
+# Chunk cache policies for VisExposureHDF5: "fixed" gives every dataset a chunk cache of chunk_cache_mb, "auto"
+# sizes each dataset's chunk cache from the size of the stamps read from it, up to a maximum of chunk_cache_mb
+CHUNK_CACHE_POLICIES = ("fixed", "auto")
+
+# Maximum size of a single block of chunks read by read_regions
+MAX_READ_BLOCK_NBYTES = 64 * 1024 * 1024
 
-def read_vis_data(vis_prods, seg_prods=None, workdir=".", method="astropy", hdf5_files=None):
+# The (big-endian) dtype of FITS image data for each BITPIX value
+BITPIX_DTYPES = {8: "u1", 16: ">i2", 32: ">i4", 64: ">i8", -32: ">f4", -64: ">f8"}
+
+
+def read_vis_data(
+    vis_prods,
+    seg_prods=None,
+    workdir=".",
+    method="astropy",
+    hdf5_files=None,
+    header_cache=False,
+    chunk_cache_policy="fixed",
+    zero_copy=False,
+    native_endian=False,
+):
     """
     Reads a list of DpdVisCalibratedFrame (and optionally dpdSheExposureReprojectedSegmentationMap),
     returning a list of VisExposure objects
@@ -63,6 +103,14 @@ def read_vis_data(vis_prods, seg_prods=None, workdir=".", method="astropy", hdf5
      - workdir: the workdir
      - method: the IO method to use... options are astropy, fitsio, hdf5
      - hdf5_files: a list of hdf5 filenames to use (only if method == "hdf5")
+     - header_cache: whether to use a cache of the exposures' parsed headers and WCSs. Only enable this for
+       trusted data directories (see VisExposure)
+     - chunk_cache_policy: the HDF5 chunk cache policy, "fixed" or "auto" (only if method == "hdf5", see
+       VisExposureHDF5)
+     - zero_copy: whether to access the images through memory maps without copying them (only if
+       method == "astropy", see VisExposureAstropyFITS)
+     - native_endian: whether to convert stamps read from the images to native byte order (only if
+       method == "astropy", see VisExposureAstropyFITS)
 
     returns:
      - vis_exposures: a list of VisExposure objects
@@ -92,7 +140,10 @@ def read_vis_data(vis_prods, seg_prods=None, workdir=".", method="astropy", hdf5
 
         qualified_hdf5_files = [os.path.join(workdir, f) for f in hdf5_files]
 
-        vis_exposures = [VisExposureHDF5(h5, dpd=dpd) for h5, dpd in zip(qualified_hdf5_files, vis_dpds)]
+        vis_exposures = [
+            VisExposureHDF5(h5, dpd=dpd, header_cache=header_cache, chunk_cache_policy=chunk_cache_policy)
+            for h5, dpd in zip(qualified_hdf5_files, vis_dpds)
+        ]
 
         logger.info("Created %d %s exposures", n_exps, vis_exposures[-1].__class__.__name__)
 
@@ -120,9 +171,18 @@ def read_vis_data(vis_prods, seg_prods=None, workdir=".", method="astropy", hdf5
     vis_exposures = []
     for det, wgt, bkg, seg, dpd in zip(dets, wgts, bkgs, segs, vis_dpds):
         if method == "astropy":
-            exp = VisExposureAstropyFITS(det, bkg, wgt, seg, dpd=dpd)
+            exp = VisExposureAstropyFITS(
+                det,
+                bkg,
+                wgt,
+                seg,
+                dpd=dpd,
+                header_cache=header_cache,
+                zero_copy=zero_copy,
+                native_endian=native_endian,
+            )
         else:
-            exp = VisExposureFitsIO(det, bkg, wgt, seg, dpd=dpd)
+            exp = VisExposureFitsIO(det, bkg, wgt, seg, dpd=dpd, header_cache=header_cache)
 
         vis_exposures.append(exp)
 
@@ -193,6 +253,15 @@ class VisExposure(ABC):
 
     This class is supposed to be agnostic to the method of accessing the data (e.g. astropy.io.fits,
     fitsio, others...) so a subclass must be created that implements data access via the chosen method.
+
+    Parsing the detectors' headers and creating their WCSs is expensive, so the parsed headers and WCSs can
+    optionally be cached in a file next to the exposure's data file (with the suffix HEADER_CACHE_SUFFIX). This
+    is enabled by setting self.header_cache_filename, which subclasses do if header_cache=True is passed to their
+    constructor. Different subclasses parse the headers differently, so each has its own cache file. The cache is
+    keyed on a fingerprint of the data file, so is rebuilt if the data file changes.
+
+    The cache is a pickle, and unpickling a file can run arbitrary code, so the cache should only be enabled for
+    trusted data directories. As a safeguard, cache files not owned by the current user are ignored.
     """
 
     def __init__(self):
@@ -201,20 +270,22 @@ class VisExposure(ABC):
         self._detectors = {}
         self.n_detectors = None
         self.dpd = None
+        self.data_filename = None
+        self.header_cache_filename = None
 
     def get_wcs_list(self):
         if not self._wcs_list:
-            self._get_wcs_and_header_list()
+            self._load_wcs_and_header_list()
         return self._wcs_list
 
     def get_header_list(self):
         if not self._header_list:
-            self._get_wcs_and_header_list()
+            self._load_wcs_and_header_list()
         return self._header_list
 
     def get_detector(self, det_name):
         if not self._header_list:
-            self._get_wcs_and_header_list()
+            self._load_wcs_and_header_list()
         if det_name not in self._detectors:
             self._create_detector(det_name)
 
@@ -285,6 +356,33 @@ class VisExposure(ABC):
     def get_dpd(self):
         return self.dpd
 
+    def _use_header_cache(self, header_cache, data_filename):
+        """Sets up the header/WCS cache for the data file, if header_cache is True"""
+        self.data_filename = data_filename
+        if header_cache:
+            self.header_cache_filename = "%s.%s%s" % (data_filename, self.__class__.__name__, HEADER_CACHE_SUFFIX)
+
+    @io_stats
+    def _load_wcs_and_header_list(self):
+        """Populates the header and WCS lists, reading them from the header cache if possible"""
+
+        if self.header_cache_filename is None:
+            self._get_wcs_and_header_list()
+            return
+
+        key = _get_header_cache_key(self.data_filename)
+
+        cached = _read_header_cache(self.header_cache_filename, key)
+
+        if cached is not None:
+            self._header_list, self._wcs_list = cached
+            logger.debug("Read headers and WCSs from cache %s", self.header_cache_filename)
+            return
+
+        self._get_wcs_and_header_list()
+
+        _write_header_cache(self.header_cache_filename, key, self._header_list, self._wcs_list)
+
     @abstractmethod
     def _get_wcs_and_header_list(self):
         # OVERRIDE ME
@@ -297,14 +395,42 @@ class VisExposure(ABC):
 
 
 class VisExposureAstropyFITS(VisExposure):
-    """Implementation of the VisExposure class using astropy.io.fits"""
+    """Implementation of the VisExposure class using astropy.io.fits
+
+    With zero_copy=True, the detectors' images are views of memory maps of the FITS files, at the data offset
+    of each HDU, so slicing a stamp only reads the pages it needs and never copies, scales or byte-swaps the whole
+    image. The images are then big-endian, as stored in the FITS file. HDUs which can't be viewed directly (e.g.
+    scaled or compressed images) fall back to astropy's data access.
+
+    With native_endian=True, slices of the images (e.g. stamps) are converted to native byte order as they are
+    read.
+    """
 
     @io_stats
     def __init__(
-        self, det_file, bkg_file=None, wgt_file=None, seg_file=None, load_rms=True, load_flg=True, memmap=True, dpd=None
+        self,
+        det_file,
+        bkg_file=None,
+        wgt_file=None,
+        seg_file=None,
+        load_rms=True,
+        load_flg=True,
+        memmap=True,
+        dpd=None,
+        header_cache=False,
+        zero_copy=False,
+        native_endian=False,
     ):
         super().__init__()
 
+        self._use_header_cache(header_cache, det_file)
+
+        self.zero_copy = zero_copy
+        self.native_endian = native_endian
+
+        # memory maps of the files, used if zero_copy is True
+        self._file_memmaps = {}
+
         self._det_hdul = None
         self._bkg_hdul = None
         self._wgt_hdul = None
@@ -381,18 +507,36 @@ class VisExposureAstropyFITS(VisExposure):
         # an instance of this ndarray. This means we cast the HDUs to different dtypes.
         # This class disguises the hdu as an ndarray, allowing it to be used directly by Cutout2D.
         class CCDData(np.ndarray):
-            def __new__(cls, hdu):
+            def __new__(cls, hdu, dtype=None):
                 shape = tuple(hdu.shape)
-                dtype = hdu.dtype
+                dtype = hdu.dtype if dtype is None else dtype
 
                 obj = super().__new__(cls, shape, dtype=dtype, buffer=None, offset=0, strides=None, order=None)
                 obj.hdu = hdu
 
                 return obj
 
-            # When indexing this object, we want to index the hdu
+            # When indexing this object, we want to index the hdu (converting it to our dtype if needed)
             def __getitem__(self, inds):
-                return self.hdu[inds]
+                data = self.hdu[inds]
+                if self.dtype != self.hdu.dtype:
+                    data = np.asarray(data).astype(self.dtype)
+                return data
+
+        def get_data(hdus):
+            if not hdus:
+                return None
+
+            hdu = hdus[det_num]
+
+            data = _get_hdu_data_view(hdu, self._file_memmaps) if self.zero_copy else None
+            if data is None:
+                data = hdu.data
+            elif not self.native_endian:
+                # The view can be used directly
+                return data
+
+            return CCDData(data, dtype=data.dtype.newbyteorder("=") if self.native_endian else None)
 
         if self.quadrant_based:
             det_num, det_id = self._parse_quad_detector_name(det_name)
@@ -402,12 +546,12 @@ class VisExposureAstropyFITS(VisExposure):
         # get the data references for the detector object (where available)
         wcs = self._wcs_list[det_num]
         header = self._header_list[det_num]
-        sci = CCDData(self.sci_hdus[det_num].data)
-        flg = CCDData(self.flg_hdus[det_num].data) if self.flg_hdus else None
-        rms = CCDData(self.rms_hdus[det_num].data) if self.rms_hdus else None
-        wgt = CCDData(self.wgt_hdus[det_num].data) if self.wgt_hdus else None
-        bkg = CCDData(self.bkg_hdus[det_num].data) if self.bkg_hdus else None
-        seg = CCDData(self.seg_hdus[det_num].data) if self.seg_hdus else None
+        sci = get_data(self.sci_hdus)
+        flg = get_data(self.flg_hdus)
+        rms = get_data(self.rms_hdus)
+        wgt = get_data(self.wgt_hdus)
+        bkg = get_data(self.bkg_hdus)
+        seg = get_data(self.seg_hdus)
 
         # create the detector object and add it to this class's detector's dictionary
         det = Detector(
@@ -432,9 +576,21 @@ class VisExposureFitsIO(VisExposure):
     """Implementation of the VisExposure class using fitsio"""
 
     @io_stats
-    def __init__(self, det_file, bkg_file=None, wgt_file=None, seg_file=None, load_rms=True, load_flg=True, dpd=None):
+    def __init__(
+        self,
+        det_file,
+        bkg_file=None,
+        wgt_file=None,
+        seg_file=None,
+        load_rms=True,
+        load_flg=True,
+        dpd=None,
+        header_cache=False,
+    ):
         super().__init__()
 
+        self._use_header_cache(header_cache, det_file)
+
         self._det_hdul = None
         self._bkg_hdul = None
         self._wgt_hdul = None
@@ -566,16 +722,34 @@ class VisExposureFitsIO(VisExposure):
 
 
 class VisExposureHDF5(VisExposure):
-    """Implementation of the VisExposure class using HDF5"""
+    """Implementation of the VisExposure class using HDF5
+
+    The chunk cache of each dataset is set by chunk_cache_policy:
+     - "fixed": every dataset has a chunk cache of chunk_cache_mb
+     - "auto": each dataset's chunk cache is sized to hold a band of chunks spanning the full width of the
+       detector and the height of the largest stamp read from it so far (up to a maximum of chunk_cache_mb).
+       As stamps are read in order of increasing y, this is enough for each chunk to be decompressed only once.
+    """
 
     @io_stats
-    def __init__(self, exposure_file, chunk_cache_mb=8, dpd=None):
+    def __init__(self, exposure_file, chunk_cache_mb=8, dpd=None, header_cache=False, chunk_cache_policy="fixed"):
         super().__init__()
 
+        if chunk_cache_policy not in CHUNK_CACHE_POLICIES:
+            raise ValueError(
+                "Chunk cache policy %s not known. Choose from %s"
+                % (chunk_cache_policy, ", ".join(CHUNK_CACHE_POLICIES))
+            )
+
+        self._use_header_cache(header_cache, exposure_file)
+
+        self.chunk_cache_nbytes = 1024 * 1024 * chunk_cache_mb
+        self.chunk_cache_policy = chunk_cache_policy
+
         # Open the file, with a chunk cache of chunk_cache_mb
         # NOTE This is the cache per dataset, so if we were to open all datasets per exposure
         # this would be: 6 dataset per CCD x 36 CCDs x 8MB cache = 1728 MB
-        self.file = h5py.File(exposure_file, "r", rdcc_nbytes=(1024 * 1024 * chunk_cache_mb))
+        self.file = h5py.File(exposure_file, "r", rdcc_nbytes=self.chunk_cache_nbytes)
 
         det_list_json = self.file.attrs["det_list"]
         self.det_list = json.loads(det_list_json)
@@ -615,6 +789,9 @@ class VisExposureHDF5(VisExposure):
         # Cutout2D converts all input data to np.ndarray unless it is already an instance
         # of this class. This means it reads the whole dataset in and converts it. This
         # class wraps it into an np.ndarray, preventing this conversion.
+        chunk_cache_policy = self.chunk_cache_policy
+        max_chunk_cache_nbytes = self.chunk_cache_nbytes
+
         class CCDData(np.ndarray):
             def __new__(cls, dataset):
                 shape = dataset.shape
@@ -622,13 +799,38 @@ class VisExposureHDF5(VisExposure):
 
                 obj = super().__new__(cls, shape, dtype=dtype, buffer=None, offset=0, strides=None, order=None)
                 obj.dataset = dataset
+                obj.max_read_height = 0
+
+                if chunk_cache_policy == "auto":
+                    # start with a chunk cache big enough for reading single rows, and grow it as needed
+                    obj.dataset = _open_dataset_with_chunk_cache(
+                        dataset, _get_chunk_cache_nbytes(dataset, 1, max_chunk_cache_nbytes)
+                    )
 
                 return obj
 
             # When indexing this object, we want to index the dataset
             def __getitem__(self, inds):
+                if chunk_cache_policy == "auto":
+                    self._observe_read_height(_get_read_height(inds, self.shape[0]))
                 return self.dataset[inds]
 
+            def read_regions(self, regions):
+                """Reads many regions from the dataset, decompressing shared chunks only once"""
+                if chunk_cache_policy == "auto" and len(regions) > 0:
+                    self._observe_read_height(max(ys.stop - ys.start for ys, _ in regions))
+                return _read_chunked_regions(self.dataset, regions)
+
+            def _observe_read_height(self, height):
+                # Grows the dataset's chunk cache if we read a taller region than before
+                if height <= self.max_read_height:
+                    return
+                old_nbytes = _get_chunk_cache_nbytes(self.dataset, max(self.max_read_height, 1), max_chunk_cache_nbytes)
+                new_nbytes = _get_chunk_cache_nbytes(self.dataset, height, max_chunk_cache_nbytes)
+                self.max_read_height = height
+                if new_nbytes > old_nbytes:
+                    self.dataset = _open_dataset_with_chunk_cache(self.dataset, new_nbytes)
+
         wcs = self._wcs_list[det_num]
         header = self._header_list[det_num]
         sci = CCDData(detector_group["sci"])
@@ -670,6 +872,46 @@ def _correct_header(hdr):
     return new_hdr
 
 
+def _get_hdu_data_view(hdu, file_memmaps):
+    """
+    Returns a read-only view of a 2D image HDU's data in a memory map of its file, without any copying, scaling or
+    byte-swapping. Returns None if this is not possible (e.g. the data are scaled, or the file is compressed).
+
+    Inputs:
+     - hdu: the image HDU
+     - file_memmaps: dictionary of the memory maps of files already opened, keyed by filename. This is updated
+       with the memory map of the HDU's file if needed
+
+    Returns:
+     - data: the view of the data, or None
+    """
+
+    if not isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)):
+        return None
+
+    header = hdu.header
+
+    if header.get("NAXIS", 0) != 2 or header.get("BITPIX") not in BITPIX_DTYPES:
+        return None
+
+    if header.get("BSCALE", 1) != 1 or header.get("BZERO", 0) != 0:
+        return None
+
+    fileinfo = hdu.fileinfo()
+    if fileinfo is None or fileinfo["file"].compression is not None:
+        return None
+
+    filename = fileinfo["file"].name
+
+    if filename not in file_memmaps:
+        file_memmaps[filename] = np.memmap(filename, dtype=np.uint8, mode="r")
+
+    shape = (header["NAXIS2"], header["NAXIS1"])
+
+    return np.ndarray(shape, dtype=BITPIX_DTYPES[header["BITPIX"]], buffer=file_memmaps[filename],
+                      offset=fileinfo["datLoc"])
+
+
 def _fitsio_to_astropy_header(hdr):
     """Converts a fitsio header to an astropy.fits.Header"""
     cards = []
@@ -682,3 +924,226 @@ def _fitsio_to_astropy_header(hdr):
         card.verify()
         cards.append(card)
     return fits.Header(cards)
+
+
+def _get_header_cache_key(filename):
+    """
+    Returns the key identifying the contents of a data file for the header/WCS cache. Hashing whole VIS files
+    would be as expensive as parsing them, so the key is made from the file's size and modification time, along with
+    a hash of its first and last FINGERPRINT_NBYTES bytes (which contain the primary and first detector headers, and
+    the end of the last detector's data). The astropy version is included as the WCSs are pickled.
+    """
+
+    stat = os.stat(filename)
+
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        h.update(f.read(FINGERPRINT_NBYTES))
+        if stat.st_size > FINGERPRINT_NBYTES:
+            f.seek(max(FINGERPRINT_NBYTES, stat.st_size - FINGERPRINT_NBYTES))
+            h.update(f.read(FINGERPRINT_NBYTES))
+
+    return (HEADER_CACHE_VERSION, astropy.__version__, stat.st_size, stat.st_mtime_ns, h.hexdigest())
+
+
+def _read_header_cache(cache_filename, key):
+    """Reads the headers and WCSs from a header cache file, returning None if it does not exist or is stale. As the
+    cache is unpickled, which can run arbitrary code, files not owned by the current user are not read."""
+
+    if not os.path.exists(cache_filename):
+        return None
+
+    try:
+        with open(cache_filename, "rb") as f:
+            # Check the owner of the opened file, rather than its path, so it can't be swapped after the check
+            if hasattr(os, "getuid") and os.fstat(f.fileno()).st_uid != os.getuid():
+                logger.warning("Header cache %s is not owned by the current user, so will not be read",
+                               cache_filename)
+                return None
+            cache = pickle.load(f)
+    except Exception as e:
+        logger.warning("Could not read header cache %s: %s", cache_filename, e)
+        return None
+
+    if cache.get("key") != key:
+        logger.info("Header cache %s is stale, so will be recreated", cache_filename)
+        return None
+
+    return cache["header_list"], cache["wcs_list"]
+
+
+def _write_header_cache(cache_filename, key, header_list, wcs_list):
+    """Writes the headers and WCSs to a header cache file. Failing to write the cache (e.g. due to the data
+    directory being read-only) is not fatal."""
+
+    cache = {"key": key, "header_list": header_list, "wcs_list": wcs_list}
+
+    try:
+        # write to a temporary file and move it into place, so other processes never see a partial cache file
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_filename)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, cache_filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+    except OSError as e:
+        logger.warning("Could not write header cache %s: %s", cache_filename, e)
+        return
+
+    logger.info("Wrote header cache %s", cache_filename)
+
+
+def read_regions(data, regions):
+    """
+    Reads many rectangular regions of a detector's data array (e.g. the overlaps of a set of stamps with the
+    detector). If the array supports it (e.g. the chunked datasets of a VisExposureHDF5), the reads are planned so
+    that overlapping regions are read together and each chunk is only decompressed once.
+
+    Inputs:
+     - data: the detector data array (e.g. Detector.sci)
+     - regions: a list of (y_slice, x_slice) tuples of the regions to read. The slices must have step 1 and lie
+       within the array
+
+    Returns:
+     - arrays: a list of the (copied) data of each region
+    """
+
+    if hasattr(data, "read_regions"):
+        return data.read_regions(regions)
+
+    return [np.array(data[region]) for region in regions]
+
+
+def plan_chunked_reads(regions, chunks, shape, itemsize, max_block_nbytes=MAX_READ_BLOCK_NBYTES):
+    """
+    Plans the reading of many rectangular regions from a chunked 2D dataset. The regions are sorted by the first
+    chunk they touch (in row-major order), and regions that share a chunk are coalesced into a single block read,
+    aligned to the chunk grid, so that the shared chunks are only read and decompressed once. A block is not grown
+    beyond max_block_nbytes.
+
+    Inputs:
+     - regions: a list of (y_slice, x_slice) tuples of the regions to read
+     - chunks: the chunk shape of the dataset
+     - shape: the shape of the dataset
+     - itemsize: the size of one element of the dataset in bytes
+     - max_block_nbytes: the maximum size of a block in bytes (a single region larger than this is still read
+       as one block)
+
+    Returns:
+     - blocks: a list of ((y_slice, x_slice), region_inds) tuples - the block to read, and the indices of the
+       regions contained in it
+    """
+
+    if len(regions) == 0:
+        return []
+
+    cy, cx = chunks
+    ny, nx = shape
+
+    # the range of chunk indices [start, stop) each region touches in y and x
+    bounds = np.array([(ys.start, ys.stop, xs.start, xs.stop) for ys, xs in regions], dtype=np.int64)
+    chunk_ranges = np.stack(
+        [bounds[:, 0] // cy, -(-bounds[:, 1] // cy), bounds[:, 2] // cx, -(-bounds[:, 3] // cx)], axis=1
+    )
+
+    order = np.lexsort((chunk_ranges[:, 2], chunk_ranges[:, 0]))
+
+    chunk_nbytes = cy * cx * itemsize
+
+    block_ranges = []
+    block_inds = []
+
+    for i in order.tolist():
+        y0, y1, x0, x1 = chunk_ranges[i].tolist()
+
+        if block_ranges:
+            by0, by1, bx0, bx1 = block_ranges[-1]
+            overlaps = y0 < by1 and by0 < y1 and x0 < bx1 and bx0 < x1
+            merged = (min(y0, by0), max(y1, by1), min(x0, bx0), max(x1, bx1))
+            nbytes = (merged[1] - merged[0]) * (merged[3] - merged[2]) * chunk_nbytes
+            if overlaps and nbytes <= max_block_nbytes:
+                block_ranges[-1] = merged
+                block_inds[-1].append(i)
+                continue
+
+        block_ranges.append((y0, y1, x0, x1))
+        block_inds.append([i])
+
+    return [
+        ((slice(y0 * cy, min(y1 * cy, ny)), slice(x0 * cx, min(x1 * cx, nx))), inds)
+        for (y0, y1, x0, x1), inds in zip(block_ranges, block_inds)
+    ]
+
+
+def _read_chunked_regions(dataset, regions):
+    """Reads a list of (y_slice, x_slice) regions from an h5py dataset, following plan_chunked_reads"""
+
+    if dataset.chunks is None:
+        return [dataset[region] for region in regions]
+
+    arrays = [None] * len(regions)
+
+    for (block_ys, block_xs), inds in plan_chunked_reads(
+        regions, dataset.chunks, dataset.shape, dataset.dtype.itemsize
+    ):
+        block = dataset[block_ys, block_xs]
+        for i in inds:
+            ys, xs = regions[i]
+            y0, x0 = ys.start - block_ys.start, xs.start - block_xs.start
+            arrays[i] = block[y0:y0 + ys.stop - ys.start, x0:x0 + xs.stop - xs.start].copy()
+
+    return arrays
+
+
+def _get_read_height(inds, ny):
+    """Returns the number of rows of a 2D array indexed by inds"""
+
+    if isinstance(inds, tuple) and len(inds) > 0:
+        inds = inds[0]
+
+    if isinstance(inds, slice):
+        start, stop, step = inds.indices(ny)
+        return len(range(start, stop, step))
+
+    return 1
+
+
+def _get_chunk_cache_nbytes(dataset, read_height, max_nbytes):
+    """Returns the size of chunk cache needed to hold a band of chunks that spans the full width of a dataset and
+    can contain a region read_height rows high at any offset, capped at max_nbytes"""
+
+    if dataset.chunks is None:
+        return 0
+
+    cy, cx = dataset.chunks
+    ny, nx = dataset.shape
+
+    n_chunk_rows = min(-(-read_height // cy) + 1, -(-ny // cy))
+    n_chunk_cols = -(-nx // cx)
+
+    return min(n_chunk_rows * n_chunk_cols * cy * cx * dataset.dtype.itemsize, max_nbytes)
+
+
+def _open_dataset_with_chunk_cache(dataset, nbytes, w0=0.75):
+    """Reopens an h5py dataset with a chunk cache of nbytes. The input dataset handle is closed, as HDF5 ignores
+    the chunk cache settings when opening a dataset that is already open."""
+
+    if dataset.chunks is None:
+        return dataset
+
+    cy, cx = dataset.chunks
+    n_chunks = max(nbytes // (cy * cx * dataset.dtype.itemsize), 1)
+
+    # HDF5 recommends the number of hash table slots be ~100 times the number of chunks that fit in the cache
+    nslots = max(100 * n_chunks + 1, 521)
+
+    dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+    dapl.set_chunk_cache(nslots, nbytes, w0)
+
+    file_id = dataset.file.id
+    name = dataset.name.encode()
+    dataset.id.close()
+
+    return h5py.Dataset(h5py.h5d.open(file_id, name, dapl=dapl))
@@ -23,7 +23,7 @@ __updated__ = "2021-08-13"
 
 import math
 from dataclasses import dataclass
-from typing import Optional, Tuple, Union
+from typing import Iterable, Optional, Sequence, Tuple, Union
 
 import galsim
 import numpy as np
@@ -35,9 +35,13 @@ from scipy.optimize import minimize
 
 from . import flags as she_flags
 from .she_image import SHEImage
+from .wcs_approximation import get_decompositions
 
 REQUIRED_FRAC_UNMASKED = 0.25
 
+# Number of pixels to check at once in the batch data quality checks
+QUALITY_CHECK_BLOCK_SIZE = 2 ** 20
+
 MSG_TOO_BIG_SHEAR = "Requested shear exceeds 1"
 
 
@@ -220,6 +224,112 @@ def _correct_for_wcs_shear_and_rotation(shear_estimate: ShearEstimate,
     shear_estimate.g2 = fitting_result.x[1]
 
 
+def correct_for_wcs_shear_and_rotation_batch(g1: Sequence[float],
+                                             g2: Sequence[float],
+                                             errs: Tuple[Sequence[float], Sequence[float]],
+                                             covar: Sequence[float],
+                                             jacobians: Sequence[Sequence[Sequence[float]]]
+                                             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                        np.ndarray]:
+    """Vectorised version of `correct_for_wcs_shear_and_rotation`, which corrects the shear estimates of many objects
+    at once for the shear and rotation of the WCS at each object's position. Rather than numerically solving for the
+    pre-WCS shear of each object, this uses the analytic inverse of shear addition. As with the unbatched version,
+    any flipping is ignored, and errors are only updated for the WCS rotation.
+
+    Parameters
+    ----------
+    g1 : Sequence[float]
+        The first components of the shear estimates in pixel coordinates.
+    g2 : Sequence[float]
+        The second components of the shear estimates in pixel coordinates.
+    errs : Tuple[Sequence[float], Sequence[float]]
+        The uncertainties (g1_err, g2_err) in the first and second components of the shear estimates.
+    covar : Sequence[float]
+        The covariances between the first and second components of the shear estimates.
+    jacobians : Sequence[Sequence[Sequence[float]]]
+        Array of shape (N, 2, 2) of the local pix2world Jacobians of the WCS at the position of each object, in the
+        convention of `galsim.wcs.JacobianWCS`, as returned by `SHEImage.get_pix2world_jacobians`.
+
+    Returns
+    -------
+    g1 : np.ndarray
+        The first components of the corrected shear estimates.
+    g2 : np.ndarray
+        The second components of the corrected shear estimates.
+    g1_err : np.ndarray
+        The uncertainties in the first components of the corrected shear estimates.
+    g2_err : np.ndarray
+        The uncertainties in the second components of the corrected shear estimates.
+    g1g2_covar : np.ndarray
+        The covariances between the first and second components of the corrected shear estimates.
+    flags : np.ndarray
+        Flags for each object, with `flag_too_large_shear` set if the magnitude of the shear estimate is greater than
+        1, and `flag_cannot_correct_distortion` set if the correction could not be calculated. The shear estimates and
+        errors of flagged objects are set to the same failure values as in `correct_for_wcs_shear_and_rotation`.
+    """
+
+    g = np.asarray(g1, dtype=float) + 1j * np.asarray(g2, dtype=float)
+    g1_err = np.asarray(errs[0], dtype=float)
+    g2_err = np.asarray(errs[1], dtype=float)
+    covar = np.asarray(covar, dtype=float)
+    jacobians = np.asarray(jacobians, dtype=float).reshape(g.shape + (2, 2))
+
+    flags = np.zeros(g.shape, dtype=np.int64)
+
+    # We can only invert the Jacobians which are finite and non-singular. Objects with other Jacobians can't be
+    # corrected
+    good_jacobian = np.all(np.isfinite(jacobians), axis=(-2, -1))
+    good_jacobian[good_jacobian] = np.linalg.det(jacobians[good_jacobian]) != 0
+
+    w2p_g = np.full(g.shape, np.nan, dtype=complex)
+    w2p_theta = np.full(g.shape, np.nan)
+
+    _, w2p_g1, w2p_g2, w2p_theta[good_jacobian], _ = get_decompositions(np.linalg.inv(jacobians[good_jacobian]))
+    w2p_g[good_jacobian] = w2p_g1 + 1j * w2p_g2
+
+    # We first rotate into the proper frame, by the reverse of the double rotation of the world2pix transformation
+    cos_2theta = np.cos(2 * w2p_theta)
+    sin_2theta = np.sin(2 * w2p_theta)
+
+    g_world = g * (cos_2theta - 1j * sin_2theta)
+
+    # Update errors from the WCS rotation, through the covariance matrix R @ C @ R^T with the rotation matrix
+    # R = [[cos, sin], [-sin, cos]]
+    var1 = g1_err ** 2
+    var2 = g2_err ** 2
+    cos2 = cos_2theta ** 2
+    sin2 = sin_2theta ** 2
+    cos_sin = cos_2theta * sin_2theta
+
+    covar_world_11 = cos2 * var1 + 2 * cos_sin * covar + sin2 * var2
+    covar_world_22 = sin2 * var1 - 2 * cos_sin * covar + cos2 * var2
+    covar_world_12 = cos_sin * (var2 - var1) + (cos2 - sin2) * covar
+
+    # TODO: Update errors from the WCS shear
+
+    # Second, we correct for the shear. Shear addition w2p_g + g_pre = g_world, i.e.
+    # g_world = (w2p_g + g_pre) / (1 + conj(w2p_g) * g_pre), can be analytically inverted to give
+    # g_pre = (g_world - w2p_g) / (1 - conj(w2p_g) * g_world)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        too_large_shear = np.abs(g_world) > 1
+        g_pre = (g_world - w2p_g) / (1 - np.conj(w2p_g) * g_world)
+
+    flags[too_large_shear] |= she_flags.flag_too_large_shear
+
+    cannot_correct = ~too_large_shear & ~np.isfinite(g_pre)
+    flags[cannot_correct] |= she_flags.flag_cannot_correct_distortion
+
+    # Set values for failed corrections the same way as in `_set_as_failed_shear_estimate`
+    failed = flags != 0
+
+    g_pre[failed] = np.nan + 1j * np.nan
+    covar_world_11[failed] = np.inf
+    covar_world_22[failed] = np.inf
+    covar_world_12[failed] = np.inf
+
+    return (g_pre.real, g_pre.imag, np.sqrt(covar_world_11), np.sqrt(covar_world_22), covar_world_12, flags)
+
+
 def uncorrect_for_wcs_shear_and_rotation(shear_estimate: ShearEstimate,
                                          stamp: Optional[SHEImage] = None,
                                          wcs: Optional[Union[AstropyWCS, GalsimWCS]] = None,
@@ -531,3 +641,246 @@ def _get_galaxy_mask_flags(gal_stamp):
         flags |= she_flags.flag_insufficient_data
 
     return flags, ravelled_antimask
+
+
+def check_data_quality_batch(data: Optional[np.ndarray],
+                             psf_data: Optional[np.ndarray],
+                             mask: Optional[np.ndarray] = None,
+                             background_map: Optional[np.ndarray] = None,
+                             noisemap: Optional[np.ndarray] = None,
+                             segmentation_map: Optional[np.ndarray] = None,
+                             stacked: bool = False) -> np.ndarray:
+    """Batch version of `check_data_quality`, which checks many galaxy and PSF stamps of the same shape at once for
+    any data quality issues, and returns an appropriate set of flags for each. Each attribute of the stamps is
+    provided as a cube of shape (N, ...), where N is the number of objects, and None can be passed for an attribute
+    which is missing for all objects. The flags are identical to those which would be returned by calling
+    `check_data_quality` on each pair of stamps.
+
+    Parameters
+    ----------
+    data : Optional[np.ndarray]
+        Cube of the science data of the galaxy stamps.
+    psf_data : Optional[np.ndarray]
+        Cube of the data of the PSF stamps.
+    mask : Optional[np.ndarray]
+        Cube of the masks of the galaxy stamps.
+    background_map : Optional[np.ndarray]
+        Cube of the background maps of the galaxy stamps.
+    noisemap : Optional[np.ndarray]
+        Cube of the noisemaps of the galaxy stamps.
+    segmentation_map : Optional[np.ndarray]
+        Cube of the segmentation maps of the galaxy stamps.
+    stacked : bool
+        Whether the stamps are from stacked images or not.
+
+    Returns
+    -------
+    flags : np.ndarray
+        Array of sets of bitwise flags indicating any data quality issues for each object.
+    """
+
+    num_objects = _get_num_objects(data, psf_data, mask, background_map, noisemap, segmentation_map)
+
+    flags = get_psf_quality_flags_batch(psf_data, num_objects=num_objects)
+
+    flags |= get_galaxy_quality_flags_batch(data,
+                                            mask=mask,
+                                            background_map=background_map,
+                                            noisemap=noisemap,
+                                            segmentation_map=segmentation_map,
+                                            stacked=stacked,
+                                            num_objects=num_objects)
+
+    return flags
+
+
+def get_psf_quality_flags_batch(psf_data: Optional[np.ndarray],
+                                num_objects: Optional[int] = None) -> np.ndarray:
+    """Batch version of `get_psf_quality_flags`, which checks many PSF stamps at once for data quality issues and
+    returns a set of flags for each.
+
+    Parameters
+    ----------
+    psf_data : Optional[np.ndarray]
+        Cube of shape (N, ...) of the data of the PSF stamps, or None if no PSF data is available.
+    num_objects : Optional[int]
+        The number of objects N. This is only required if `psf_data` is None.
+
+    Returns
+    -------
+    flags : np.ndarray
+        Array of sets of bitwise flags indicating any data quality issues for each PSF stamp.
+    """
+
+    if psf_data is None:
+        if num_objects is None:
+            raise ValueError("`num_objects` must be supplied to `get_psf_quality_flags_batch` if `psf_data` is None.")
+        return np.full(num_objects, she_flags.flag_no_psf, dtype=np.int64)
+
+    psf_data = _get_flattened_cube(psf_data)
+
+    flags = np.zeros(len(psf_data), dtype=np.int64)
+
+    for block in _get_quality_check_blocks(psf_data):
+        good_psf_data = psf_data[block]
+        corrupt = ((good_psf_data.sum(axis=1) == 0) |
+                   (good_psf_data < -0.01 * good_psf_data.max(axis=1, keepdims=True)).any(axis=1))
+        flags[block][corrupt] |= she_flags.flag_corrupt_psf
+
+    return flags
+
+
+def get_galaxy_quality_flags_batch(data: Optional[np.ndarray],
+                                   mask: Optional[np.ndarray] = None,
+                                   background_map: Optional[np.ndarray] = None,
+                                   noisemap: Optional[np.ndarray] = None,
+                                   segmentation_map: Optional[np.ndarray] = None,
+                                   stacked: bool = False,
+                                   num_objects: Optional[int] = None) -> np.ndarray:
+    """Batch version of `get_galaxy_quality_flags`, which checks many galaxy stamps of the same shape at once for data
+    quality issues and returns a set of flags for each. Each attribute of the stamps is provided as a cube of shape
+    (N, ...), and None can be passed for an attribute which is missing for all objects.
+
+    Parameters
+    ----------
+    data : Optional[np.ndarray]
+        Cube of the science data of the galaxy stamps.
+    mask : Optional[np.ndarray]
+        Cube of the masks of the galaxy stamps.
+    background_map : Optional[np.ndarray]
+        Cube of the background maps of the galaxy stamps.
+    noisemap : Optional[np.ndarray]
+        Cube of the noisemaps of the galaxy stamps.
+    segmentation_map : Optional[np.ndarray]
+        Cube of the segmentation maps of the galaxy stamps.
+    stacked : bool
+        Whether the stamps are from stacked images or not.
+    num_objects : Optional[int]
+        The number of objects N. This is only required if all cubes are None.
+
+    Returns
+    -------
+    flags : np.ndarray
+        Array of sets of bitwise flags indicating any data quality issues for each galaxy stamp.
+    """
+
+    if num_objects is None:
+        num_objects = _get_num_objects(data, mask, background_map, noisemap, segmentation_map)
+
+    # Check for simple presence of data before anything else
+    if data is None:
+        return np.full(num_objects, she_flags.flag_no_science_image, dtype=np.int64)
+
+    flags = np.zeros(num_objects, dtype=np.int64)
+
+    data, mask, background_map, noisemap, segmentation_map = (_get_flattened_cube(a) for a in (data,
+                                                                                               mask,
+                                                                                               background_map,
+                                                                                               noisemap,
+                                                                                               segmentation_map))
+
+    # Flag missing data for all objects
+    if mask is None:
+        flags |= she_flags.flag_no_mask
+    for a, missing_flag in ((background_map, she_flags.flag_no_background_map),
+                            (noisemap, she_flags.flag_no_noisemap),
+                            (segmentation_map, she_flags.flag_no_segmentation_map),):
+        if a is None:
+            flags |= missing_flag
+
+    # Check each block of stamps, so that all checks of a block are done while it's in memory
+    for block in _get_quality_check_blocks(data):
+
+        block_flags = flags[block]
+
+        # Check the mask, and get the antimask of the good data
+        if mask is None:
+            antimask = np.ones(data[block].shape, dtype=bool)
+        else:
+            block_mask = mask[block]
+            block_flags[(block_mask < 0).any(axis=1)] |= she_flags.flag_corrupt_mask
+            antimask = ~block_mask.astype(bool)
+
+        # Check how much of the data is unmasked, and if we have enough
+        frac_unmasked = antimask.sum(axis=1) / antimask.shape[1]
+        block_flags[frac_unmasked < REQUIRED_FRAC_UNMASKED] |= she_flags.flag_insufficient_data
+
+        # Check for corrupt data
+        if stacked and background_map is not None:
+            block_data = data[block] + background_map[block]
+        else:
+            block_data = data[block]
+
+        for a, corrupt_flag, min_value in ((block_data, she_flags.flag_corrupt_science_image, 0),
+                                           (background_map, she_flags.flag_corrupt_background_map, 0),
+                                           (noisemap, she_flags.flag_corrupt_noisemap, 0),
+                                           (segmentation_map, she_flags.flag_corrupt_segmentation_map, -1),):
+
+            if a is None:
+                continue
+            if a is not block_data:
+                a = a[block]
+
+            block_flags[_get_corrupt_data_batch(a, antimask, min_value)] |= corrupt_flag
+
+    return flags
+
+
+def _get_corrupt_data_batch(a: np.ndarray,
+                            antimask: np.ndarray,
+                            min_value: int) -> np.ndarray:
+    """Private function to check whether the unmasked data of each row of a flattened cube are corrupt, i.e. if any
+    are NaN, infinite, or less than `min_value`, or if they sum to zero. This is equivalent to the checks in
+    `get_galaxy_quality_flags`.
+    """
+
+    with np.errstate(invalid="ignore"):
+        invalid = ~((a >= min_value) & (a < np.inf))
+    corrupt = (invalid & antimask).any(axis=1)
+
+    # The sum needs special care to be consistent with the unbatched version. If all valid data are non-negative,
+    # they can only sum to zero if they are all zero. Integer sums are exact no matter how the masked-out data are
+    # excluded, but for floats we sum the unmasked data of each row in the same order as the unbatched version.
+    if min_value >= 0:
+        corrupt |= ~((a != 0) & antimask).any(axis=1)
+    elif np.issubdtype(a.dtype, np.integer):
+        corrupt |= np.where(antimask, a, 0).sum(axis=1) == 0
+    else:
+        corrupt |= np.array([row[row_antimask].sum() == 0 for row, row_antimask in zip(a, antimask)], dtype=bool)
+
+    return corrupt
+
+
+def _get_num_objects(*l_cubes: Optional[np.ndarray]) -> int:
+    """Private function to get the number of objects from the first provided cube of stamp data.
+    """
+
+    for a in l_cubes:
+        if a is not None:
+            return len(a)
+
+    raise ValueError("At least one cube of stamp data must be supplied to check data quality.")
+
+
+def _get_flattened_cube(a: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Private function to flatten a cube of stamps of shape (N, ...) into a C-contiguous array of shape (N, M),
+    where each row is the ravelled stamp.
+    """
+
+    if a is None:
+        return None
+
+    a = np.asarray(a)
+
+    return np.ascontiguousarray(a.reshape(len(a), -1))
+
+
+def _get_quality_check_blocks(a: np.ndarray) -> Iterable[slice]:
+    """Private function to iterate over slices of blocks of rows of a flattened cube, each containing around
+    QUALITY_CHECK_BLOCK_SIZE elements.
+    """
+
+    rows_per_block = max(QUALITY_CHECK_BLOCK_SIZE // max(a.shape[1], 1), 1)
+
+    for start in range(0, len(a), rows_per_block):
+        yield slice(start, start + rows_per_block)
@@ -17,13 +17,24 @@
 # the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
 # Boston, MA 02110-1301 USA
 
+# Each module in this package is imported only when it is first accessed as an attribute of this package (including
+# through `from SHE_PPT.table_formats import <module>` or `import *`)
+
 import glob
+from importlib import import_module
 from os.path import basename, dirname, isfile
 
-modules = glob.glob(dirname(__file__) + "/*.py")
-__all__ = [basename(f)[:-3]
-           for f in modules if isfile(f) and not f.endswith('__init__.py')]
+__all__ = sorted(basename(f)[:-3] for f in glob.glob(dirname(__file__) + "/*.py")
+                 if isfile(f) and not f.endswith('__init__.py'))
+
+del dirname, basename, isfile, glob
+
+
+def __getattr__(name):
+    if name in __all__:
+        return import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-from . import *  # noqa: F401,E402,F403
 
-del modules, dirname, basename, isfile, glob
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
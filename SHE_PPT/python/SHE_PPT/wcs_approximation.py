@@ -0,0 +1,535 @@
+""" @file wcs_approximation.py
+
+    Created 16 Oct 2026
+
+    Defines a class which approximates the pixel-to-world transformation of a WCS over a region of an image with
+    low-order polynomials, with a validated error bound, for fast vectorised coordinate transformations.
+"""
+
+__updated__ = "2026-10-16"
+
+# Copyright (C) 2012-2020 Euclid Science Ground Segment
+#
+# This library is free software; you can redistribute it and/or modify it under the terms of the GNU Lesser General
+# Public License as published by the Free Software Foundation; either version 3.0 of the License, or (at your option)
+# any later version.
+#
+# This library is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with this library; if not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+from typing import Literal, Tuple, Union
+
+import astropy.wcs
+import numpy as np
+from numpy.polynomial import legendre
+
+from . import logging
+from .coordinates import radec_to_unit_vectors
+
+logger = logging.getLogger(__name__)
+
+# Default maximum error in pixels of the approximate transformations, and maximum error of the local Jacobians
+# relative to the pixel scale
+DEFAULT_MAX_ERROR = 1e-3
+DEFAULT_MAX_JACOBIAN_ERROR = 1e-6
+
+# Default maximum order of the polynomials, and the number of points per side of the grid they're fit to
+DEFAULT_MAX_ORDER = 5
+DEFAULT_N_FIT = 16
+
+# Step in pixels used for the numerical derivatives of the exact transformation (as used by GalSim)
+JACOBIAN_STEP = 1.
+
+ARCSEC_PER_RADIAN = 180 * 3600 / np.pi
+
+
+class ApproximateWCS:
+    """Approximation of the transformations between pixel and world coordinates of a celestial WCS over a rectangular
+    region of pixel coordinates.
+
+    The world coordinates are projected onto the tangent plane at the centre of the region, and the transformations
+    between the pixel coordinates and the tangent plane coordinates (in both directions) are fit with Legendre
+    polynomials. The order of the polynomials is increased until the errors of the positions and local Jacobians,
+    measured against the exact WCS on a grid twice as dense as the fitting grid, are within the requested bounds. If no
+    order up to the maximum meets the bounds, the approximation is marked as invalid and all transformations use the
+    exact WCS.
+
+    Positions outside of the fitted region are always transformed with the exact WCS.
+
+    Attributes
+    ----------
+    wcs : astropy.wcs.WCS
+        The exact WCS being approximated
+    xmin, xmax, ymin, ymax : float
+        The bounds of the approximated region, in 0-origin pixel coordinates of the WCS
+    order : Optional[int]
+        The order of the fitted polynomials, or None if the approximation is invalid
+    error : float
+        The maximum position error in pixels measured on the validation grid
+    jacobian_error : float
+        The maximum error of the local Jacobians, relative to the pixel scale, measured on the validation grid
+    valid : bool
+        Whether or not the approximation meets the error bounds
+    """
+
+    def __init__(self,
+                 wcs: astropy.wcs.WCS,
+                 xmin: float,
+                 xmax: float,
+                 ymin: float,
+                 ymax: float,
+                 max_error: float = DEFAULT_MAX_ERROR,
+                 max_jacobian_error: float = DEFAULT_MAX_JACOBIAN_ERROR,
+                 max_order: int = DEFAULT_MAX_ORDER,
+                 n_fit: int = DEFAULT_N_FIT):
+        """Initializer for an ApproximateWCS object, which fits the approximation.
+
+        Parameters
+        ----------
+        wcs : astropy.wcs.WCS
+            The celestial WCS to approximate
+        xmin, xmax, ymin, ymax : float
+            The bounds of the region to approximate, in 0-origin pixel coordinates of the WCS
+        max_error : float
+            The maximum allowed error in pixels of the approximate transformations (default 1e-3)
+        max_jacobian_error : float
+            The maximum allowed error of the local Jacobians, relative to the pixel scale (default 1e-6)
+        max_order : int
+            The maximum order of the polynomials to fit (default 5)
+        n_fit : int
+            The number of points per side of the grid the polynomials are fit to (default 16). This must be greater
+            than max_order.
+        """
+
+        if not wcs.has_celestial:
+            raise ValueError("ApproximateWCS requires a celestial WCS.")
+        if (xmax <= xmin) or (ymax <= ymin):
+            raise ValueError(f"Invalid region to approximate: x [{xmin}, {xmax}], y [{ymin}, {ymax}].")
+        if n_fit <= max_order:
+            raise ValueError(f"n_fit ({n_fit}) must be greater than max_order ({max_order}).")
+
+        self.wcs = wcs
+        self.xmin, self.xmax, self.ymin, self.ymax = float(xmin), float(xmax), float(ymin), float(ymax)
+        self.max_error = max_error
+        self.max_jacobian_error = max_jacobian_error
+
+        # Tangent plane at the centre of the region
+        self._x_c, self._y_c = (self.xmin + self.xmax) / 2, (self.ymin + self.ymax) / 2
+        self._x_hw, self._y_hw = (self.xmax - self.xmin) / 2, (self.ymax - self.ymin) / 2
+
+        ra_c, dec_c = wcs.all_pix2world(self._x_c, self._y_c, 0)
+        self._set_up_tangent_plane(float(ra_c), float(dec_c))
+
+        # Fitting grid, and a validation grid with points between and on all the fitting grid points
+        fit_x, fit_y = self._get_grid(n_fit)
+        fit_xi, fit_eta = self._exact_pix2tan(fit_x, fit_y)
+
+        val_x, val_y = self._get_grid(2 * n_fit - 1)
+        val_xi, val_eta = self._exact_pix2tan(val_x, val_y)
+        val_jacobians = self._exact_tan_jacobians(val_x, val_y)
+
+        # Normalisation of the tangent plane coordinates for the inverse fit
+        self._xi_c, self._xi_hw = _get_centre_and_half_width(val_xi)
+        self._eta_c, self._eta_hw = _get_centre_and_half_width(val_eta)
+
+        # Tangent plane distance per pixel, to express errors in pixels
+        pix_scale = np.sqrt(np.abs(np.median(np.linalg.det(val_jacobians))))
+
+        self.order = None
+        self.error = np.inf
+        self.jacobian_error = np.inf
+
+        for order in range(1, max_order + 1):
+
+            self._set_up_polynomials(fit_x, fit_y, fit_xi, fit_eta, order)
+
+            approx_xi, approx_eta = self._approx_pix2tan(val_x, val_y)
+            approx_x, approx_y = self._approx_tan2pix(val_xi, val_eta)
+
+            error = max(np.max(np.hypot(approx_xi - val_xi, approx_eta - val_eta)) / pix_scale,
+                        np.max(np.hypot(approx_x - val_x, approx_y - val_y)))
+            jacobian_error = np.max(np.abs(self._approx_tan_jacobians(val_x, val_y) - val_jacobians)) / pix_scale
+
+            self.error, self.jacobian_error = error, jacobian_error
+
+            if error <= max_error and jacobian_error <= max_jacobian_error:
+                self.order = order
+                break
+
+        if self.valid:
+            logger.debug("Approximated WCS over region x [%f, %f], y [%f, %f] with polynomials of order %d, with "
+                         "maximum error %e pixels and Jacobian error %e", self.xmin, self.xmax, self.ymin, self.ymax,
+                         self.order, self.error, self.jacobian_error)
+        else:
+            logger.warning("Could not approximate WCS over region x [%f, %f], y [%f, %f] to within %e pixels and "
+                           "Jacobian error %e with polynomials up to order %d (errors %e and %e); the exact WCS will "
+                           "be used.", self.xmin, self.xmax, self.ymin, self.ymax, max_error, max_jacobian_error,
+                           max_order, self.error, self.jacobian_error)
+
+    @property
+    def valid(self) -> bool:
+        """Whether or not the approximation meets the error bounds.
+        """
+        return self.order is not None
+
+    def pix2world(self,
+                  x: Union[float, np.ndarray[float]],
+                  y: Union[float, np.ndarray[float]],
+                  origin: Literal[0, 1] = 0) -> Tuple[np.ndarray[float], np.ndarray[float]]:
+        """Converts pixel coordinates to ra and dec world coordinates in degrees, in the same way as
+        `astropy.wcs.WCS.all_pix2world`.
+
+        Parameters
+        ----------
+        x : Union[float, np.ndarray[float]]
+            x pixel coordinate(s)
+        y : Union[float, np.ndarray[float]]
+            idem for y
+        origin : {0, 1}
+            Coordinate of the pixel in the lower left corner of the image
+
+        Returns
+        -------
+        ra : np.ndarray[float]
+            Right ascension(s) in degrees
+        dec : np.ndarray[float]
+            idem for Declination
+        """
+
+        shape, x, y = _flatten(x, y)
+        x -= origin
+        y -= origin
+
+        in_region = self._in_region(x, y)
+
+        if np.all(in_region):
+            ra, dec = self._tan2world(*self._approx_pix2tan(x, y))
+        else:
+            ra, dec = self.wcs.all_pix2world(x, y, 0)
+            if np.any(in_region):
+                ra[in_region], dec[in_region] = self._tan2world(*self._approx_pix2tan(x[in_region], y[in_region]))
+
+        return ra.reshape(shape), dec.reshape(shape)
+
+    def world2pix(self,
+                  ra: Union[float, np.ndarray[float]],
+                  dec: Union[float, np.ndarray[float]],
+                  origin: Literal[0, 1] = 0) -> Tuple[np.ndarray[float], np.ndarray[float]]:
+        """Converts ra and dec world coordinates in degrees to pixel coordinates, in the same way as
+        `astropy.wcs.WCS.all_world2pix`.
+
+        Parameters
+        ----------
+        ra : Union[float, np.ndarray[float]]
+            Right ascension(s) in degrees
+        dec : Union[float, np.ndarray[float]]
+            idem for Declination
+        origin : {0, 1}
+            Coordinate of the pixel in the lower left corner of the image
+
+        Returns
+        -------
+        x : np.ndarray[float]
+            x pixel coordinate(s)
+        y : np.ndarray[float]
+            idem for y
+        """
+
+        shape, ra, dec = _flatten(ra, dec)
+
+        if self.valid:
+            xi, eta, in_front = self._world2tan(ra, dec)
+            x, y = self._approx_tan2pix(xi, eta)
+
+            # Positions which the approximation puts outside of the region (or which are behind the tangent plane)
+            # are transformed exactly
+            exact = ~(in_front & self._in_region(x, y))
+        else:
+            x, y = np.empty_like(ra), np.empty_like(ra)
+            exact = np.ones(len(ra), dtype=bool)
+
+        if np.any(exact):
+            x[exact], y[exact] = self.wcs.all_world2pix(ra[exact], dec[exact], 0)
+
+        return (x + origin).reshape(shape), (y + origin).reshape(shape)
+
+    def local_jacobians(self,
+                        x: Union[float, np.ndarray[float]],
+                        y: Union[float, np.ndarray[float]],
+                        origin: Literal[0, 1] = 0) -> np.ndarray[float]:
+        """Gets the local pixel-to-world Jacobians at the given pixel coordinates, in the convention of
+        `galsim.wcs.JacobianWCS` - i.e. in arcsec per pixel, with +u pointing west and +v pointing north.
+
+        Parameters
+        ----------
+        x : Union[float, np.ndarray[float]]
+            x pixel coordinate(s)
+        y : Union[float, np.ndarray[float]]
+            idem for y
+        origin : {0, 1}
+            Coordinate of the pixel in the lower left corner of the image
+
+        Returns
+        -------
+        jacobians : np.ndarray[float]
+            Array of shape (..., 2, 2) of the Jacobians in the format [[ du/dx , du/dy ],
+                                                                      [ dv/dx , dv/dy ]]
+        """
+
+        shape, x, y = _flatten(x, y)
+        x -= origin
+        y -= origin
+
+        in_region = self._in_region(x, y)
+
+        # Positions in the tangent plane, and the Jacobians of the tangent plane coordinates
+        xi, eta = np.empty_like(x), np.empty_like(x)
+        tan_jacobians = np.empty((len(x), 2, 2))
+
+        if np.any(in_region):
+            xi[in_region], eta[in_region] = self._approx_pix2tan(x[in_region], y[in_region])
+            tan_jacobians[in_region] = self._approx_tan_jacobians(x[in_region], y[in_region])
+        if not np.all(in_region):
+            xi[~in_region], eta[~in_region] = self._exact_pix2tan(x[~in_region], y[~in_region])
+            tan_jacobians[~in_region] = self._exact_tan_jacobians(x[~in_region], y[~in_region])
+
+        # Unnormalised position vectors, and their derivatives with respect to x and y
+        v = self._c0 + np.stack((xi, eta), axis=-1) @ self._tan_basis
+        dv = tan_jacobians.transpose(0, 2, 1) @ self._tan_basis
+
+        norm_v = np.linalg.norm(v, axis=-1)
+        p = v / norm_v[:, None]
+
+        # Local west and north unit vectors at each position
+        north = np.stack((-p[:, 2] * p[:, 0], -p[:, 2] * p[:, 1], 1 - p[:, 2] ** 2), axis=-1)
+        north /= np.linalg.norm(north, axis=-1)[:, None]
+        west = np.cross(p, north)
+
+        # Project the derivatives onto the local directions (the components along p are removed by the projection)
+        jacobians = np.stack((west, north), axis=1) @ dv.transpose(0, 2, 1)
+        jacobians *= (ARCSEC_PER_RADIAN / norm_v)[:, None, None]
+
+        return jacobians.reshape(shape + (2, 2))
+
+    def _in_region(self, x: np.ndarray[float], y: np.ndarray[float]) -> np.ndarray[bool]:
+        """Private method to check which positions are within the approximated region. Always False if the
+        approximation is invalid.
+        """
+        if not self.valid:
+            return np.zeros(len(x), dtype=bool)
+        return (x >= self.xmin) & (x <= self.xmax) & (y >= self.ymin) & (y <= self.ymax)
+
+    def _get_grid(self, n: int) -> Tuple[np.ndarray[float], np.ndarray[float]]:
+        """Private method to get a regular grid of n x n points covering the approximated region.
+        """
+        x, y = np.meshgrid(np.linspace(self.xmin, self.xmax, n), np.linspace(self.ymin, self.ymax, n))
+        return x.ravel(), y.ravel()
+
+    def _set_up_tangent_plane(self, ra_c: float, dec_c: float) -> None:
+        """Private method to set up the unit vector of the centre of the tangent plane, and the unit vectors of its
+        east and north directions.
+        """
+        self._c0 = radec_to_unit_vectors(ra_c, dec_c)[0]
+        ra_c, dec_c = np.radians(ra_c), np.radians(dec_c)
+        self._tan_basis = np.array([[-np.sin(ra_c), np.cos(ra_c), 0.],
+                                    [-np.sin(dec_c) * np.cos(ra_c), -np.sin(dec_c) * np.sin(ra_c), np.cos(dec_c)]])
+
+    def _world2tan(self, ra: np.ndarray[float], dec: np.ndarray[float]) -> Tuple[np.ndarray[float],
+                                                                                 np.ndarray[float],
+                                                                                 np.ndarray[bool]]:
+        """Private method to project world coordinates onto the tangent plane (gnomonic projection, in radians).
+        Also returns whether or not each position is in front of the tangent plane.
+        """
+        p = radec_to_unit_vectors(ra, dec)
+        p_c = p @ self._c0
+        in_front = p_c > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xi, eta = (p @ self._tan_basis.T).T / np.where(in_front, p_c, 1.)
+        return xi, eta, in_front
+
+    def _tan2world(self, xi: np.ndarray[float], eta: np.ndarray[float]) -> Tuple[np.ndarray[float],
+                                                                                 np.ndarray[float]]:
+        """Private method to deproject tangent plane coordinates (in radians) to world coordinates in degrees.
+        """
+        v = self._c0 + np.stack((xi, eta), axis=-1) @ self._tan_basis
+        ra = np.degrees(np.arctan2(v[:, 1], v[:, 0])) % 360.
+        dec = np.degrees(np.arctan2(v[:, 2], np.hypot(v[:, 0], v[:, 1])))
+        return ra, dec
+
+    def _exact_pix2tan(self, x: np.ndarray[float], y: np.ndarray[float]) -> Tuple[np.ndarray[float],
+                                                                                  np.ndarray[float]]:
+        """Private method to transform pixel coordinates to tangent plane coordinates with the exact WCS.
+        """
+        xi, eta, _ = self._world2tan(*self.wcs.all_pix2world(x, y, 0))
+        return xi, eta
+
+    def _exact_tan_jacobians(self, x: np.ndarray[float], y: np.ndarray[float]) -> np.ndarray[float]:
+        """Private method to calculate the Jacobians of the tangent plane coordinates with respect to pixel
+        coordinates with the exact WCS, using central differences.
+        """
+        d = JACOBIAN_STEP
+        xi, eta = self._exact_pix2tan(np.concatenate((x + d, x - d, x, x)), np.concatenate((y, y, y + d, y - d)))
+        xi, eta = xi.reshape(4, -1), eta.reshape(4, -1)
+        jacobians = np.empty((len(x), 2, 2))
+        jacobians[:, 0, 0] = (xi[0] - xi[1]) / (2 * d)
+        jacobians[:, 1, 0] = (eta[0] - eta[1]) / (2 * d)
+        jacobians[:, 0, 1] = (xi[2] - xi[3]) / (2 * d)
+        jacobians[:, 1, 1] = (eta[2] - eta[3]) / (2 * d)
+        return jacobians
+
+    def _set_up_polynomials(self,
+                            x: np.ndarray[float],
+                            y: np.ndarray[float],
+                            xi: np.ndarray[float],
+                            eta: np.ndarray[float],
+                            order: int) -> None:
+        """Private method to fit the polynomials of the given order for both directions of the transformation.
+
+        The polynomials are fit as Legendre series in coordinates normalised to [-1, 1] (for good conditioning), and
+        then converted to power series, which are faster to evaluate.
+        """
+
+        # Conversion matrix from the coefficients of a Legendre series to those of a power series
+        leg2poly = np.zeros((order + 1, order + 1))
+        for i in range(order + 1):
+            leg2poly[:i + 1, i] = legendre.leg2poly(np.eye(order + 1)[i])
+
+        def fit(u, v, values):
+            vander = legendre.legvander2d(u, v, (order, order))
+            coeffs, _, _, _ = np.linalg.lstsq(vander, np.stack(values, axis=-1), rcond=None)
+            return leg2poly @ coeffs.T.reshape(-1, order + 1, order + 1) @ leg2poly.T
+
+        self._powers = np.arange(order + 1)
+
+        self._pix2tan_coeffs = fit(*self._normalise_pix(x, y), (xi, eta))
+        self._tan2pix_coeffs = fit(*self._normalise_tan(xi, eta), (x, y))
+
+        # Coefficients of the derivatives with respect to x and y
+        self._pix2tan_dx_coeffs = np.zeros_like(self._pix2tan_coeffs)
+        self._pix2tan_dx_coeffs[:, :-1, :] = self._pix2tan_coeffs[:, 1:, :] * self._powers[1:, None] / self._x_hw
+        self._pix2tan_dy_coeffs = np.zeros_like(self._pix2tan_coeffs)
+        self._pix2tan_dy_coeffs[:, :, :-1] = self._pix2tan_coeffs[:, :, 1:] * self._powers[1:] / self._y_hw
+
+    def _normalise_pix(self, x: np.ndarray[float], y: np.ndarray[float]) -> Tuple[np.ndarray[float],
+                                                                                  np.ndarray[float]]:
+        """Private method to normalise pixel coordinates to the range [-1, 1] over the approximated region.
+        """
+        return (x - self._x_c) / self._x_hw, (y - self._y_c) / self._y_hw
+
+    def _normalise_tan(self, xi: np.ndarray[float], eta: np.ndarray[float]) -> Tuple[np.ndarray[float],
+                                                                                     np.ndarray[float]]:
+        """Private method to normalise tangent plane coordinates to the range [-1, 1] over the approximated region.
+        """
+        return (xi - self._xi_c) / self._xi_hw, (eta - self._eta_c) / self._eta_hw
+
+    def _eval(self, coeffs: np.ndarray[float], u: np.ndarray[float], v: np.ndarray[float]) -> np.ndarray[float]:
+        """Private method to evaluate a stack of 2D power series at normalised coordinates.
+        """
+        n_coeffs, n_powers = len(coeffs), len(self._powers)
+        u_coeffs = _vander(u, n_powers) @ coeffs.transpose(1, 0, 2).reshape(n_powers, n_coeffs * n_powers)
+        return np.sum(u_coeffs.reshape(len(u), n_coeffs, n_powers) * _vander(v, n_powers)[:, None, :], axis=-1).T
+
+    def _approx_pix2tan(self, x: np.ndarray[float], y: np.ndarray[float]) -> np.ndarray[float]:
+        """Private method to transform pixel coordinates to tangent plane coordinates with the fitted polynomials.
+        """
+        return self._eval(self._pix2tan_coeffs, *self._normalise_pix(x, y))
+
+    def _approx_tan2pix(self, xi: np.ndarray[float], eta: np.ndarray[float]) -> np.ndarray[float]:
+        """Private method to transform tangent plane coordinates to pixel coordinates with the fitted polynomials.
+        """
+        return self._eval(self._tan2pix_coeffs, *self._normalise_tan(xi, eta))
+
+    def _approx_tan_jacobians(self, x: np.ndarray[float], y: np.ndarray[float]) -> np.ndarray[float]:
+        """Private method to calculate the Jacobians of the tangent plane coordinates with respect to pixel
+        coordinates from the derivatives of the fitted polynomials.
+        """
+        u, v = self._normalise_pix(x, y)
+        return np.stack((self._eval(self._pix2tan_dx_coeffs, u, v).T,
+                         self._eval(self._pix2tan_dy_coeffs, u, v).T), axis=-1)
+
+
+def _vander(a: np.ndarray[float], n: int) -> np.ndarray[float]:
+    """Private function to get the Vandermonde matrix of the powers 0 to n-1 of an array, by repeated multiplication
+    (which is much faster than raising to integer powers).
+    """
+    vander = np.empty((len(a), n))
+    vander[:, 0] = 1.
+    for i in range(1, n):
+        np.multiply(vander[:, i - 1], a, out=vander[:, i])
+    return vander
+
+
+def _flatten(a: Union[float, np.ndarray[float]],
+             b: Union[float, np.ndarray[float]]) -> Tuple[Tuple[int, ...], np.ndarray[float], np.ndarray[float]]:
+    """Private function to broadcast two arrays of coordinates together, returning their shape and flattened copies.
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    return a.shape, a.ravel().copy(), b.ravel().copy()
+
+
+def _get_centre_and_half_width(a: np.ndarray[float]) -> Tuple[float, float]:
+    """Private function to get the centre and half-width of the range of values in an array.
+    """
+    a_min, a_max = np.min(a), np.max(a)
+    return (a_min + a_max) / 2, (a_max - a_min) / 2
+
+
+def get_decompositions(jacobians: np.ndarray[float]) -> Tuple[np.ndarray[float],
+                                                              np.ndarray[float],
+                                                              np.ndarray[float],
+                                                              np.ndarray[float],
+                                                              np.ndarray[bool]]:
+    """Vectorised equivalent of `galsim.wcs.JacobianWCS.getDecomposition`, which decomposes Jacobians into a scale,
+    shear, rotation and possible flip.
+
+    Parameters
+    ----------
+    jacobians : np.ndarray[float]
+        Array of shape (..., 2, 2) of the Jacobians in the format [[ du/dx , du/dy ],
+                                                                  [ dv/dx , dv/dy ]]
+
+    Returns
+    -------
+    scale : np.ndarray[float]
+        Scale factors of the decompositions
+    g1 : np.ndarray[float]
+        g1 components of the shears of the decompositions
+    g2 : np.ndarray[float]
+        g2 components of the shears of the decompositions
+    theta : np.ndarray[float]
+        Rotation angles of the decompositions in radians
+    flip : np.ndarray[bool]
+        Whether or not each Jacobian includes a flip
+    """
+
+    jacobians = np.asarray(jacobians, dtype=float)
+
+    det = np.linalg.det(jacobians)
+    if np.any(det == 0):
+        raise ValueError("Transformation is singular")
+
+    flip = det < 0
+    scale = np.sqrt(np.abs(det))
+
+    # A flip swaps the x and y columns of the Jacobian
+    dudx = np.where(flip, jacobians[..., 0, 1], jacobians[..., 0, 0])
+    dudy = np.where(flip, jacobians[..., 0, 0], jacobians[..., 0, 1])
+    dvdx = np.where(flip, jacobians[..., 1, 1], jacobians[..., 1, 0])
+    dvdy = np.where(flip, jacobians[..., 1, 0], jacobians[..., 1, 1])
+
+    c = dudx + dvdy
+    s = dvdx - dudy
+    theta = np.arctan2(s, c)
+
+    factor = c * c + s * s
+    c = c / factor
+    s = s / factor
+
+    g1 = c * (dudx - dvdy) - s * (dudy + dvdx)
+    g2 = s * (dudx - dvdy) + c * (dudy + dvdx)
+
+    return scale, g1, g2, theta, flip
@@ -0,0 +1,94 @@
+"""
+This script times the object grouping functions in SHE_PPT.clustering and SHE_PPT.coordinates for increasing numbers
+of objects (at a fixed density of objects), to show how they scale up to the number of objects in a deep tile.
+
+Usage:
+    $ E-Run SHE_PPT 9.7 python SHE_PPT/scripts/benchmark_clustering.py --max_n 1000000 --sep 2
+
+"""
+
+# Copyright (C) 2012-2020 Euclid Science Ground Segment
+#
+# This library is free software; you can redistribute it and/or modify it under the terms of the GNU Lesser General
+# Public License as published by the Free Software Foundation; either version 3.0 of the License, or (at your option)
+# any later version.
+#
+# This library is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with this library; if not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301 USA
+
+import argparse
+import time
+
+import numpy as np
+
+from SHE_PPT.clustering import _find_group_ids, _merge_grouped, identify_all_groups
+from SHE_PPT.coordinates import get_subregion
+
+
+def _time(func, *args, **kwargs):
+    """Returns the time taken to call func(*args, **kwargs)"""
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def main():
+    """
+    @brief
+        Alternate entry point for non-Elements execution.
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--min_n', default=1000, type=int,
+                        help="The smallest number of objects to time (default 1000).")
+    parser.add_argument('--max_n', default=1000000, type=int,
+                        help="The largest number of objects to time (default 1000000).")
+    parser.add_argument('--density', default=0.05, type=float,
+                        help="The number of objects per unit area (default 0.05).")
+    parser.add_argument('--sep', default=2., type=float,
+                        help="The maximum separation between objects to group them together (default 2).")
+    parser.add_argument('--seed', default=1, type=int,
+                        help="The seed for the random positions of the objects (default 1).")
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    print("%10s %10s %15s %15s %15s %15s" % ("N", "N_groups", "get_subregion", "find_groups", "merge_grouped",
+                                             "total"))
+
+    n = args.min_n
+    while n <= args.max_n:
+
+        # uniformly distributed objects in a square with the requested density
+        width = np.sqrt(n / args.density)
+        x = rng.random(n) * width
+        y = rng.random(n) * width
+
+        # a subregion in the centre of the field, containing a quarter of the objects
+        t_subregion = _time(get_subregion, x, y, width / 4, 3 * width / 4, width / 4, 3 * width / 4)
+
+        t0 = time.perf_counter()
+        group_ids = _find_group_ids(x, y, args.sep)
+        t_find = time.perf_counter() - t0
+
+        t_merge = _time(_merge_grouped, x.copy(), y.copy(), group_ids)
+
+        t_total = _time(identify_all_groups, x, y, sep=args.sep)
+
+        print("%10d %10d %14.4fs %14.4fs %14.4fs %14.4fs" % (n, group_ids.max() + 1, t_subregion, t_find, t_merge,
+                                                             t_total))
+
+        n *= 10
+
+    return
+
+
+if __name__ == "__main__":
+    main()
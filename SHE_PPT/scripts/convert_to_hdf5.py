@@ -0,0 +1,88 @@
+"""
+This script converts all the VIS exposures in a listfile to HDF5 files, which can then be read with
+SHE_PPT.she_io.vis_exposures.read_vis_data(..., method="hdf5"), and writes a listfile of the HDF5 files.
+
+Usage:
+    $ E-Run SHE_PPT 9.7 python SHE_PPT/scripts/convert_to_hdf5.py --workdir $WORKDIR --vis_listfile vis.json
+      --seg_listfile seg.json --hdf5_listfile hdf5.json --chunk auto --compression lzf --max_workers 4
+
+"""
+
+# Copyright (C) 2012-2020 Euclid Science Ground Segment
+#
+# This library is free software; you can redistribute it and/or modify it under the terms of the GNU Lesser General
+# Public License as published by the Free Software Foundation; either version 3.0 of the License, or (at your option)
+# any later version.
+#
+# This library is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with this library; if not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA 02110-1301 USA
+
+import argparse
+
+from SHE_PPT.file_io import get_allowed_filename, read_listfile, write_listfile
+from SHE_PPT.she_io.hdf5 import COMPRESSION_OPTIONS, convert_exposures_to_hdf5
+
+
+def main():
+    """
+    @brief
+        Alternate entry point for non-Elements execution.
+    """
+
+    parser = argparse.ArgumentParser()
+
+    # Input arguments
+    parser.add_argument('--workdir', default='.', type=str,
+                        help="The workdir, containing the listfiles and products (default '.').")
+    parser.add_argument('--vis_listfile', required=True, type=str,
+                        help="Listfile of DpdVisCalibratedFrame products.")
+    parser.add_argument('--seg_listfile', required=True, type=str,
+                        help="Listfile of reprojected segmentation map products.")
+
+    # Output arguments
+    parser.add_argument('--hdf5_listfile', required=True, type=str,
+                        help="Listfile of the created HDF5 files.")
+
+    # Conversion options
+    parser.add_argument('--chunk', default='auto', type=str,
+                        help="Chunk shape: 'auto' (matched to the stamp size), 'none', or 'NY,NX' (default 'auto').")
+    parser.add_argument('--compression', default='gzip', type=str,
+                        choices=[str(c).lower() for c in COMPRESSION_OPTIONS],
+                        help="Compression to use for chunked files (default 'gzip').")
+    parser.add_argument('--shuffle', action='store_true',
+                        help="Apply the shuffle filter before compressing.")
+    parser.add_argument('--max_workers', default=None, type=int,
+                        help="Number of worker threads to use for each exposure (default: convert serially).")
+
+    args = parser.parse_args()
+
+    if args.chunk == 'auto':
+        chunk = 'auto'
+    elif args.chunk == 'none':
+        chunk = None
+    else:
+        chunk = tuple(int(n) for n in args.chunk.split(','))
+
+    compression = None if args.compression == 'none' else args.compression
+
+    vis_prods = read_listfile(args.vis_listfile, workdir=args.workdir)
+    seg_prods = read_listfile(args.seg_listfile, workdir=args.workdir)
+
+    hdf5_files = [get_allowed_filename(type_name="EXP", instance_id="HDF5-%d" % i, extension=".h5")
+                  for i in range(len(vis_prods))]
+
+    convert_exposures_to_hdf5(vis_prods, seg_prods, hdf5_files, workdir=args.workdir, chunk=chunk,
+                              compression=compression, shuffle=args.shuffle, max_workers=args.max_workers)
+
+    write_listfile(args.hdf5_listfile, hdf5_files, workdir=args.workdir)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,9 @@ import math
 
 import numpy as np
 
-from SHE_PPT.clustering import identify_all_groups, partition_into_batches
+from SHE_PPT.clustering import (_find_group_ids, _find_groups, _merge_grouped, identify_all_groups,
+                                partition_into_batches, )
+from SHE_PPT.coordinates import euclidean_metric, haversine_metric, haversine_metric_deg
 from SHE_PPT.testing.utility import SheTestCase
 
 
@@ -71,7 +73,7 @@ class Test_coordinates(SheTestCase):
 
         # now add a chain of nx-1 points in the x-direction to connect a whole line of points into a single group
         x_chain = x + [i + 0.5 for i in range(nx - 1)]
-        y_chain = y + [20 for i in range(nx + 1)]
+        y_chain = y + [20 for i in range(nx - 1)]
 
         xx, yy, groups = identify_all_groups(x_chain, y_chain, sep=0.9)
 
@@ -92,6 +94,64 @@ class Test_coordinates(SheTestCase):
         n_groups = groups.max() + 1
         assert (n_groups == 1)
 
+    def test_kdtree_groups(self):
+        """Tests that the KD-tree grouping gives the same groups as the distance matrix based grouping, for all the
+           supported metrics"""
+
+        rng = np.random.default_rng(1)
+        n = 1000
+
+        # points in a 1x1 degree field, with some points close to the RA=0 boundary
+        ras = np.mod(rng.random(n) - 0.2, 360.)
+        decs = rng.random(n) + 30.
+
+        for metric, x, y, sep in ((euclidean_metric, ras, decs, 0.02),
+                                  (haversine_metric_deg, ras, decs, 0.02),
+                                  (haversine_metric, np.radians(ras), np.radians(decs), np.radians(0.02))):
+
+            group_ids = _find_group_ids(x, y, sep, metric=metric)
+
+            # the distance matrix groups are ordered by cluster label, so sort by the lowest index of each group
+            expected_groups = sorted(_find_groups(x, y, sep, metric=metric), key=lambda group: group.min())
+            assert len(expected_groups) > 0
+
+            expected_group_ids = np.full(n, -1)
+            for group_id, group in enumerate(expected_groups):
+                expected_group_ids[group] = group_id
+
+            assert np.array_equal(group_ids, expected_group_ids)
+
+        # identify_all_groups with a custom metric uses the batched distance matrices, which should find the same
+        # groups (up to their numbering) as the KD-tree
+        _, _, group_ids = identify_all_groups(ras, decs, sep=0.02)
+        _, _, batch_group_ids = identify_all_groups(ras, decs, sep=0.02, batchsize=200,
+                                                    metric=lambda *args: euclidean_metric(*args))
+
+        pairs = set(zip(group_ids, batch_group_ids))
+        assert len(pairs) == len(set(group_ids)) == len(set(batch_group_ids))
+
+    def test_merge_grouped(self):
+        """Tests that _merge_grouped moves grouped objects to the centre of mass of their groups, and leaves
+           ungrouped objects where they are"""
+
+        rng = np.random.default_rng(1)
+        n = 1000
+
+        x = rng.random(n)
+        y = rng.random(n)
+        group_ids = rng.integers(-1, 50, n)
+
+        xs, ys = _merge_grouped(x.copy(), y.copy(), group_ids)
+
+        ungrouped = group_ids == -1
+        assert np.array_equal(xs[ungrouped], x[ungrouped])
+        assert np.array_equal(ys[ungrouped], y[ungrouped])
+
+        for group_id in range(50):
+            inds = group_ids == group_id
+            assert np.allclose(xs[inds], np.mean(x[inds]))
+            assert np.allclose(ys[inds], np.mean(y[inds]))
+
     def test_partition_into_batches(self):
 
         # create a unit square of n random points
@@ -26,6 +26,7 @@ import os
 import shutil
 import stat
 import subprocess
+import tarfile
 from time import sleep
 from typing import Type
 
@@ -40,13 +41,14 @@ from SHE_PPT.constants.classes import ShearEstimationMethods
 from SHE_PPT.constants.misc import DATA_SUBDIR
 from SHE_PPT.constants.test_data import (MDB_PRODUCT_FILENAME, MER_FINAL_CATALOG_LISTFILE_FILENAME, SYNC_CONF,
                                          TEST_DATADIR, TEST_DATA_LOCATION, )
-from SHE_PPT.file_io import (DEFAULT_FILE_EXTENSION, DEFAULT_FILE_SUBDIR, DEFAULT_INSTANCE_ID, DEFAULT_TYPE_NAME,
-                             FileLoader, FitsLoader, MultiFileLoader, MultiFitsLoader, MultiProductLoader,
-                             MultiTableLoader, ProductLoader, SheFileAccessError, SheFileNamer, SheFileReadError,
-                             SheFileWriteError, TableLoader, append_hdu, copy_listfile_between_dirs,
-                             copy_product_between_dirs, find_aux_file, find_conf_file, find_file, find_file_in_path,
-                             find_web_file, first_in_path, first_writable_in_path, get_all_files, get_allowed_filename,
-                             get_data_filename, get_qualified_filename, instance_id_maxlen, processing_function_maxlen,
+from SHE_PPT.file_io import (COPY_METHOD_HARDLINK, DEFAULT_FILE_EXTENSION, DEFAULT_FILE_SUBDIR, DEFAULT_INSTANCE_ID,
+                             DEFAULT_TYPE_NAME, FileLoader, FitsLoader, MultiFileLoader, MultiFitsLoader,
+                             MultiProductLoader, MultiTableLoader, ProductCache, ProductLoader, SheFileAccessError,
+                             SheFileNamer, SheFileReadError, SheFileWriteError, TAR_COMPRESSION_OPTIONS, TableLoader,
+                             append_hdu, copy_files, copy_listfile_between_dirs, copy_product_between_dirs,
+                             find_aux_file, find_conf_file, find_file, find_file_in_path, find_web_file, first_in_path,
+                             first_writable_in_path, get_all_files, get_allowed_filename, get_data_filename,
+                             get_qualified_filename, instance_id_maxlen, processing_function_maxlen,
                              read_d_l_method_table_filenames, read_d_l_method_tables, read_d_method_table_filenames,
                              read_d_method_tables, read_fits, read_listfile, read_product_and_table, read_table,
                              read_table_from_product, read_xml_product, remove_files, replace_in_file,
@@ -380,6 +382,46 @@ class TestIO(SheTestCase):
 
         try_remove_file(test_qualified_filename)
 
+    def test_product_cache(self):
+        """Tests that products read with use_cache=True are only parsed once while their file is unchanged, and that
+        each read returns an independent copy.
+        """
+
+        test_filename = "cached_product.xml"
+        test_qualified_filename = get_qualified_filename(test_filename,
+                                                         workdir=self.workdir)
+
+        write_xml_product(self.test_xml_product, test_qualified_filename)
+
+        product_cache = ProductCache(max_size=1)
+
+        p1 = product_cache.read_product(test_qualified_filename)
+        p2 = product_cache.read_product(test_qualified_filename)
+        assert product_cache.cache_info().hits == 1
+        assert product_cache.cache_info().misses == 1
+
+        # Modifying one product read in shouldn't affect others
+        assert p1 is not p2
+        p1.Header.ProductId = "modified"
+        assert product_cache.read_product(test_qualified_filename).Header.ProductId.value() != "modified"
+
+        # Rewriting the file should result in it being read in again
+        write_xml_product(p1, test_qualified_filename)
+        assert product_cache.read_product(test_qualified_filename).Header.ProductId.value() == "modified"
+        assert product_cache.cache_info().misses == 2
+
+        # Explicit invalidation, and read_xml_product's use of the process-wide cache
+        product_cache.invalidate(test_qualified_filename)
+        assert product_cache.cache_info().n_products == 0
+
+        p3 = read_xml_product(test_qualified_filename, product_type=dpdVisStackedFrame, use_cache=True)
+        assert p3.Header.ProductId.value() == "modified"
+
+        product_cache.cache_clear()
+        assert product_cache.cache_info() == (0, 0, 0, 1)
+
+        try_remove_file(test_qualified_filename)
+
     @staticmethod
     def _run_file_loader_test(file_loader: FileLoader, ex_type: Type):
         """Run common tests that a FileLoader works as expected.
@@ -980,6 +1022,69 @@ class TestIO(SheTestCase):
                       workdir=self.workdir,
                       delete_files=False)
 
+    @pytest.mark.parametrize("compression", TAR_COMPRESSION_OPTIONS)
+    def test_tar_files_compressed(self, compression):
+        """ Runs test of tarring files with each compression option, in chunks, deleting files as we go.
+        """
+
+        if compression == "zstd" and SHE_PPT.file_io.zstandard is None:
+            pytest.skip("zstandard package not available")
+
+        # Set up files in a subdirectory, with enough data to be split over multiple blocks for "gz" compression
+        os.makedirs(os.path.join(self.workdir, "tar_test"), exist_ok=True)
+
+        rng = np.random.default_rng(1234)
+        d_data = {}
+        for i in range(7):
+            filename = os.path.join("tar_test", f"file_{i}.bin")
+            d_data[filename] = rng.integers(0, 16, size=300000, dtype=np.uint8).tobytes()
+            with open(os.path.join(self.workdir, filename), "wb") as fo:
+                fo.write(d_data[filename])
+
+        tarball_filename = f"tarball_{compression}.tar"
+
+        # Pass the filenames as a generator, to check that they're read lazily
+        tar_files(tarball_filename=tarball_filename,
+                  l_filenames=(filename for filename in d_data),
+                  workdir=self.workdir,
+                  delete_files=True,
+                  compression=compression,
+                  max_workers=2,
+                  chunk_size=3)
+
+        for filename in d_data:
+            assert not os.path.exists(os.path.join(self.workdir, filename))
+
+        # Check the contents of the tarball
+        qualified_tarball_filename = os.path.join(self.workdir, tarball_filename)
+        if compression == "zstd":
+            with open(qualified_tarball_filename, "rb") as fi:
+                tar_fileobj = SHE_PPT.file_io.zstandard.ZstdDecompressor().stream_reader(fi.read())
+            tar = tarfile.open(fileobj=tar_fileobj, mode="r|")
+        else:
+            tar = tarfile.open(qualified_tarball_filename, mode="r")
+        with tar:
+            d_read_data = {member.name: tar.extractfile(member).read() for member in tar}
+        assert d_read_data == d_data
+
+        # Check that we can only append to uncompressed tarballs
+        with open(os.path.join(self.workdir, "extra.txt"), "w") as fo:
+            fo.write("baz\n")
+        if compression is None:
+            tar_files(tarball_filename=tarball_filename,
+                      l_filenames=["extra.txt"],
+                      workdir=self.workdir,
+                      append=True)
+            with tarfile.open(qualified_tarball_filename, mode="r") as tar:
+                assert tar.getnames() == list(d_data) + ["extra.txt"]
+        else:
+            with pytest.raises(ValueError):
+                tar_files(tarball_filename=tarball_filename,
+                          l_filenames=["extra.txt"],
+                          workdir=self.workdir,
+                          compression=compression,
+                          append=True)
+
     def test_rw_product_and_table(self):
         """ Test reading and writing a product and table together with utility functions.
         """
@@ -1093,6 +1198,90 @@ class TestIO(SheTestCase):
         # Cleanup created data
         shutil.rmtree(dest_subdir)
 
+    def test_copy_files(self):
+        """ Unit test for SHE_PPT.file_io.copy_files
+        """
+
+        l_filenames = [f"copy_test_{i}.bin" for i in range(5)]
+        rng = np.random.default_rng(1234)
+        for filename in l_filenames:
+            with open(os.path.join(self.src_dir, filename), "wb") as fo:
+                fo.write(rng.integers(0, 256, size=10000, dtype=np.uint8).tobytes())
+
+        copy_dest_dir = os.path.join(self.dest_dir, "copy_test")
+        l_file_pairs = [(os.path.join(self.src_dir, filename), os.path.join(copy_dest_dir, filename))
+                        for filename in l_filenames]
+
+        # Copy all files, including a duplicated one, which should only be copied once
+        report = copy_files(l_file_pairs + l_file_pairs[:1], max_workers=2)
+
+        assert report.num_files == 5
+        assert report.num_copied == 5
+        assert report.nbytes == 50000
+        for qualified_src_filename, qualified_dest_filename in l_file_pairs:
+            assert filecmp.cmp(qualified_src_filename, qualified_dest_filename, shallow=False)
+
+        # Modify one destination file, and check that only it is replaced when overwriting, with identical files
+        # skipped, and that nothing is replaced if not overwriting
+        with open(l_file_pairs[2][1], "r+b") as fo:
+            fo.write(b"foo")
+
+        report = copy_files(l_file_pairs, max_workers=2)
+        assert report.num_copied == 0
+        assert not filecmp.cmp(*l_file_pairs[2], shallow=False)
+
+        report = copy_files(l_file_pairs, overwrite=True, max_workers=2)
+        assert report.num_copied == 1
+        assert report.num_skipped == 4
+        assert filecmp.cmp(*l_file_pairs[2], shallow=False)
+
+        # Check that we can hard link files, replacing the copies
+        os.remove(l_file_pairs[0][1])
+        copy_files(l_file_pairs, method=COPY_METHOD_HARDLINK)
+        assert os.path.samefile(*l_file_pairs[0])
+
+        # Check that we get expected errors
+        with pytest.raises(SheFileWriteError):
+            copy_files(l_file_pairs, require_dest_free=True)
+        with pytest.raises(SheFileReadError):
+            copy_files([(os.path.join(self.src_dir, FILENAME_NO_FILE), os.path.join(copy_dest_dir, FILENAME_NO_FILE))],
+                       require_src_exist=True)
+        with pytest.raises(ValueError):
+            copy_files(l_file_pairs, method="bad_method")
+
+        # Cleanup the created files
+        shutil.rmtree(copy_dest_dir)
+
+    def test_copy_files_empty_copy_file_range(self, monkeypatch):
+        """ Test that copy_files falls back to a standard copy if os.copy_file_range reports success without copying
+            anything, as happens on some filesystems.
+        """
+
+        filename = "copy_range_test.bin"
+        qualified_src_filename = os.path.join(self.src_dir, filename)
+        qualified_dest_filename = os.path.join(self.dest_dir, filename)
+        with open(qualified_src_filename, "wb") as fo:
+            fo.write(np.random.default_rng(1234).integers(0, 256, size=10000, dtype=np.uint8).tobytes())
+
+        # Disable reflinks so that os.copy_file_range is tried, and have it copy nothing
+        l_copy_file_range_calls = []
+
+        def mock_copy_file_range(*args, **kwargs):
+            l_copy_file_range_calls.append(args)
+            return 0
+
+        monkeypatch.setattr(SHE_PPT.file_io, "fcntl", None)
+        monkeypatch.setattr(os, "copy_file_range", mock_copy_file_range, raising=False)
+
+        report = copy_files([(qualified_src_filename, qualified_dest_filename)])
+
+        assert len(l_copy_file_range_calls) == 1
+        assert report.num_copied == 1
+        assert report.nbytes == 10000
+        assert filecmp.cmp(qualified_src_filename, qualified_dest_filename, shallow=False)
+
+        os.remove(qualified_dest_filename)
+
     def test_copy_product(self):
         """ Unit test for SHE_PPT.file_io.copy_product_between_dirs
         """
@@ -1408,6 +1597,53 @@ class TestMeasurementsProductIO(SheTestCase):
         assert isinstance(test_product, dpdSheValidatedMeasurements)
         assert test_product.Header.ProductId.value() == self.ex_product_id
 
+    def test_read_d_l_method_tables_concurrent(self):
+        """Test that reading with a thread pool gives the same output, in the same order, as reading serially, and
+        raises the same exception for a missing product.
+        """
+
+        # Write a second product with only the KSB table, so that the lists for each method differ in length
+        shm_product_2 = create_dpd_she_validated_measurements(KSB_filename=self.KSB_TABLE_FILENAME)
+        shm_product_filename_2 = "shm_product_2.xml"
+        write_xml_product(shm_product_2, shm_product_filename_2, workdir=self.workdir)
+
+        l_product_filenames = [self.SHM_PRODUCT_FILENAME, shm_product_filename_2, self.SHM_PRODUCT_FILENAME]
+
+        (d_l_method_tables_serial,
+         l_products_serial) = read_d_l_method_tables(l_product_filenames=l_product_filenames,
+                                                     workdir=self.workdir)
+        (d_l_method_tables,
+         l_products) = read_d_l_method_tables(l_product_filenames=l_product_filenames,
+                                              workdir=self.workdir,
+                                              max_workers=4)
+
+        assert ([p.Header.ProductId.value() for p in l_products] ==
+                [p.Header.ProductId.value() for p in l_products_serial])
+
+        for method in ShearEstimationMethods:
+            assert len(d_l_method_tables[method]) == len(d_l_method_tables_serial[method])
+            for test_table, ex_table in zip(d_l_method_tables[method], d_l_method_tables_serial[method]):
+                assert test_table.colnames == ex_table.colnames
+                assert len(test_table) == len(ex_table)
+        assert len(d_l_method_tables[ShearEstimationMethods.KSB]) == 3
+        assert len(d_l_method_tables[ShearEstimationMethods.LENSMC]) == 2
+
+        with pytest.raises(SheFileReadError):
+            read_d_l_method_table_filenames(l_product_filenames=l_product_filenames + ["missing_product.xml"],
+                                            workdir=self.workdir,
+                                            max_workers=4)
+
+        # Test that a MultiProductLoader also preserves order
+        multi_product_loader = MultiProductLoader(workdir=self.workdir,
+                                                  l_filenames=l_product_filenames)
+        l_products = multi_product_loader.get_all(max_workers=4)
+        assert ([p.Header.ProductId.value() for p in l_products] ==
+                [p.Header.ProductId.value() for p in l_products_serial])
+
+        multi_product_loader.load_all(max_workers=4)
+        assert ([file_loader.obj.Header.ProductId.value() for file_loader in multi_product_loader.l_file_loaders] ==
+                [p.Header.ProductId.value() for p in l_products_serial])
+
     def test_read_d_method_tables(self):
         """Unit test of `read_d_method_tables` function.
         """
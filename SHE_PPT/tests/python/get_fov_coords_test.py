@@ -26,6 +26,7 @@
 import pytest
 
 import numpy as np
+from astropy.coordinates import SkyCoord
 from astropy.wcs import WCS
 
 from SHE_PPT.she_image import SHEImage
@@ -149,3 +150,81 @@ class TestGetFovCoords:
         assert np.abs(y12 - y11) < np.abs(
             x11 - x21
         ), "Gap between detectors is bigger in y than x - detector IDs may be transposed?"
+
+    def test_find_positions(self, frame):
+        """
+        Tests that the vectorised SHEFrame.find_positions agrees with SHEFrame._find_position
+        """
+
+        # positions at the centres of a few detectors, and one outside the FOV of all detectors
+        x = PIXEL_SHAPE[0] / 2
+        y = PIXEL_SHAPE[1] / 2
+        l_det_ixy = [(1, 1), (4, 5), (6, 6), (2, 3)]
+
+        l_ra = []
+        l_dec = []
+        for det_x, det_y in l_det_ixy:
+            ra, dec = frame.detectors[det_y, det_x].pix2world(x, y)
+            l_ra.append(ra)
+            l_dec.append(dec)
+
+        bad_ra, bad_dec = frame.detectors[1, 1].pix2world(-500, -500)
+        l_ra.append(bad_ra)
+        l_dec.append(bad_dec)
+
+        x_i, y_i, xs, ys = frame.find_positions(np.array(l_ra), np.array(l_dec))
+
+        for i, (ra, dec) in enumerate(zip(l_ra, l_dec)):
+            detector, x_det, y_det, det_x_i, det_y_i = frame._find_position(ra, dec)
+
+            if detector is None:
+                assert x_i[i] == -1 and y_i[i] == -1, "find_positions found a position not on any detector"
+                assert np.isnan(xs[i]) and np.isnan(ys[i]), "find_positions returned pixel coords for a bad position"
+                continue
+
+            assert (x_i[i], y_i[i]) == (det_x_i, det_y_i), "find_positions returned the wrong detector"
+            assert np.isclose(xs[i], x_det), "find_positions did not return the correct detector x pixel"
+            assert np.isclose(ys[i], y_det), "find_positions did not return the correct detector y pixel"
+
+        # The position outside the FOV should have no candidate detectors in the footprint index
+        assert len(frame.footprint_index.get_candidate_detectors(bad_ra, bad_dec)) == 0
+
+    def test_get_objects_in_exposure(self, frame):
+        """
+        Tests that SHEFrame.get_objects_in_exposure agrees with SHEImage.get_objects_in_detector for each detector
+        """
+
+        # Random positions covering all the detectors and some of the area around them
+        rng = np.random.default_rng(1234)
+
+        n = 10000
+        l_ra, l_dec = frame.detectors[1, 1].pix2world(rng.uniform(-1000, 5 * 5000 + PIXEL_SHAPE[0] + 1000, n),
+                                                      rng.uniform(-1000, 5 * 5000 + PIXEL_SHAPE[1] + 1000, n))
+        sc = SkyCoord(l_ra, l_dec, unit="deg")
+
+        for buffer in (0, 50):
+
+            all_inds, all_xs, all_ys, detectors = frame.get_objects_in_exposure(sc, x_buffer=buffer, y_buffer=buffer)
+
+            assert len(all_inds) > 0
+
+            start = 0
+            for x_i in range(7):
+                for y_i in range(7):
+
+                    detector = frame.detectors[x_i, y_i]
+                    if detector is None:
+                        continue
+
+                    inds, xs, ys = detector.get_objects_in_detector(sc, x_buffer=buffer, y_buffer=buffer)
+
+                    end = start + len(inds)
+
+                    assert np.all(all_inds[start:end] == inds)
+                    assert np.allclose(all_xs[start:end], xs)
+                    assert np.allclose(all_ys[start:end], ys)
+                    assert np.all(detectors[start:end] == (x_i, y_i))
+
+                    start = end
+
+            assert start == len(all_inds)
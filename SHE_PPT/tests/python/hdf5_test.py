@@ -23,8 +23,36 @@
 :author: Gordon Gibb
 """
 
+import os
+
+import h5py
+import numpy as np
 import pytest
 
+from SHE_PPT.she_io.hdf5 import convert_to_hdf5, get_chunk_shape, DEFAULT_STAMP_SIZE
+
+# NOTE the file conftest.py contains the pytest fixtures used by this test
+
+
+def verify_same_hdf5(filename, expected_filename):
+    """Verifies that two converted HDF5 files contain the same attributes and data"""
+
+    with h5py.File(filename, "r") as f, h5py.File(expected_filename, "r") as expected_f:
+        for attr in ("header", "det_list", "wcs_list", "header_list"):
+            assert f.attrs[attr] == expected_f.attrs[attr], "Attribute %s differs" % attr
+
+        assert set(f) == set(expected_f)
+
+        for group_name in f:
+            group, expected_group = f[group_name], expected_f[group_name]
+            assert group.attrs["wcs"] == expected_group.attrs["wcs"]
+
+            for dataset_name in ("sci", "rms", "flg", "wgt", "bkg", "seg"):
+                ds, expected_ds = group[dataset_name], expected_group[dataset_name]
+                assert ds.dtype == expected_ds.dtype
+                assert ds.attrs["header"] == expected_ds.attrs["header"]
+                assert np.array_equal(ds[()], expected_ds[()]), "Dataset %s/%s differs" % (group_name, dataset_name)
+
 
 class Testhdf5(object):
     @pytest.mark.skip(reason="Conversion is implicitly tested in vis_exposures_test")
@@ -34,3 +62,36 @@ class Testhdf5(object):
         # which minimally tests that the conversion function does not fail. The tests on the VisExposures
         # classes check that astropy.fits, fitsio and HDF5 files all contain exectly the same data
         pass
+
+    def test_parallel_conversion(self, workdir, input_fits):
+        """Tests that the pipelined conversion gives the same data as the serial conversion, for each compression
+        option"""
+
+        det, wgt, bkg, _, _, seg = input_fits
+
+        fits_files = [os.path.join(workdir, "data", f) for f in (det, bkg, wgt, seg)]
+
+        expected_filename = os.path.join(workdir, "serial.h5")
+        convert_to_hdf5(*fits_files, expected_filename)
+
+        for kwargs in (
+            dict(chunk=(100, 100)),
+            dict(chunk="auto", shuffle=True),
+            dict(chunk=(100, 100), compression="lzf"),
+            dict(chunk=None),
+        ):
+            for max_workers in (None, 2):
+                filename = os.path.join(workdir, "parallel.h5")
+                convert_to_hdf5(*fits_files, filename, max_workers=max_workers, **kwargs)
+                verify_same_hdf5(filename, expected_filename)
+
+        with pytest.raises(ValueError):
+            convert_to_hdf5(*fits_files, filename, chunk=(100, 100), compression="invalid compression")
+
+    def test_get_chunk_shape(self):
+        """Tests the chunk shapes are matched to the stamp size, and no larger than the image"""
+
+        chunk = get_chunk_shape((4136, 4096))
+        assert chunk[0] == chunk[1] < DEFAULT_STAMP_SIZE
+
+        assert get_chunk_shape((4136, 50), stamp_size=400) == (100, 50)
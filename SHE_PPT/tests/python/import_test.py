@@ -21,6 +21,10 @@ __updated__ = "2021-08-20"
 # You should have received a copy of the GNU Lesser General Public License along with this library; if not, write to
 # the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import json
+import subprocess
+import sys
+
 from SHE_PPT import *  # noqa: F401,F403
 from SHE_PPT.constants import *  # noqa: F401,F403
 from SHE_PPT.products import *  # noqa: F401,F403
@@ -29,6 +33,21 @@ from SHE_PPT.table_formats import *  # noqa: F401,F403
 from SHE_PPT.testing import *  # noqa: F401,F403
 from SHE_PPT.testing.utility import SheTestCase
 
+# Code run in a fresh interpreter to time importing a product module, and list which product and table format modules
+# end up imported
+IMPORT_BENCHMARK_CODE = """
+import json, sys, time
+t0 = time.perf_counter()
+import SHE_PPT.file_io
+t1 = time.perf_counter()
+from SHE_PPT.products import she_psf_model_image
+t2 = time.perf_counter()
+print(json.dumps({"t_file_io": t1 - t0,
+                  "t_product": t2 - t1,
+                  "l_modules": [m for m in sys.modules if m.startswith(("SHE_PPT.products.",
+                                                                         "SHE_PPT.table_formats."))]}))
+"""
+
 
 class TestImports(SheTestCase):
 
@@ -37,3 +56,17 @@ class TestImports(SheTestCase):
             module level.
         """
         pass
+
+    def test_import_time(self):
+        """ Benchmark of the time to import SHE_PPT.file_io and a single product module in a fresh interpreter, checking
+            that this doesn't import all other product and table format modules.
+        """
+
+        output = subprocess.run([sys.executable, "-c", IMPORT_BENCHMARK_CODE],
+                                check=True, capture_output=True, text=True).stdout
+        d_results = json.loads(output.splitlines()[-1])
+
+        print(f"Import time of SHE_PPT.file_io: {d_results['t_file_io']:.3f} s; "
+              f"of SHE_PPT.products.she_psf_model_image: {d_results['t_product']:.3f} s")
+
+        assert d_results["l_modules"] == ["SHE_PPT.products.she_psf_model_image"]
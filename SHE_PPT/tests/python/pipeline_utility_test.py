@@ -20,6 +20,7 @@
 
 __updated__ = "2021-08-12"
 
+import filecmp
 import os
 import shutil
 from argparse import Namespace
@@ -120,6 +121,17 @@ class TestPipelineUtility(SheTestCase):
         assert os.path.exists(os.path.join(qualified_subdir_name, product_filename))
         assert os.path.exists(os.path.join(qualified_subdir_name, table_filename))
 
+        # Check that archiving the product again replaces the archived table if it's been modified
+        qualified_archived_table_filename = os.path.join(qualified_subdir_name, table_filename)
+        with open(qualified_archived_table_filename, "ab") as fo:
+            fo.write(b"foo")
+
+        archive_product(product_filename=product_filename,
+                        archive_dir=qualified_base_subdir_name,
+                        workdir=self.workdir)
+        assert filecmp.cmp(os.path.join(self.workdir, table_filename), qualified_archived_table_filename,
+                           shallow=False)
+
         # Check that we can also copy a non-product, getting only a warning
         table_filename_2 = "test_table_2.fits"
         shutil.copy(os.path.join(self.workdir, table_filename),
@@ -35,7 +35,8 @@ from SHE_PPT.she_io.psf_model_images import (
     PSFModelImage,
     read_psf_model_images,
     ObjectModelImage,
-    PSFModelImagesWriter
+    PSFModelImagesWriter,
+    PSF_LAYOUT_STACKED,
 )
 
 # NOTE the file conftest.py contains the pytest fixtures used by this test
@@ -167,3 +168,136 @@ class TestPSFModelImagesWriter:
 
         with pytest.raises(RuntimeError, match="This PSFWriter object is finalised!"):
             writer.close()
+
+
+class TestPSFModelImagesWriterStacked:
+    """Tests the PSFModelImagesWriter class with the stacked layout"""
+
+    @pytest.mark.parametrize("compression_workers", [0, 2])
+    def test_writer_stacked(self, workdir, compression_workers):
+        """Tests that PSFs written in several blocks are read back correctly, including for objects not modelled"""
+
+        psf_filename = workdir / "psf_stacked.h5"
+
+        object_ids = list(range(10, 20))
+        psfs = {}
+        with PSFModelImagesWriter(object_ids, psf_filename, OVERSAMPLING_FACTOR, layout=PSF_LAYOUT_STACKED,
+                                  block_size=3, compression_workers=compression_workers) as writer:
+            # Write in an order different to the table's, and skip some objects
+            for obj in object_ids[::-2] + object_ids[-4::-2]:
+                psfs[obj] = np.random.random(PSF_SHAPE)
+                writer.write_psf(obj, psfs[obj])
+
+        psf_models = PSFModelImageHDF5(psf_filename)
+        assert psf_models.layout == PSF_LAYOUT_STACKED
+        assert psf_models.stacked_images.shape == (len(psfs),) + PSF_SHAPE
+
+        for obj in object_ids:
+            image = psf_models[obj]
+            if obj in psfs:
+                assert np.array_equal(image.bulge, psfs[obj])
+                assert image.table_row["MODELLED"]
+            else:
+                assert image.bulge.size == 0
+                assert not image.table_row["MODELLED"]
+
+        batch = psf_models.get_model_images_batch(object_ids[::-1])
+        for obj, image, modelled in zip(object_ids[::-1], batch.bulge, batch.modelled):
+            assert modelled == (obj in psfs)
+            if modelled:
+                assert np.array_equal(image, psfs[obj])
+
+        validate_psf_model_image(psf_models)
+
+    @pytest.mark.parametrize("layout", [None, PSF_LAYOUT_STACKED])
+    def test_writer_reused_array(self, workdir, layout):
+        """Tests that each PSF is written correctly when the caller reuses one array for all of them"""
+
+        psf_filename = workdir / "psf_reused.h5"
+
+        kwargs = {} if layout is None else {"layout": layout, "block_size": 3}
+
+        psfs = {}
+        psf_buffer = np.empty(PSF_SHAPE)
+        with PSFModelImagesWriter(OBJECT_ID_LIST, psf_filename, OVERSAMPLING_FACTOR, **kwargs) as writer:
+            for obj in OBJECT_ID_LIST:
+                psf_buffer[...] = np.random.random(PSF_SHAPE)
+                psfs[obj] = psf_buffer.copy()
+                writer.write_psf(obj, psf_buffer)
+
+        psf_models = PSFModelImageHDF5(psf_filename)
+
+        for obj in OBJECT_ID_LIST:
+            assert np.array_equal(psf_models[obj].bulge, psfs[obj])
+
+    def test_writer_stacked_shape_mismatch(self, workdir):
+        """Tests that the writer raises an exception if PSFs of different shapes are written to the stacked layout"""
+
+        psf_filename = workdir / "psf_stacked.h5"
+
+        with PSFModelImagesWriter(OBJECT_ID_LIST, psf_filename, OVERSAMPLING_FACTOR, layout=PSF_LAYOUT_STACKED,
+                                  block_size=1) as writer:
+            writer.write_psf(OBJECT_ID_LIST[0], np.random.random(PSF_SHAPE))
+            with pytest.raises(ValueError, match="does not match the shape"):
+                writer.write_psf(OBJECT_ID_LIST[1], np.random.random((10, 10)))
+
+
+class TestPSFModelImageHDF5:
+    """Tests the batch reading and caching of PSFModelImageHDF5"""
+
+    def test_get_model_images_batch(self, workdir):
+        """Tests that a batch of PSFs is stacked in the requested order, including repeated and unmodelled objects"""
+
+        psf_filename = workdir / "psf.h5"
+
+        psfs = {}
+        with PSFModelImagesWriter(OBJECT_ID_LIST, psf_filename, OVERSAMPLING_FACTOR) as writer:
+            for obj in OBJECT_ID_LIST[:-1]:
+                psfs[obj] = np.random.random(PSF_SHAPE)
+                writer.write_psf(obj, psfs[obj], quality_flag=obj)
+
+        psf_models = PSFModelImageHDF5(psf_filename)
+
+        obj_ids = [2, 0, OBJECT_ID_LIST[-1], 2]
+        batch = psf_models.get_model_images_batch(obj_ids)
+
+        assert batch.bulge.shape == (len(obj_ids),) + PSF_SHAPE
+        assert list(batch.modelled) == [True, True, False, True]
+        assert list(batch.table_rows["OBJECT_ID"]) == obj_ids
+        assert list(batch.quality_flags[[0, 1, 3]]) == [2, 0, 2]
+
+        for obj, image, modelled in zip(obj_ids, batch.bulge, batch.modelled):
+            if modelled:
+                assert np.array_equal(image, psfs[obj])
+            else:
+                assert not image.any()
+
+        with pytest.raises(KeyError, match="not present"):
+            psf_models.get_model_images_batch([0, 12345])
+
+    def test_cache(self, workdir):
+        """Tests that objects are served from the cache, and the least recently used are evicted from it"""
+
+        psf_filename = workdir / "psf.h5"
+
+        psfs = {}
+        with PSFModelImagesWriter(OBJECT_ID_LIST, psf_filename, OVERSAMPLING_FACTOR) as writer:
+            for obj in OBJECT_ID_LIST:
+                psfs[obj] = np.random.random(PSF_SHAPE)
+                writer.write_psf(obj, psfs[obj])
+
+        psf_models = PSFModelImageHDF5(psf_filename, cache_size=2)
+
+        model = psf_models[0]
+        assert psf_models[0] is model
+        assert not model.bulge.flags.writeable
+
+        psf_models.get_model_images_batch([1, 2])
+        assert list(psf_models._cache) == [1, 2]
+
+        # Cached and uncached objects should be stacked together correctly
+        batch = psf_models.get_model_images_batch([2, 3, 0])
+        for obj, image in zip([2, 3, 0], batch.bulge):
+            assert np.array_equal(image, psfs[obj])
+        assert list(psf_models._cache) == [3, 0]
+        assert np.array_equal(psf_models[3].bulge, psfs[3])
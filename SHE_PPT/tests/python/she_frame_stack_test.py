@@ -0,0 +1,338 @@
+"""
+File: tests/python/she_frame_stack_test.py
+
+Created on: 17/10/26
+"""
+
+__updated__ = "2026-10-17"
+
+# Copyright (C) 2012-2020 Euclid Science Ground Segment
+#
+# This library is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3.0 of the License, or (at your option)
+# any later version.
+#
+# This library is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+from astropy.units import degree
+
+from SHE_PPT.file_io import read_listfile, write_listfile
+from SHE_PPT.she_frame import SHEFrame
+from SHE_PPT.she_frame_stack import (PLACEMENT_COLUMNS, PLACEMENT_DET_IX, PLACEMENT_DET_IY, PLACEMENT_EXP_INDEX,
+                                     PLACEMENT_OBJ_INDEX, PLACEMENT_X, PLACEMENT_Y, SHEFrameStack)
+from SHE_PPT.table_formats.mer_final_catalog import tf as mfc_tf
+
+# NOTE the file conftest.py contains or imports the pytest fixtures used by this test
+
+STAMP_SIZE = 20
+
+
+def read_frame_stack(workdir, input_products, **kwargs):
+    """Reads a SHEFrameStack (without PSFs or a stacked image) from the mock input products"""
+
+    vis_listfile, mer_listfile, _, seg_listfile, _ = input_products
+
+    return SHEFrameStack.read(exposure_listfile_filename=vis_listfile,
+                              seg_listfile_filename=seg_listfile,
+                              detections_listfile_filename=mer_listfile,
+                              workdir=str(workdir),
+                              **kwargs)
+
+
+def write_distinct_exposure_listfile(workdir, input_products):
+    """Copies the product of each exposure to a different filename, so that the exposures can be told apart, and
+    writes a listfile of these. Returns the input products with this listfile in place of the original one, and the
+    list of exposure product filenames."""
+
+    vis_listfile = input_products[0]
+
+    l_exposure_filenames = []
+    for i, exposure_filename in enumerate(read_listfile(os.path.join(workdir, vis_listfile))):
+        distinct_filename = "exposure_%d.xml" % i
+        shutil.copy(os.path.join(workdir, exposure_filename), os.path.join(workdir, distinct_filename))
+        l_exposure_filenames.append(distinct_filename)
+
+    distinct_vis_listfile = "distinct_data_images.json"
+    write_listfile(os.path.join(workdir, distinct_vis_listfile), l_exposure_filenames)
+
+    return (distinct_vis_listfile, *input_products[1:]), l_exposure_filenames
+
+
+@pytest.fixture
+def frame_stack(workdir, input_products_ccd):
+    return read_frame_stack(workdir, input_products_ccd)
+
+
+@pytest.fixture
+def object_coords(frame_stack):
+    """The coordinates of the objects in the detections catalogue, followed by a point far outside the observation"""
+
+    ras = np.asarray(frame_stack.detections_catalogue[mfc_tf.gal_x_world], dtype=float)
+    decs = np.asarray(frame_stack.detections_catalogue[mfc_tf.gal_y_world], dtype=float)
+
+    ras = np.append(ras, (ras[0] + 180) % 360)
+    decs = np.append(decs, -decs[0])
+
+    return SkyCoord(ras, decs, unit=degree)
+
+
+class TestSheFrameStack(object):
+
+    def test_get_object_placements(self, frame_stack, object_coords):
+        """Tests that get_object_placements finds each object where SHEFrame.find_positions and
+        SHEFrame.get_objects_in_exposure do, in order of object and then exposure"""
+
+        placements = frame_stack.get_object_placements(object_coords)
+
+        assert placements.colnames == PLACEMENT_COLUMNS
+
+        obj_index = placements[PLACEMENT_OBJ_INDEX].data
+        exp_index = placements[PLACEMENT_EXP_INDEX].data
+
+        # Rows should be sorted by object, then exposure
+        assert np.array_equal(np.lexsort((exp_index, obj_index)), np.arange(len(placements)))
+
+        # The off-field point should not be found
+        assert len(object_coords) - 1 not in obj_index
+
+        ras = object_coords.ra.deg
+        decs = object_coords.dec.deg
+
+        for i, exposure in enumerate(frame_stack.exposures):
+
+            exp_placements = placements[exp_index == i]
+
+            det_ix, det_iy, x, y = exposure.find_positions(ras, decs)
+            found = np.flatnonzero(det_ix >= 0)
+
+            assert np.array_equal(exp_placements[PLACEMENT_OBJ_INDEX], found)
+            assert np.array_equal(exp_placements[PLACEMENT_DET_IX], det_ix[found])
+            assert np.array_equal(exp_placements[PLACEMENT_DET_IY], det_iy[found])
+            assert np.allclose(exp_placements[PLACEMENT_X], x[found])
+            assert np.allclose(exp_placements[PLACEMENT_Y], y[found])
+
+            # Each object should be on one of the detectors get_objects_in_exposure finds it on
+            inds, _, _, detectors = exposure.get_objects_in_exposure(object_coords)
+            assert set(found) == set(inds)
+            for row in exp_placements:
+                l_detectors = [tuple(d) for d in np.asarray(detectors)[inds == row[PLACEMENT_OBJ_INDEX]]]
+                assert (row[PLACEMENT_DET_IX], row[PLACEMENT_DET_IY]) in l_detectors
+
+    def test_get_objects_in_observation(self, frame_stack, object_coords):
+        """Tests that get_objects_in_observation returns the sorted, unique indices of the objects found in any
+        exposure, and optionally the placements table"""
+
+        unique_inds = frame_stack.get_objects_in_observation(object_coords)
+
+        l_expected = set()
+        for exposure in frame_stack.exposures:
+            inds, _, _, _ = exposure.get_objects_in_exposure(object_coords)
+            l_expected.update(inds.tolist())
+
+        assert np.array_equal(unique_inds, sorted(l_expected))
+
+        unique_inds_2, placements = frame_stack.get_objects_in_observation(object_coords, return_placements=True)
+
+        assert np.array_equal(unique_inds_2, unique_inds)
+        assert np.array_equal(np.unique(placements[PLACEMENT_OBJ_INDEX]), unique_inds)
+
+    def test_get_object_placements_empty(self, frame_stack, object_coords):
+        """Tests get_object_placements and get_objects_in_observation when no objects are in the observation"""
+
+        off_field_coords = object_coords[-1:]
+
+        placements = frame_stack.get_object_placements(off_field_coords)
+
+        assert len(placements) == 0
+        assert placements.colnames == PLACEMENT_COLUMNS
+
+        unique_inds, placements = frame_stack.get_objects_in_observation(off_field_coords, return_placements=True)
+
+        assert len(unique_inds) == 0
+        assert len(placements) == 0
+
+    def test_extract_stamp_stack_with_placements(self, frame_stack, object_coords):
+        """Tests that extract_stamp_stack gives the same stamps when passed an object's placements"""
+
+        placements = frame_stack.get_object_placements(object_coords)
+
+        for i in np.unique(placements[PLACEMENT_OBJ_INDEX])[:5]:
+
+            ra = object_coords[i].ra.deg
+            dec = object_coords[i].dec.deg
+
+            stamp_stack = frame_stack.extract_stamp_stack(ra, dec, width=STAMP_SIZE)
+            placed_stamp_stack = frame_stack.extract_stamp_stack(ra, dec, width=STAMP_SIZE,
+                                                                 placements=placements[
+                                                                     placements[PLACEMENT_OBJ_INDEX] == i])
+
+            for stamp, placed_stamp in zip(stamp_stack.exposures, placed_stamp_stack.exposures):
+                assert (stamp is None) == (placed_stamp is None)
+                if stamp is not None:
+                    assert placed_stamp == stamp
+
+    def test_read_concurrent(self, workdir, input_products_ccd, monkeypatch):
+        """Tests that reading the exposures concurrently gives the same frame stack, with the exposures in order"""
+
+        input_products, l_exposure_filenames = write_distinct_exposure_listfile(workdir, input_products_ccd)
+
+        original_read = SHEFrame.read
+
+        def read_and_label(frame_product_filename, **kwargs):
+            # Finish reading the later exposures first, to check that they're still returned in order
+            i = l_exposure_filenames.index(frame_product_filename)
+            time.sleep(0.05 * (len(l_exposure_filenames) - i))
+
+            frame = original_read(frame_product_filename=frame_product_filename, **kwargs)
+            frame.test_product_filename = frame_product_filename
+            return frame
+
+        monkeypatch.setattr(SHEFrame, "read", read_and_label)
+
+        serial_frame_stack = read_frame_stack(workdir, input_products)
+        concurrent_frame_stack = read_frame_stack(workdir, input_products, max_workers=2)
+
+        assert [exposure.test_product_filename for exposure in serial_frame_stack.exposures] == l_exposure_filenames
+        assert ([exposure.test_product_filename for exposure in concurrent_frame_stack.exposures] ==
+                l_exposure_filenames)
+
+        assert concurrent_frame_stack == serial_frame_stack
+
+    def test_read_concurrent_exception(self, workdir, input_products_ccd, monkeypatch):
+        """Tests that an exception raised while reading an exposure concurrently reaches the caller unchanged"""
+
+        input_products, l_exposure_filenames = write_distinct_exposure_listfile(workdir, input_products_ccd)
+
+        class MockReadError(Exception):
+            pass
+
+        error = MockReadError("Failed to read exposure")
+
+        original_read = SHEFrame.read
+
+        def read_or_raise(frame_product_filename, **kwargs):
+            if frame_product_filename == l_exposure_filenames[2]:
+                raise error
+            return original_read(frame_product_filename=frame_product_filename, **kwargs)
+
+        monkeypatch.setattr(SHEFrame, "read", read_or_raise)
+
+        with pytest.raises(MockReadError) as excinfo:
+            read_frame_stack(workdir, input_products, max_workers=2)
+
+        assert excinfo.value is error
+
+    def test_read_concurrent_unloaded(self, workdir, input_products_ccd, frame_stack, object_coords):
+        """Tests that stamps can be extracted from multiple threads from a frame stack read concurrently without
+        loading its images, which reads them through shared file handles"""
+
+        unloaded_frame_stack = read_frame_stack(workdir, input_products_ccd, load_images=False, max_workers=2)
+
+        l_inds = frame_stack.get_objects_in_observation(object_coords)
+
+        def extract(frame_stack_to_use, i):
+            return frame_stack_to_use.extract_stamp_stack(object_coords[i].ra.deg, object_coords[i].dec.deg,
+                                                          width=STAMP_SIZE)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            l_stamp_stacks = list(executor.map(lambda i: extract(unloaded_frame_stack, i), l_inds))
+
+        for i, stamp_stack in zip(l_inds, l_stamp_stacks):
+            expected_stamp_stack = extract(frame_stack, i)
+            for stamp, expected_stamp in zip(stamp_stack.exposures, expected_stamp_stack.exposures):
+                assert (stamp is None) == (expected_stamp is None)
+                if stamp is not None:
+                    assert np.array_equal(stamp.data, expected_stamp.data)
+                    assert np.array_equal(stamp.noisemap, expected_stamp.noisemap)
+
+    @pytest.mark.parametrize("prefetch", [0, 1, 100])
+    def test_iter_galaxy_stacks(self, frame_stack, prefetch):
+        """Tests that iter_galaxy_stacks gives the same stamp stacks as extract_galaxy_stack, in order"""
+
+        l_gal_ids = list(frame_stack.detections_catalogue[mfc_tf.ID][:6])[::-1]
+
+        l_stamp_stacks = list(frame_stack.iter_galaxy_stacks(l_gal_ids, STAMP_SIZE, prefetch=prefetch))
+
+        assert len(l_stamp_stacks) == len(l_gal_ids)
+        for gal_id, stamp_stack in zip(l_gal_ids, l_stamp_stacks):
+            assert stamp_stack == frame_stack.extract_galaxy_stack(gal_id, STAMP_SIZE)
+
+    def test_iter_galaxy_stacks_negative_prefetch(self, frame_stack):
+        """Tests that iter_galaxy_stacks raises a ValueError for a negative prefetch"""
+
+        l_gal_ids = list(frame_stack.detections_catalogue[mfc_tf.ID][:2])
+
+        with pytest.raises(ValueError):
+            next(frame_stack.iter_galaxy_stacks(l_gal_ids, STAMP_SIZE, prefetch=-1))
+
+    @pytest.mark.parametrize("prefetch", [0, 2])
+    def test_iter_galaxy_stacks_exception(self, frame_stack, monkeypatch, prefetch):
+        """Tests that an exception raised while extracting the stamps of one galaxy is raised at its position"""
+
+        l_gal_ids = list(frame_stack.detections_catalogue[mfc_tf.ID][:5])
+        bad_gal_id = l_gal_ids[2]
+
+        original_extract_galaxy_stack = frame_stack.extract_galaxy_stack
+
+        def extract_or_raise(gal_id, *args, **kwargs):
+            if gal_id == bad_gal_id:
+                raise KeyError(gal_id)
+            return original_extract_galaxy_stack(gal_id, *args, **kwargs)
+
+        monkeypatch.setattr(frame_stack, "extract_galaxy_stack", extract_or_raise)
+
+        gen = frame_stack.iter_galaxy_stacks(l_gal_ids, STAMP_SIZE, prefetch=prefetch)
+
+        for gal_id in l_gal_ids[:2]:
+            assert next(gen) == original_extract_galaxy_stack(gal_id, STAMP_SIZE)
+
+        with pytest.raises(KeyError):
+            next(gen)
+
+    def test_iter_galaxy_stacks_close(self, frame_stack, monkeypatch):
+        """Tests that closing the generator early stops the background thread without extracting the remaining
+        stamps"""
+
+        l_gal_ids = list(frame_stack.detections_catalogue[mfc_tf.ID])
+
+        original_extract_galaxy_stack = frame_stack.extract_galaxy_stack
+        l_extracted_ids = []
+
+        def slow_extract(gal_id, *args, **kwargs):
+            time.sleep(0.05)
+            l_extracted_ids.append(gal_id)
+            return original_extract_galaxy_stack(gal_id, *args, **kwargs)
+
+        monkeypatch.setattr(frame_stack, "extract_galaxy_stack", slow_extract)
+
+        l_threads_before = set(threading.enumerate())
+
+        gen = frame_stack.iter_galaxy_stacks(l_gal_ids, STAMP_SIZE, prefetch=2)
+        next(gen)
+
+        # Close the generator in another thread, so that the test fails rather than hangs if this doesn't return
+        closing_thread = threading.Thread(target=gen.close)
+        closing_thread.start()
+        closing_thread.join(timeout=30)
+        assert not closing_thread.is_alive()
+
+        # At most the prefetched stamps should have been extracted after the first, and the worker thread stopped
+        assert len(l_extracted_ids) <= 4 < len(l_gal_ids)
+        assert set(threading.enumerate()) <= l_threads_before
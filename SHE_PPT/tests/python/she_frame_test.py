@@ -0,0 +1,275 @@
+"""
+File: tests/python/she_frame_test.py
+
+Created on: 16/10/26
+"""
+
+__updated__ = "2026-10-16"
+
+# Copyright (C) 2012-2020 Euclid Science Ground Segment
+#
+# This library is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 3.0 of the License, or (at your option)
+# any later version.
+#
+# This library is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import gc
+import os
+import threading
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.table import Table
+from astropy.wcs import WCS
+
+from SHE_PPT.constants.fits import PSF_CAT_TAG
+from SHE_PPT.she_frame import LoadedDetectorCache, SHEFrame
+from SHE_PPT.she_image import SHEImage
+from SHE_PPT.table_formats.she_psf_model_image import tf as pstf
+from SHE_PPT.testing.utility import SheTestCase
+
+
+class TestSheFrame(SheTestCase):
+    """Unit tests for the SHEFrame class.
+    """
+
+    def post_setup(self):
+        """Write out files of detector images, and set up a frame which will load them lazily.
+        """
+
+        self.nx = 60
+        self.ny = 40
+        self.l_xy = [(1, 1), (1, 2), (2, 1), (2, 2)]
+
+        rng = np.random.default_rng(1234)
+
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        wcs.wcs.cdelt = [0.1 / 3600, 0.1 / 3600]
+
+        # Write the science image, noisemap and mask of each detector to one file, and the segmentation maps to
+        # another, stored with the astropy (y,x) convention
+        self.d_data = {}
+        self.d_seg = {}
+        data_hdulist = fits.HDUList([fits.PrimaryHDU()])
+        seg_hdulist = fits.HDUList([fits.PrimaryHDU()])
+        for xy in self.l_xy:
+            self.d_data[xy] = rng.normal(size=(self.ny, self.nx)).astype(np.float32)
+            self.d_seg[xy] = rng.integers(0, 5, size=(self.ny, self.nx), dtype=np.int64)
+            data_hdulist.append(fits.ImageHDU(self.d_data[xy]))
+            data_hdulist.append(fits.ImageHDU(np.ones((self.ny, self.nx), dtype=np.float32)))
+            data_hdulist.append(fits.ImageHDU(np.zeros((self.ny, self.nx), dtype=np.int32)))
+            seg_hdulist.append(fits.ImageHDU(self.d_seg[xy]))
+
+        self.data_filename = os.path.join(self.workdir, "test_SHEFrame_data.fits")
+        self.seg_filename = os.path.join(self.workdir, "test_SHEFrame_seg.fits")
+        data_hdulist.writeto(self.data_filename, overwrite=True)
+        seg_hdulist.writeto(self.seg_filename, overwrite=True)
+
+        self.wcs = wcs
+
+        # Budget for the images of two detectors
+        detector_nbytes = self.nx * self.ny * (4 + 4 + 4 + 8)
+        self.detector_cache = LoadedDetectorCache(max_nbytes=2 * detector_nbytes)
+
+        self.frame = self._make_lazy_frame(self.detector_cache)
+
+    def _make_lazy_frame(self, detector_cache):
+        """Sets up a frame with unloaded detectors, in the same way as SHEFrame.read with load_images="lazy".
+        """
+
+        detectors = np.ndarray((3, 3), dtype=SHEImage)
+        for xy in self.l_xy:
+            detector = SHEImage(data=None, wcs=self.wcs)
+            detector.shape = (self.nx, self.ny)
+            detectors[xy] = detector
+
+        frame = SHEFrame(detectors)
+        frame._lazy_load_images = True
+        frame._detector_cache = detector_cache
+
+        frame._data_filename = self.data_filename
+        frame._noisemap_filename = self.data_filename
+        frame._mask_filename = self.data_filename
+        frame._seg_filename = self.seg_filename
+
+        frame._d_data_hdus = {xy: 1 + 3 * i for i, xy in enumerate(self.l_xy)}
+        frame._d_noisemap_hdus = {xy: 2 + 3 * i for i, xy in enumerate(self.l_xy)}
+        frame._d_mask_hdus = {xy: 3 + 3 * i for i, xy in enumerate(self.l_xy)}
+        frame._d_seg_hdus = {xy: 1 + i for i, xy in enumerate(self.l_xy)}
+
+        return frame
+
+    def test_lazy_load_images(self):
+        """Test that stamps extracted from lazily-loaded detectors are correct, and that detectors are unloaded when
+        the cache's memory budget is exceeded.
+        """
+
+        def l_loaded():
+            return [self.frame.detectors[xy].data.size > 0 for xy in self.l_xy]
+
+        assert l_loaded() == [False, False, False, False]
+
+        for i, xy in enumerate(self.l_xy + [(2, 1), (1, 1)]):
+
+            stamp = self.frame.extract_detector_stamp(*xy, x=20.3, y=15.2, width=11)
+
+            assert np.array_equal(stamp.data, self.d_data[xy].transpose()[15:26, 10:21])
+            assert np.array_equal(stamp.segmentation_map, self.d_seg[xy].transpose()[15:26, 10:21])
+
+            # Only the two most recently used detectors should be loaded
+            assert sum(l_loaded()) == min(i + 1, 2)
+            assert self.frame.detectors[xy].data.size > 0
+            assert self.frame.detectors[xy].shape == (self.nx, self.ny)
+
+        cache_info = self.detector_cache.cache_info()
+        assert cache_info.hits == 1
+        assert cache_info.misses == 5
+        assert cache_info.n_detectors == 2
+        assert cache_info.nbytes <= cache_info.max_nbytes
+
+        # Clearing the cache should unload all detectors
+        self.detector_cache.cache_clear()
+        assert l_loaded() == [False, False, False, False]
+        assert self.frame.detectors[1, 1].shape == (self.nx, self.ny)
+
+    def test_lazy_load_images_concurrent(self):
+        """Test that a detector in use by one thread isn't unloaded, and doesn't block other threads from loading and
+        using other detectors.
+        """
+
+        xy_pinned = self.l_xy[0]
+        pinned = threading.Event()
+        release = threading.Event()
+
+        def use_detector():
+            with self.detector_cache.loaded_detector(self.frame, *xy_pinned):
+                pinned.set()
+                release.wait(timeout=30)
+
+        pinning_thread = threading.Thread(target=use_detector)
+        pinning_thread.start()
+
+        try:
+            assert pinned.wait(timeout=30)
+
+            # Extract stamps from all other detectors in another thread, which shouldn't wait on the pinned detector
+            def extract_others():
+                for xy in self.l_xy[1:]:
+                    self.frame.extract_detector_stamp(*xy, x=20.3, y=15.2, width=11)
+
+            extracting_thread = threading.Thread(target=extract_others)
+            extracting_thread.start()
+            extracting_thread.join(timeout=30)
+            assert not extracting_thread.is_alive()
+
+            # The pinned detector should still be loaded, despite being the least recently used
+            assert self.frame.detectors[xy_pinned].data.size > 0
+
+        finally:
+            release.set()
+            pinning_thread.join()
+
+    def test_lazy_load_images_deleted_frame(self):
+        """Test that detectors are dropped from the cache when their frame is deleted.
+        """
+
+        detector_cache = LoadedDetectorCache(max_nbytes=self.detector_cache.max_nbytes)
+
+        frame = self._make_lazy_frame(detector_cache)
+        for xy in self.l_xy[:2]:
+            frame.extract_detector_stamp(*xy, x=20.3, y=15.2, width=11)
+
+        assert detector_cache.cache_info().n_detectors == 2
+        assert detector_cache.cache_info().nbytes > 0
+
+        del frame
+        gc.collect()
+
+        assert detector_cache.cache_info().n_detectors == 0
+        assert detector_cache.cache_info().nbytes == 0
+
+        # The budget should now be available to another frame's detectors
+        other_frame = self._make_lazy_frame(detector_cache)
+        for xy in self.l_xy[:2]:
+            other_frame.extract_detector_stamp(*xy, x=20.3, y=15.2, width=11)
+
+        assert all(other_frame.detectors[xy].data.size > 0 for xy in self.l_xy[:2])
+
+    def test_extract_psf(self):
+        """Test that PSF stamps are read on demand from a PSF file which is kept open.
+        """
+
+        num_objects = 5
+        psf_shape = (9, 7)
+
+        l_ids = [100 + 7 * i for i in range(num_objects)]
+
+        # Write a PSF file, with the catalogue in the first extension and then the bulge and disk PSFs of each object
+        psf_cat = pstf.init_table(size=num_objects)
+        psf_cat[pstf.ID] = l_ids
+        psf_cat[pstf.bulge_index] = [2 + 2 * i for i in range(num_objects)]
+        psf_cat[pstf.disk_index] = [3 + 2 * i for i in range(num_objects)]
+
+        rng = np.random.default_rng(5678)
+        l_psf_data = [rng.uniform(size=psf_shape).astype(np.float32) for _ in range(2 * num_objects)]
+
+        psf_hdulist = fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(psf_cat, name=PSF_CAT_TAG)])
+        for psf_data in l_psf_data:
+            psf_hdulist.append(fits.ImageHDU(psf_data))
+
+        psf_filename = os.path.join(self.workdir, "test_SHEFrame_psf.fits")
+        psf_hdulist.writeto(psf_filename, overwrite=True)
+
+        with fits.open(psf_filename, memmap=True) as psf_data_hdulist:
+
+            frame = SHEFrame(self.frame.detectors,
+                             psf_data_hdulist=psf_data_hdulist,
+                             psf_catalogue=Table.read(psf_data_hdulist[1]))
+
+            for i in (3, 0, 4):
+                bulge_psf_stamp, disk_psf_stamp = frame.extract_psf(l_ids[i])
+
+                assert np.array_equal(bulge_psf_stamp.data, l_psf_data[2 * i].transpose())
+                assert np.array_equal(disk_psf_stamp.data, l_psf_data[2 * i + 1].transpose())
+
+                # The stamps should have their own, writeable copies of the data
+                assert bulge_psf_stamp.data.flags.writeable
+                assert not np.shares_memory(bulge_psf_stamp.data, psf_data_hdulist[2 * i + 2].data)
+
+                # And their own copies of the headers
+                bulge_psf_stamp.header["TESTKEY"] = 1
+                assert "TESTKEY" not in psf_data_hdulist[2 * i + 2].header
+
+            with pytest.raises(KeyError):
+                frame.extract_psf(1)
+
+            # Replacing the catalogue should invalidate the index of PSF HDUs
+            psf_cat_swapped = Table(frame.psf_catalogue)
+            psf_cat_swapped[pstf.bulge_index], psf_cat_swapped[pstf.disk_index] = (psf_cat[pstf.disk_index],
+                                                                                   psf_cat[pstf.bulge_index])
+            frame.psf_catalogue = psf_cat_swapped
+
+            bulge_psf_stamp, disk_psf_stamp = frame.extract_psf(l_ids[1])
+            assert np.array_equal(bulge_psf_stamp.data, l_psf_data[3].transpose())
+            assert np.array_equal(disk_psf_stamp.data, l_psf_data[2].transpose())
+
+            # The frame shouldn't close a PSF file it didn't open
+            frame.close()
+            assert not psf_data_hdulist._file.closed
+
+        # A frame should close a PSF file it opened (as in SHEFrame.read) when closed
+        with SHEFrame(self.frame.detectors, psf_data_hdulist=fits.open(psf_filename, memmap=True)) as frame:
+            frame._owns_psf_data_hdulist = True
+            psf_data_hdulist = frame.psf_data_hdulist
+        assert psf_data_hdulist._file.closed
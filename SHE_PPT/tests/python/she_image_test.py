@@ -41,8 +41,8 @@ from SHE_PPT.constants.fits import (CCDID_LABEL, EXPTIME_LABEL, GAIN_LABEL, OBS_
                                     ZERO_POINT_LABEL, )
 from SHE_PPT.constants.misc import SEGMAP_UNASSIGNED_VALUE
 from SHE_PPT.file_io import get_qualified_filename
-from SHE_PPT.she_image import (DETECTOR_SHAPE, D_ATTR_CONVERSIONS, D_IMAGE_DTYPES, NOISEMAP_DTYPE, PRIMARY_TAG,
-                               SEG_DTYPE, SHEImage,
+from SHE_PPT.she_image import (DETECTOR_SHAPE, D_ATTR_CONVERSIONS, D_IMAGE_DTYPES, FitsTileCache, NOISEMAP_DTYPE,
+                               PRIMARY_TAG, SEG_DTYPE, SHEImage,
                                WGT_DTYPE, )
 from SHE_PPT.testing.utility import SheTestCase
 
@@ -699,6 +699,35 @@ class TestSheImage(SheTestCase):
                                         segmentation_map_filepath=self.l_qualified_test_filenames[3],
                                         mask_ext=PRIMARY_TAG)
 
+    def test_tile_cache(self):
+        """Tests that stamps read through the tile cache match the image, and that overlapping stamps reuse tiles.
+        """
+
+        img = SHEImage(np.random.randn(300 * 200).reshape(300, 200).astype(np.float32))
+        img.write_to_fits(self.qualified_test_filename, overwrite=True)
+
+        cache = FitsTileCache(tile_size=32)
+
+        for xmin, ymin, xmax, ymax in ((0, 0, 10, 10), (5, 17, 100, 50), (250, 150, 300, 200), (31, 31, 33, 33)):
+            stamp = cache.read_stamp(xmin, ymin, xmax, ymax, self.qualified_test_filename, 0)
+            assert np.array_equal(stamp, img.data[xmin:xmax, ymin:ymax])
+
+        # Reading a stamp within tiles already read should not read any more
+        misses = cache.cache_info().misses
+        cache.read_stamp(10, 20, 40, 40, self.qualified_test_filename, 0)
+        assert cache.cache_info().misses == misses
+        assert cache.cache_info().hits > 0
+
+        # The cache should keep within its memory budget
+        tile_nbytes = 32 * 32 * 4
+        cache = FitsTileCache(max_nbytes=3 * tile_nbytes, tile_size=32)
+        stamp = cache.read_stamp(0, 0, 300, 200, self.qualified_test_filename, 0)
+        assert np.array_equal(stamp, img.data)
+        assert cache.cache_info().nbytes <= 3 * tile_nbytes
+
+        cache.cache_clear()
+        assert cache.cache_info() == (0, 0, 0, 0, 3 * tile_nbytes)
+
     def test_extracted_stamp_is_view(self):
         """Checks that the extracted stamp is a view, not a copy.
         """
@@ -1331,6 +1360,66 @@ class TestSheImage(SheTestCase):
         assert np.isclose(test_p2w_scale, p2w_scale)
         assert np.allclose((-w2p_shear.g1, -w2p_shear.g2), (test_p2w_shear.g1, test_p2w_shear.g2))
 
+    def test_wcs_approximation(self):
+        """Test that the vectorised transformations with an approximation to the WCS agree with the exact WCS.
+        """
+
+        img = SHEImage(np.zeros((400, 300)), header=self.img.header, wcs=self.wcs)
+        img_exact = SHEImage(np.zeros((400, 300)), header=self.img.header, wcs=deepcopy(self.wcs))
+
+        max_error = 1e-3
+        wcs_approximation = img.set_up_wcs_approximation(max_error=max_error)
+        assert wcs_approximation.valid
+        assert img.wcs_approximation is wcs_approximation
+
+        # Test points on and around the image, so that some use the exact WCS
+        rng = np.random.default_rng(1)
+        l_x = rng.uniform(-50, 450, 100)
+        l_y = rng.uniform(-50, 350, 100)
+
+        l_ra, l_dec = img.pix2world(l_x, l_y)
+        l_ex_ra, l_ex_dec = img_exact.pix2world(l_x, l_y)
+        l_ex_x, l_ex_y = img_exact.world2pix(l_ex_ra, l_ex_dec)
+
+        # Convert the differences to pixels with the pixel scale (~0.1 arcsec)
+        assert np.all(np.abs((l_ra - l_ex_ra) * np.cos(np.radians(l_ex_dec))) * 3600 / 0.1 < max_error)
+        assert np.all(np.abs(l_dec - l_ex_dec) * 3600 / 0.1 < max_error)
+
+        l_x_approx, l_y_approx = img.world2pix(l_ex_ra, l_ex_dec)
+        assert np.all(np.hypot(l_x_approx - l_ex_x, l_y_approx - l_ex_y) < max_error)
+
+        # Check the vectorised decompositions against the decompositions from GalSim
+        for decompositions, ex_decompositions in ((img.get_pix2world_decompositions(l_x, l_y),
+                                                   img_exact.get_pix2world_decompositions(l_x, l_y)),
+                                                  (img.get_world2pix_decompositions(l_ex_ra, l_ex_dec),
+                                                   [img_exact.get_world2pix_decomposition(ra, dec)
+                                                    for ra, dec in zip(l_ex_ra, l_ex_dec)])):
+            scale, g1, g2, theta, flip = decompositions
+            if not isinstance(ex_decompositions, tuple):
+                ex_decompositions = ([d[0] for d in ex_decompositions],
+                                     [d[1].g1 for d in ex_decompositions],
+                                     [d[1].g2 for d in ex_decompositions],
+                                     [d[2].rad for d in ex_decompositions],
+                                     [d[3] for d in ex_decompositions])
+            ex_scale, ex_g1, ex_g2, ex_theta, ex_flip = ex_decompositions
+            assert np.allclose(scale, ex_scale, rtol=1e-6)
+            assert np.allclose(g1, ex_g1, atol=1e-6)
+            assert np.allclose(g2, ex_g2, atol=1e-6)
+            assert np.allclose(theta, ex_theta, atol=1e-6)
+            assert np.all(flip == ex_flip)
+
+        # Check that stamps share the approximation, and that it is unset if the WCS is changed
+        stamp = img.extract_stamp(100.5, 200.5, 20)
+        assert stamp.wcs_approximation is wcs_approximation
+        assert np.allclose(stamp.pix2world(l_x[:5], l_y[:5]), img_exact.extract_stamp(100.5, 200.5, 20).pix2world(
+            l_x[:5], l_y[:5]), rtol=0, atol=1e-7)
+
+        with pytest.raises(ValueError):
+            img_exact.wcs_approximation = wcs_approximation
+
+        img.wcs = deepcopy(self.wcs)
+        assert img.wcs_approximation is None
+
     def test_get_objects_in_detector(self):
         """Unit test of the `get_objects_in_detector` method.
         """
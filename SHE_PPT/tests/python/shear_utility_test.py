@@ -30,9 +30,10 @@ from astropy.io import fits
 from SHE_PPT import flags as she_flags
 from SHE_PPT.constants.fits import GAIN_LABEL, SCALE_LABEL
 from SHE_PPT.she_image import SHEImage
-from SHE_PPT.shear_utility import (ShearEstimate, check_data_quality,
-                                   correct_for_wcs_shear_and_rotation,
-                                   get_g_from_e, get_galaxy_quality_flags, get_psf_quality_flags,
+from SHE_PPT.shear_utility import (ShearEstimate, check_data_quality, check_data_quality_batch,
+                                   correct_for_wcs_shear_and_rotation, correct_for_wcs_shear_and_rotation_batch,
+                                   get_g_from_e, get_galaxy_quality_flags, get_galaxy_quality_flags_batch,
+                                   get_psf_quality_flags, get_psf_quality_flags_batch,
                                    uncorrect_for_wcs_shear_and_rotation, )
 from SHE_PPT.testing.utility import SheTestCase
 
@@ -354,6 +355,69 @@ class TestCase(SheTestCase):
         assert np.isclose(shear_estimate.g1g2_covar, init_shear_estimate.g1g2_covar)
         assert np.isclose(shear_estimate.weight, init_shear_estimate.weight)
 
+    def test_correct_wcs_shear_and_rotation_batch(self):
+        """Tests that the batch correction for WCS shear and rotation gives the same results as the unbatched version.
+        """
+
+        rng = np.random.default_rng(1234)
+
+        n = 20
+
+        # Random shears, including one which is too large and one which is NaN
+        l_g1 = rng.uniform(-0.5, 0.5, n)
+        l_g2 = rng.uniform(-0.5, 0.5, n)
+        l_g1_err = rng.uniform(0.1, 0.3, n)
+        l_g2_err = rng.uniform(0.1, 0.3, n)
+        l_covar = rng.uniform(-0.01, 0.01, n)
+
+        l_g1[0] = 1.1
+        l_g1[1] = np.nan
+
+        # Random Jacobians made up of a rotation and a mild distortion, with one which is singular
+        theta = rng.uniform(-np.pi, np.pi, n)
+        rotation_matrices = np.array([[np.cos(theta), -np.sin(theta)],
+                                      [np.sin(theta), np.cos(theta)]]).transpose((2, 0, 1))
+        jacobians = (np.identity(2) + rng.uniform(-0.1, 0.1, (n, 2, 2))) @ rotation_matrices
+        jacobians[2] = 0
+
+        l_g1_corr, l_g2_corr, l_g1_err_corr, l_g2_err_corr, l_covar_corr, l_flags = \
+            correct_for_wcs_shear_and_rotation_batch(l_g1, l_g2, (l_g1_err, l_g2_err), l_covar, jacobians)
+
+        assert l_flags[0] == she_flags.flag_too_large_shear
+        assert l_flags[1] == she_flags.flag_cannot_correct_distortion
+        assert l_flags[2] == she_flags.flag_cannot_correct_distortion
+
+        for i in range(3):
+            assert np.isnan(l_g1_corr[i]) and np.isnan(l_g2_corr[i])
+            assert np.isinf(l_g1_err_corr[i]) and np.isinf(l_g2_err_corr[i]) and np.isinf(l_covar_corr[i])
+
+        # Check the rest against the unbatched version
+        for i in range(3, n):
+
+            shear_estimate = ShearEstimate(g1=l_g1[i],
+                                           g2=l_g2[i],
+                                           g1_err=l_g1_err[i],
+                                           g2_err=l_g2_err[i],
+                                           g1g2_covar=l_covar[i])
+
+            jacobian = jacobians[i]
+            wcs = galsim.AffineTransform(dudx=jacobian[0, 0], dudy=jacobian[0, 1],
+                                         dvdx=jacobian[1, 0], dvdy=jacobian[1, 1])
+            gs_header = galsim.FitsHeader()
+            wcs.writeToFitsHeader(gs_header, galsim.BoundsI(1, 1, 2, 2))
+            mock_stamp = SHEImage(data=np.zeros((1, 1)), offset=np.array((0., 0.)),
+                                  header=fits.Header(gs_header.header))
+            mock_stamp.galsim_wcs = wcs
+
+            correct_for_wcs_shear_and_rotation(shear_estimate, mock_stamp)
+
+            assert l_flags[i] == shear_estimate.flags
+            assert np.isclose(l_g1_corr[i], shear_estimate.g1, atol=1e-5)
+            assert np.isclose(l_g2_corr[i], shear_estimate.g2, atol=1e-5)
+            assert np.isclose(l_g1_err_corr[i], shear_estimate.g1_err)
+            assert np.isclose(l_g2_err_corr[i], shear_estimate.g2_err)
+            assert np.isclose(l_covar_corr[i], shear_estimate.g1g2_covar)
+
     def test_get_psf_quality_flags(self):
         """Unit test of the `get_psf_quality_flags` function.
         """
@@ -435,3 +499,62 @@ class TestCase(SheTestCase):
         # Check with corrupt stamp
         ex_corrupt_flags = she_flags.flag_corrupt_psf | she_flags.flag_corrupt_science_image
         assert check_data_quality(self.corrupt_gal_stamp, self.corrupt_psf_stamp) == ex_corrupt_flags
+
+    def test_check_data_quality_batch(self):
+        """Unit test of the `check_data_quality_batch` function, checking that it gives the same flags as
+        `check_data_quality` for each stamp.
+        """
+
+        l_gal_stamps = [deepcopy(self.gal_stamp) for _ in range(9)]
+
+        l_gal_stamps[1].data[0, 0] = -1e99
+        l_gal_stamps[2].noisemap[5, 3] = np.nan
+        l_gal_stamps[3].mask += 1
+        l_gal_stamps[4].mask[0, 0] = -1
+        l_gal_stamps[5].background_map[1, 1] = np.inf
+        l_gal_stamps[6].segmentation_map[:, :] = 0
+
+        # Invalid data which is masked out shouldn't be flagged
+        l_gal_stamps[7].data[2, 2] = np.nan
+        l_gal_stamps[7].mask[2, 2] = 1
+
+        # Segmentation map which sums to zero in the unmasked region
+        l_gal_stamps[8].segmentation_map[:, :50] = -1
+        l_gal_stamps[8].segmentation_map[:, 50:] = 1
+
+        l_psf_stamps = [deepcopy(self.psf_stamp) for _ in range(len(l_gal_stamps))]
+
+        l_psf_stamps[1].data[0, 0] = -1e99
+        l_psf_stamps[2].data[:, :] = 0
+        l_psf_stamps[3].data[4, 4] = np.nan
+
+        def _get_cube(attr, l_stamps):
+            return np.array([getattr(stamp, attr) for stamp in l_stamps])
+
+        psf_data = _get_cube("data", l_psf_stamps)
+
+        for stacked in (False, True):
+            for missing_attr in (None, "mask", "background_map", "noisemap", "segmentation_map"):
+
+                d_cubes = {attr: _get_cube(attr, l_gal_stamps)
+                           for attr in ("data", "mask", "background_map", "noisemap", "segmentation_map")}
+
+                l_test_gal_stamps = deepcopy(l_gal_stamps)
+                if missing_attr is not None:
+                    d_cubes[missing_attr] = None
+                    for stamp in l_test_gal_stamps:
+                        setattr(stamp, missing_attr, None)
+
+                flags = check_data_quality_batch(psf_data=psf_data, stacked=stacked, **d_cubes)
+                gal_flags = get_galaxy_quality_flags_batch(stacked=stacked, **d_cubes)
+
+                for i, (gal_stamp, psf_stamp) in enumerate(zip(l_test_gal_stamps, l_psf_stamps)):
+                    assert flags[i] == check_data_quality(gal_stamp, psf_stamp, stacked=stacked)
+                    assert gal_flags[i] == get_galaxy_quality_flags(gal_stamp, stacked=stacked)
+
+        # Check that we get the expected flags when data is missing for all objects
+        assert np.all(get_psf_quality_flags_batch(None, num_objects=3) == she_flags.flag_no_psf)
+        assert np.all(get_galaxy_quality_flags_batch(None, num_objects=3) == she_flags.flag_no_science_image)
+
+        with pytest.raises(ValueError):
+            check_data_quality_batch(None, None)
@@ -26,17 +26,43 @@
 import pytest
 import os
 
+from astropy.io import fits
 from astropy.table import Table
-from astropy.wcs import WCS
+from astropy.wcs import WCS, NoConvergence
 import numpy as np
 
 
-from SHE_PPT.she_io.stamps import extract_exposure_stamp, Stamp, wcs_with_buffer
+from SHE_PPT.she_io.stamps import (extract_exposure_stamp, extract_stamps_batch, get_detector_assignments, Stamp,
+                                   wcs_with_buffer)
 from SHE_PPT.she_io.vis_exposures import VisExposureAstropyFITS
 
 # NOTE the file conftest.py contains or imports the pytest fixtures used by this test
 
 
+class DivergentWCS(WCS):
+    """WCS for which all_world2pix fails to converge for positions outside the detector, as can happen with a
+    strongly distorted WCS"""
+
+    def all_world2pix(self, *args, **kwargs):
+        px, py = super().all_world2pix(*args, **kwargs)
+        nx, ny = self.pixel_shape
+        divergent = np.flatnonzero((px < 0) | (px > nx) | (py < 0) | (py > ny))
+        if len(divergent) > 0:
+            raise NoConvergence("Failed to converge", best_solution=np.stack((px, py), axis=-1),
+                                divergent=divergent, slow_conv=None)
+        return px, py
+
+
+class MockExposure(object):
+    """Stands in for a VisExposure, providing only its WCSs"""
+
+    def __init__(self, wcs_list):
+        self.wcs_list = wcs_list
+
+    def get_wcs_list(self):
+        return self.wcs_list
+
+
 class Teststamps(object):
     def test_extract_stamps(self, workdir, input_fits):
         """Tests extract_stamps"""
@@ -73,6 +99,76 @@ class Teststamps(object):
 
         assert stamp is None, "Extracted stamp from invalid coordinates, but the returned stamp was not None"
 
+    def test_extract_stamps_batch(self, workdir, input_fits):
+        """Tests that extract_stamps_batch gives the same stamps as extract_exposure_stamp"""
+
+        det, wgt, bkg, mer, _, seg = input_fits
+
+        det_file = os.path.join(workdir, "data", det)
+        wgt_file = os.path.join(workdir, "data", wgt)
+        bkg_file = os.path.join(workdir, "data", bkg)
+        seg_file = os.path.join(workdir, "data", seg)
+        mer_file = os.path.join(workdir, "data", mer)
+
+        mer_t = Table.read(mer_file)
+
+        exp = VisExposureAstropyFITS(det_file, bkg_file, wgt_file, seg_file)
+
+        # include an antipodal point that is guaranteed not to be in the observation
+        ra = np.append(mer_t["RIGHT_ASCENSION"], (mer_t[0]["RIGHT_ASCENSION"] + 180) % 360)
+        dec = np.append(mer_t["DECLINATION"], -mer_t[0]["DECLINATION"])
+
+        stamps = extract_stamps_batch(exp, ra, dec, size=200)
+
+        assert len(stamps) == len(ra), "Unexpected number of stamps returned"
+
+        assert stamps[-1] is None, "Extracted stamp from invalid coordinates, but the returned stamp was not None"
+
+        for i in range(len(ra)):
+            expected = extract_exposure_stamp(exp, ra[i], dec[i], size=200)
+
+            if expected is None:
+                assert stamps[i] is None, "Object %d should not have a stamp" % i
+                continue
+
+            assert type(stamps[i]) is Stamp, "Extracted stamp is an unexpected type"
+
+            for attr in ("sci", "rms", "flg", "wgt", "bkg", "seg"):
+                assert np.array_equal(getattr(stamps[i], attr), getattr(expected, attr)), (
+                    "Stamp attribute %s differs for object %d" % (attr, i)
+                )
+
+            assert stamps[i].wcs.to_header_string() == expected.wcs.to_header_string(), "Stamp WCS differs"
+
+    def test_get_detector_assignments_distorted(self):
+        """Tests that get_detector_assignments assigns objects to a detector with a distorted WCS, even if the
+        WCS transformation fails to converge for other objects"""
+
+        NX = 200
+        NY = 100
+
+        header = fits.Header({"NAXIS": 2, "NAXIS1": NX, "NAXIS2": NY,
+                              "CTYPE1": "RA---TPV", "CTYPE2": "DEC--TPV",
+                              "CRPIX1": NX / 2, "CRPIX2": NY / 2, "CRVAL1": 10., "CRVAL2": 20.,
+                              "CD1_1": 0.1 / 3600, "CD1_2": 0., "CD2_1": 0., "CD2_2": 0.1 / 3600,
+                              "PV1_1": 1., "PV1_4": 0.05, "PV1_7": 1e-2, "PV2_1": 1., "PV2_4": 0.03, "PV2_7": 1e-2})
+
+        wcs_list = [DivergentWCS(header), WCS(header)]
+
+        # Objects in the detector, just outside it (where the DivergentWCS fails to converge), and far off-field
+        px = np.array([20., 100.5, 180., NX + 20., 100.])
+        py = np.array([10., 50.5, 90., NY / 2, NY / 2])
+        ra, dec = wcs_list[1].all_pix2world(px, py, 0)
+        ra[-1], dec[-1] = (ra[-1] + 180) % 360, -dec[-1]
+
+        det_inds, x, y = get_detector_assignments(MockExposure(wcs_list), ra, dec)
+
+        assert np.array_equal(det_inds, [0, 0, 0, -1, -1])
+        assert np.allclose(x[:3], px[:3])
+        assert np.allclose(y[:3], py[:3])
+        assert np.all(np.isnan(x[3:]))
+        assert np.all(np.isnan(y[3:]))
+
     def test_wcs_with_buffer(self):
         """Tests wcs_with_buffer"""
 
@@ -26,6 +26,9 @@
 import pytest
 import os
 import json
+import pickle
+
+import numpy as np
 
 from SHE_PPT.she_io.vis_exposures import (
     VisExposureAstropyFITS,
@@ -33,6 +36,9 @@ from SHE_PPT.she_io.vis_exposures import (
     VisExposureHDF5,
     Detector,
     read_vis_data,
+    HEADER_CACHE_SUFFIX,
+    plan_chunked_reads,
+    read_regions,
 )
 
 # NOTE the file conftest.py contains the pytest fixtures used by this test
@@ -159,11 +165,134 @@ def verify_read_vis_data(workdir, input_products, hdf5_listfile):
         exps = read_vis_data(vis_prods=vis_prods, seg_prods=seg_prods, workdir=workdir, method="invalid method")
 
 
+def verify_header_cache(monkeypatch, exposure_class, data_filename, *args):
+    """Verifies that the headers and WCSs read from the header cache are the same as those parsed from the file"""
+
+    cache_filename = "%s.%s%s" % (data_filename, exposure_class.__name__, HEADER_CACHE_SUFFIX)
+
+    exp_uncached = exposure_class(*args)
+
+    # The first exposure with the cache enabled creates the cache, the second reads from it
+    exp_cache_write = exposure_class(*args, header_cache=True)
+    exp_cache_write.get_header_list()
+    assert os.path.exists(cache_filename), "Header cache file was not created"
+
+    exp_cache_read = exposure_class(*args, header_cache=True)
+
+    for exp in (exp_cache_write, exp_cache_read):
+        assert len(exp) == len(exp_uncached)
+        for hdr, expected_hdr in zip(exp.get_header_list(), exp_uncached.get_header_list()):
+            assert hdr == expected_hdr, "Header from the header cache differs from the parsed header"
+        for wcs, expected_wcs in zip(exp.get_wcs_list(), exp_uncached.get_wcs_list()):
+            assert wcs.to_header_string() == expected_wcs.to_header_string(), "WCS from the header cache differs"
+
+    with open(cache_filename, "rb") as f:
+        cache = pickle.load(f)
+
+    # A cache owned by another user should be ignored
+    if hasattr(os, "getuid"):
+        with open(cache_filename, "wb") as f:
+            pickle.dump(dict(cache, header_list=[]), f)
+
+        with monkeypatch.context() as m:
+            m.setattr(os, "getuid", lambda: os.stat(cache_filename).st_uid + 1)
+            exp_foreign = exposure_class(*args, header_cache=True)
+            assert len(exp_foreign) == len(exp_uncached), "Header cache owned by another user was used"
+
+    # A cache with a non-matching key should be ignored and rewritten
+    cache["key"] = None
+    cache["header_list"] = []
+    with open(cache_filename, "wb") as f:
+        pickle.dump(cache, f)
+
+    exp_stale = exposure_class(*args, header_cache=True)
+    assert len(exp_stale) == len(exp_uncached), "Stale header cache was used"
+
+    os.remove(cache_filename)
+
+
 class Testvis_exposures(object):
     def testExposures(self, workdir, input_fits, input_hdf5, num_detectors):
         """Tests the Exposure classes"""
         verify_all_exposure_types(workdir, input_fits, input_hdf5, num_detectors, quadrants=False)
 
+    def test_header_cache(self, workdir, input_fits, input_hdf5, monkeypatch):
+        """Tests the header/WCS cache of the Exposure classes"""
+
+        det, wgt, bkg, _, _, seg = input_fits
+
+        det_file = os.path.join(workdir, "data", det)
+        wgt_file = os.path.join(workdir, "data", wgt)
+        bkg_file = os.path.join(workdir, "data", bkg)
+        seg_file = os.path.join(workdir, "data", seg)
+        hdf5_file = os.path.join(workdir, input_hdf5)
+
+        verify_header_cache(monkeypatch, VisExposureAstropyFITS, det_file, det_file, bkg_file, wgt_file, seg_file)
+        verify_header_cache(monkeypatch, VisExposureFitsIO, det_file, det_file, bkg_file, wgt_file, seg_file)
+        verify_header_cache(monkeypatch, VisExposureHDF5, hdf5_file, hdf5_file)
+
+        # The astropy and fitsio classes read the same data file, but must not share a cache file
+        exp_astropy = VisExposureAstropyFITS(det_file, bkg_file, wgt_file, seg_file, header_cache=True)
+        exp_fitsio = VisExposureFitsIO(det_file, bkg_file, wgt_file, seg_file, header_cache=True)
+        assert exp_astropy.header_cache_filename != exp_fitsio.header_cache_filename
+
+    def test_zero_copy(self, workdir, input_fits):
+        """Tests that the zero-copy (memory mapped) mode of VisExposureAstropyFITS gives the same data"""
+
+        det, wgt, bkg, _, _, seg = input_fits
+
+        fits_files = [os.path.join(workdir, "data", f) for f in (det, bkg, wgt, seg)]
+
+        exp = VisExposureAstropyFITS(*fits_files)
+
+        for native_endian in (False, True):
+            exp_zero_copy = VisExposureAstropyFITS(*fits_files, zero_copy=True, native_endian=native_endian)
+
+            for i in range(len(exp)):
+                assert exp_zero_copy[i] == exp[i], "Zero-copy detector differs from the default detector"
+
+                stamp = exp_zero_copy[i].sci[:10, :10]
+                assert stamp.dtype.isnative is native_endian
+
+            if not native_endian:
+                assert not exp_zero_copy[0].sci.flags.owndata, "Zero-copy detector data is a copy"
+
+    def test_chunked_reads(self, workdir, input_hdf5):
+        """Tests the chunk-aware reading of regions from an HDF5 exposure with both chunk cache policies"""
+
+        hdf5_file = os.path.join(workdir, input_hdf5)
+
+        with pytest.raises(ValueError):
+            VisExposureHDF5(hdf5_file, chunk_cache_policy="invalid policy")
+
+        rng = np.random.default_rng(1)
+
+        for chunk_cache_policy in ("fixed", "auto"):
+            exp = VisExposureHDF5(hdf5_file, chunk_cache_policy=chunk_cache_policy)
+            sci = exp[0].sci
+            ny, nx = sci.shape
+
+            regions = []
+            for _ in range(50):
+                y0, x0 = rng.integers(0, ny - 1), rng.integers(0, nx - 1)
+                regions.append((slice(y0, min(y0 + 40, ny)), slice(x0, min(x0 + 40, nx))))
+
+            # every region must be read from exactly one block that contains it
+            blocks = plan_chunked_reads(regions, sci.dataset.chunks, sci.shape, sci.dtype.itemsize)
+            assert sorted(i for _, inds in blocks for i in inds) == list(range(len(regions)))
+            for (block_ys, block_xs), inds in blocks:
+                for i in inds:
+                    ys, xs = regions[i]
+                    assert block_ys.start <= ys.start and ys.stop <= block_ys.stop
+                    assert block_xs.start <= xs.start and xs.stop <= block_xs.stop
+
+            full_data = sci[:, :]
+            for region, data in zip(regions, read_regions(sci, regions)):
+                assert np.array_equal(data, full_data[region]), "Region read by read_regions is incorrect"
+
+            if chunk_cache_policy == "auto":
+                assert sci.max_read_height == ny, "Chunk cache was not resized after reading the full detector"
+
     def test_read_vis_data(self, workdir, input_products, hdf5_listfile):
         """Tests read_vis_exposures"""
         verify_read_vis_data(workdir, input_products, hdf5_listfile)